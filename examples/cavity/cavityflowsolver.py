@@ -383,19 +383,18 @@ class CavityFlowSolver(flowsolver.FlowSolver):
 
         return {"bcu": bcu, "bcp": bcp}
 
-    def _steady_state_default_initial_guess(self) -> dolfin.UserExpression:
-        class default_initial_guess(dolfin.UserExpression):
-            def eval(self, value, x):
-                value[0] = 1.0
-                value[1] = 0.0
-                value[2] = 0.0
-                if x[1] <= 0:  # inside cavity
-                    value[0] = 0.0
-
-            def value_shape(self):
-                return (3,)
-
-        return default_initial_guess()
+    def _default_steady_state_initial_guess(self) -> dolfin.Function:
+        def u_guess(x):
+            return np.where(x[:, 1] <= 0, 0.0, 1.0)  # zero inside cavity
+
+        return flu.interpolate_numpy(
+            [
+                u_guess,
+                lambda x: np.zeros(x.shape[0]),
+                lambda x: np.zeros(x.shape[0]),
+            ],
+            self.W,
+        )
 
 
 ###############################################################################
@@ -495,7 +494,7 @@ if __name__ == "__main__":
 
     logger.info("Step several times")
     for _ in range(fs.params_time.num_steps):
-        y_meas = flu.MpiUtils.mpi_broadcast(fs.y_meas)
+        y_meas = flu.MpiUtils.mpi_broadcast(fs.y_meas, comm=fs.comm)
         u_ctrl = [0.3 + 0.1 * y_meas[0]]
         fs.step(u_ctrl=u_ctrl)
 
@@ -0,0 +1,129 @@
+"""
+Check the measurement matrix C of OperatorGetter (computed from the linear
+functional of each sensor) against brute-force evaluation of the sensors on
+each DOF, on a tiny mesh of the cavity channel with a point and an integral sensor,
+for Taylor-Hood (P2-P1) and stabilized equal-order (P1-P1) elements.
+See OperatorGetter.check_C.
+----------------------------------------------------------------------
+"""
+
+import time
+import logging
+from pathlib import Path
+
+import dolfin
+import numpy as np
+
+import flowsolverparameters
+from operatorgetter import OperatorGetter
+from sensor import SensorHorizontalWallShear, SensorPoint, SENSOR_TYPE
+from actuator import ActuatorForceGaussianV
+from cavityflowsolver import CavityFlowSolver
+
+# LOG
+dolfin.set_log_level(dolfin.LogLevel.WARNING)
+logger = logging.getLogger(__name__)
+FORMAT = "[%(asctime)s %(filename)s->%(funcName)s():%(lineno)s]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+
+def make_tiny_mesh(meshpath: Path, xinfa: float, xinf: float, yinf: float) -> None:
+    """Write a coarse rectangular mesh of the channel above the cavity (the cavity
+    itself is left out: its boundaries are simply not marked), small enough for
+    brute-force computation of C.
+
+    Args:
+        meshpath (Path): path of xdmf mesh file
+        xinfa (float): inlet abscissa
+        xinf (float): outlet abscissa
+        yinf (float): height of upper wall
+    """
+    mesh = dolfin.RectangleMesh(
+        dolfin.MPI.comm_world,
+        dolfin.Point(xinfa, 0.0),
+        dolfin.Point(xinf, yinf),
+        37,
+        5,
+    )
+    with dolfin.XDMFFile(dolfin.MPI.comm_world, str(meshpath)) as fm:
+        fm.write(mesh)
+
+
+def make_flowsolver(cwd: Path, meshpath: Path, is_equal_order: bool):
+    """Cavity FlowSolver on tiny mesh with a point sensor and a wall shear sensor
+
+    Args:
+        cwd (Path): path of the example directory
+        meshpath (Path): path of xdmf mesh file
+        is_equal_order (bool): use stabilized P1-P1 if True, else Taylor-Hood P2-P1
+
+    Returns:
+        CavityFlowSolver: flow solver
+    """
+    params_flow = flowsolverparameters.ParamFlow(Re=7500, uinf=1.0)
+    params_flow.user_data["L"] = 1.0
+    params_flow.user_data["D"] = 1.0
+    params_time = flowsolverparameters.ParamTime(num_steps=1, dt=0.0004, Tstart=0.0)
+    params_save = flowsolverparameters.ParamSave(
+        save_every=0, path_out=cwd / "data_output"
+    )
+    params_solver = flowsolverparameters.ParamSolver(
+        throw_error=True, is_eq_nonlinear=True, is_equal_order=is_equal_order
+    )
+    params_mesh = flowsolverparameters.ParamMesh(meshpath=meshpath)
+    params_mesh.user_data["xinf"] = 2.5
+    params_mesh.user_data["xinfa"] = -1.2
+    params_mesh.user_data["yinf"] = 0.5
+    params_mesh.user_data["x0ns_left"] = -0.4
+    params_mesh.user_data["x0ns_right"] = 1.75
+    params_restart = flowsolverparameters.ParamRestart()
+
+    actuator_force = ActuatorForceGaussianV(
+        sigma=0.0849, position=np.array([-0.1, 0.02])
+    )
+    sensor_point = SensorPoint(
+        sensor_type=SENSOR_TYPE.V, position=np.array([1.53, 0.21])
+    )
+    sensor_shear = SensorHorizontalWallShear(
+        sensor_index=100,
+        x_sensor_left=1.0,
+        x_sensor_right=1.1,
+        y_sensor=0.0,
+        sensor_type=SENSOR_TYPE.OTHER,
+    )
+    params_control = flowsolverparameters.ParamControl(
+        sensor_list=[sensor_point, sensor_shear],
+        actuator_list=[actuator_force],
+    )
+    params_ic = flowsolverparameters.ParamIC(
+        xloc=2.0, yloc=0.0, radius=0.5, amplitude=1.0
+    )
+
+    return CavityFlowSolver(
+        params_flow=params_flow,
+        params_time=params_time,
+        params_save=params_save,
+        params_solver=params_solver,
+        params_mesh=params_mesh,
+        params_restart=params_restart,
+        params_control=params_control,
+        params_ic=params_ic,
+        verbose=0,
+    )
+
+
+if __name__ == "__main__":
+    t000 = time.time()
+    cwd = Path(__file__).parent
+    meshpath = cwd / "data_output" / "cavity_tiny.xdmf"
+    meshpath.parent.mkdir(parents=True, exist_ok=True)
+    make_tiny_mesh(meshpath, xinfa=-1.2, xinf=2.5, yinf=0.5)
+
+    for is_equal_order in [False, True]:
+        fs = make_flowsolver(cwd, meshpath, is_equal_order=is_equal_order)
+        logger.info(f"Checking C with is_equal_order={is_equal_order}...")
+        logger.info(f"Number of DOFs: {fs.W.dim()}")
+        assert OperatorGetter(fs).check_C(rtol=1e-8), "C differs from brute force"
+
+    logger.info("C is consistent with brute force")
+    logger.info(f"Total elapsed: {time.time() - t000}")
@@ -0,0 +1,123 @@
+"""
+Compute the steady state of the flow over an open cavity at Re=7500 on the coarse
+mesh, transfer it to the fine mesh with FieldTransfer, and use it as initial guess
+of the Newton method on the fine mesh.
+The script may be run in parallel (e.g. mpirun -n 4), both meshes being
+partitioned independently (see FieldTransfer).
+----------------------------------------------------------------------
+"""
+
+import time
+import logging
+from pathlib import Path
+
+import dolfin
+import numpy as np
+
+import flowsolverparameters
+from fieldtransfer import FieldTransfer
+from sensor import SensorHorizontalWallShear, SENSOR_TYPE
+from actuator import ActuatorForceGaussianV
+from cavityflowsolver import CavityFlowSolver
+
+# LOG
+dolfin.set_log_level(dolfin.LogLevel.WARNING)
+logger = logging.getLogger(__name__)
+FORMAT = "[%(asctime)s %(filename)s->%(funcName)s():%(lineno)s]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+
+def make_flowsolver(cwd: Path, meshname: str) -> CavityFlowSolver:
+    """Cavity FlowSolver at Re=7500 on given mesh (default feedback configuration)
+
+    Args:
+        cwd (Path): path of the example directory
+        meshname (str): name of mesh in data_input/ (e.g. cavity_coarse)
+
+    Returns:
+        CavityFlowSolver: flow solver
+    """
+    params_flow = flowsolverparameters.ParamFlow(Re=7500, uinf=1.0)
+    params_flow.user_data["L"] = 1.0
+    params_flow.user_data["D"] = 1.0
+    params_time = flowsolverparameters.ParamTime(num_steps=10, dt=0.0004, Tstart=0.0)
+    params_save = flowsolverparameters.ParamSave(
+        save_every=0, path_out=cwd / "data_output" / meshname
+    )
+    params_solver = flowsolverparameters.ParamSolver(
+        throw_error=True, is_eq_nonlinear=True, shift=0.0
+    )
+    params_mesh = flowsolverparameters.ParamMesh(
+        meshpath=cwd / "data_input" / f"{meshname}.xdmf"
+    )
+    params_mesh.user_data["xinf"] = 2.5
+    params_mesh.user_data["xinfa"] = -1.2
+    params_mesh.user_data["yinf"] = 0.5
+    params_mesh.user_data["x0ns_left"] = -0.4
+    params_mesh.user_data["x0ns_right"] = 1.75
+    params_restart = flowsolverparameters.ParamRestart()
+
+    actuator_force = ActuatorForceGaussianV(
+        sigma=0.0849, position=np.array([-0.1, 0.02])
+    )
+    sensor_feedback = SensorHorizontalWallShear(
+        sensor_index=100,
+        x_sensor_left=1.0,
+        x_sensor_right=1.1,
+        y_sensor=0.0,
+        sensor_type=SENSOR_TYPE.OTHER,
+    )
+    params_control = flowsolverparameters.ParamControl(
+        sensor_list=[sensor_feedback],
+        actuator_list=[actuator_force],
+    )
+    params_ic = flowsolverparameters.ParamIC(
+        xloc=2.0, yloc=0.0, radius=0.5, amplitude=1.0
+    )
+
+    return CavityFlowSolver(
+        params_flow=params_flow,
+        params_time=params_time,
+        params_save=params_save,
+        params_solver=params_solver,
+        params_mesh=params_mesh,
+        params_restart=params_restart,
+        params_control=params_control,
+        params_ic=params_ic,
+        verbose=0,
+    )
+
+
+if __name__ == "__main__":
+    t000 = time.time()
+    cwd = Path(__file__).parent
+    uctrl0 = [0.0]
+
+    logger.info("Steady state on coarse mesh...")
+    fs_coarse = make_flowsolver(cwd, "cavity_coarse")
+    t0 = time.time()
+    fs_coarse.compute_steady_state(method="picard", max_iter=3, tol=1e-7, u_ctrl=uctrl0)
+    fs_coarse.compute_steady_state(
+        method="newton", max_iter=25, u_ctrl=uctrl0, initial_guess=fs_coarse.fields.UP0
+    )
+    logger.info(f"Coarse steady state ({fs_coarse.W.dim()} DOFs): {time.time() - t0}")
+
+    logger.info("Steady state on fine mesh, seeded with coarse steady state...")
+    fs_fine = make_flowsolver(cwd, "cavity_fine")
+    t0 = time.time()
+    transfer = FieldTransfer(fs_from=fs_coarse, fs_to=fs_fine)
+    initial_guess = transfer.transfer_steady_state()
+    logger.info(f"Transfer: {time.time() - t0}")
+    UP0_transferred = initial_guess.copy(deepcopy=True)  # Newton works in place
+
+    t0 = time.time()
+    fs_fine.compute_steady_state(
+        method="newton", max_iter=25, u_ctrl=uctrl0, initial_guess=initial_guess
+    )
+    logger.info(f"Fine steady state ({fs_fine.W.dim()} DOFs): {time.time() - t0}")
+
+    # distance between transferred and converged steady states (collective norms)
+    diff = fs_fine.fields.UP0.vector() - UP0_transferred.vector()
+    rel_diff = diff.norm("l2") / fs_fine.fields.UP0.vector().norm("l2")
+    logger.info(f"Relative distance of transferred guess to steady state: {rel_diff}")
+    logger.info(f"Total elapsed: {time.time() - t000}")
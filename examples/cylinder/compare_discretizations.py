@@ -0,0 +1,230 @@
+"""
+Compare Taylor-Hood (P2-P1) and stabilized equal-order (P1-P1) discretizations
+on the flow past a cylinder at Re=100.
+
+For each discretization, report the number of DOFs, the steady lift/drag
+coefficients, the runtime of time-stepping, the Strouhal number of vortex shedding
+and the lift coefficient time series (written as csv in data_output/), as well as
+the relative errors of P1-P1 with respect to the P2-P1 reference (err_* columns
+of data_output/discretization_summary.csv). Lift statistics are computed after the
+transient (second half of the series), and the lift time series are compared up
+to a time shift, since shedding phases drift apart between discretizations.
+See ParamSolver.is_equal_order and FlowSolver._make_stabilization.
+----------------------------------------------------------------------
+"""
+
+import time
+import logging
+from pathlib import Path
+
+import dolfin
+import numpy as np
+import pandas as pd
+
+import flowsolverparameters
+import utils_flowsolver as flu
+from sensor import SensorPoint, SENSOR_TYPE
+from actuator import ActuatorBCParabolicV
+from cylinderflowsolver import CylinderFlowSolver
+
+# LOG
+dolfin.set_log_level(dolfin.LogLevel.WARNING)
+logger = logging.getLogger(__name__)
+FORMAT = "[%(asctime)s %(filename)s->%(funcName)s():%(lineno)s]: %(message)s"
+logging.basicConfig(format=FORMAT, level=logging.INFO)
+
+
+def compute_strouhal(t: np.ndarray, cl: np.ndarray, D: float, uinf: float) -> float:
+    """Compute Strouhal number St = f*D/uinf from the dominant frequency of the
+    lift coefficient, on the second half of the time series (after the transient).
+
+    Args:
+        t (np.ndarray): time
+        cl (np.ndarray): lift coefficient
+        D (float): cylinder diameter
+        uinf (float): free-stream velocity
+
+    Returns:
+        float: Strouhal number
+    """
+    cl = cl[len(cl) // 2 :]
+    dt = t[1] - t[0]
+    spectrum = np.abs(np.fft.rfft(cl - np.mean(cl)))
+    freq = np.fft.rfftfreq(len(cl), d=dt)
+    return freq[np.argmax(spectrum)] * D / uinf
+
+
+def phase_aligned_error(cl_ref: np.ndarray, cl: np.ndarray, max_lag: int) -> float:
+    """Relative L2 error between two lift time series after time-shifting cl to
+    best match cl_ref (shedding phases drift apart between discretizations), on
+    the second half of the series.
+
+    Args:
+        cl_ref (np.ndarray): reference lift coefficient
+        cl (np.ndarray): lift coefficient
+        max_lag (int): largest shift (in time steps), e.g. one shedding period
+
+    Returns:
+        float: relative error for the best shift
+    """
+    cl_ref = cl_ref[len(cl_ref) // 2 :]
+    cl = cl[len(cl) // 2 :]
+    n = len(cl_ref) - max_lag
+    errors = [
+        np.linalg.norm(cl[lag : lag + n] - cl_ref[:n]) / np.linalg.norm(cl_ref[:n])
+        for lag in range(max_lag + 1)
+    ] + [
+        np.linalg.norm(cl[:n] - cl_ref[lag : lag + n]) / np.linalg.norm(cl_ref[:n])
+        for lag in range(1, max_lag + 1)
+    ]
+    return min(errors)
+
+
+def run_discretization(is_equal_order: bool, cwd: Path, num_steps: int, dt: float):
+    """Run steady state + time-stepping on the cylinder with given discretization.
+
+    Args:
+        is_equal_order (bool): use stabilized P1-P1 if True, else Taylor-Hood P2-P1
+        cwd (Path): path of the example directory
+        num_steps (int): number of time steps
+        dt (float): time step
+
+    Returns:
+        dict: summary (DOFs, steady cl/cd, runtime, final cl, St) and lift time series
+    """
+    name = "P1P1" if is_equal_order else "P2P1"
+
+    params_flow = flowsolverparameters.ParamFlow(Re=100, uinf=1.0)
+    params_flow.user_data["D"] = 1.0
+    params_time = flowsolverparameters.ParamTime(num_steps=num_steps, dt=dt, Tstart=0.0)
+    params_save = flowsolverparameters.ParamSave(
+        save_every=0, path_out=cwd / "data_output" / name
+    )
+    params_solver = flowsolverparameters.ParamSolver(
+        throw_error=True, is_eq_nonlinear=True, shift=0.0, is_equal_order=is_equal_order
+    )
+    params_mesh = flowsolverparameters.ParamMesh(
+        meshpath=cwd / "data_input" / "o1.xdmf"
+    )
+    params_mesh.user_data["xinf"] = 20
+    params_mesh.user_data["xinfa"] = -10
+    params_mesh.user_data["yinf"] = 10
+    params_restart = flowsolverparameters.ParamRestart()
+
+    actuator_bc_1 = ActuatorBCParabolicV(angular_size_deg=10)
+    actuator_bc_2 = ActuatorBCParabolicV(angular_size_deg=10)
+    sensor_feedback = SensorPoint(sensor_type=SENSOR_TYPE.V, position=np.array([3, 0]))
+    params_control = flowsolverparameters.ParamControl(
+        sensor_list=[sensor_feedback],
+        actuator_list=[actuator_bc_1, actuator_bc_2],
+    )
+    params_ic = flowsolverparameters.ParamIC(
+        xloc=2.0, yloc=0.0, radius=0.5, amplitude=1.0
+    )
+
+    fs = CylinderFlowSolver(
+        params_flow=params_flow,
+        params_time=params_time,
+        params_save=params_save,
+        params_solver=params_solver,
+        params_mesh=params_mesh,
+        params_restart=params_restart,
+        params_control=params_control,
+        params_ic=params_ic,
+        verbose=0,
+    )
+
+    uctrl0 = [0.0, 0.0]
+    fs.compute_steady_state(method="picard", max_iter=3, tol=1e-7, u_ctrl=uctrl0)
+    fs.compute_steady_state(
+        method="newton", max_iter=25, u_ctrl=uctrl0, initial_guess=fs.fields.UP0
+    )
+
+    fs.initialize_time_stepping(ic=None)
+
+    cl = np.zeros(num_steps)
+    t0 = time.time()
+    for i in range(num_steps):
+        fs.step(u_ctrl=uctrl0)
+        cl[i], _ = fs.compute_force_coefficients(
+            fs.fields.U0 + fs.fields.u_, fs.fields.P0 + fs.fields.p_
+        )
+    runtime = time.time() - t0
+
+    tt = fs.timeseries["time"].to_numpy()[1:]
+    lift = pd.DataFrame({"time": tt, "cl": cl})
+
+    return {
+        "discretization": name,
+        "ndof": fs.W.dim(),
+        "cl0": fs.cl0,
+        "cd0": fs.cd0,
+        "runtime": runtime,
+        "runtime_per_step": runtime / num_steps,
+        "cl_final": cl[-1],
+        # after the transient, as compute_strouhal
+        "cl_rms": np.sqrt(np.mean(cl[num_steps // 2 :] ** 2)),
+        "cl_amplitude": np.ptp(cl[num_steps // 2 :]) / 2,
+        "St": compute_strouhal(
+            tt, cl, D=params_flow.user_data["D"], uinf=params_flow.uinf
+        ),
+    }, lift
+
+
+if __name__ == "__main__":
+    t000 = time.time()
+    cwd = Path(__file__).parent
+
+    # long enough for vortex shedding to develop (t=100) for Strouhal number
+    num_steps = 20000
+    dt = 0.005
+
+    summary = []
+    lifts = dict()
+    for is_equal_order in [False, True]:
+        logger.info(f"Running with is_equal_order={is_equal_order}...")
+        res, lift = run_discretization(
+            is_equal_order=is_equal_order, cwd=cwd, num_steps=num_steps, dt=dt
+        )
+        summary.append(res)
+        lifts[res["discretization"]] = lift
+
+    summary = pd.DataFrame(summary)
+    # relative errors with respect to P2P1 (cl0 is 0 by symmetry)
+    for coef in ["cd0", "cl_rms", "cl_amplitude", "St"]:
+        ref_coef = summary[coef][0]
+        summary[f"err_{coef}"] = np.abs(summary[coef] - ref_coef) / max(
+            abs(ref_coef), np.finfo(float).eps
+        )
+    # lift signals compared up to a time shift of at most one shedding period
+    period_steps = int(np.ceil(1 / (summary["St"][0] * dt)))
+    summary["err_cl_aligned"] = [
+        0.0,
+        phase_aligned_error(
+            lifts["P2P1"]["cl"].to_numpy(),
+            lifts["P1P1"]["cl"].to_numpy(),
+            max_lag=period_steps,
+        ),
+    ]
+
+    if flu.MpiUtils.get_rank() == 0:
+        summary.to_csv(cwd / "data_output" / "discretization_summary.csv", index=False)
+        for name, lift in lifts.items():
+            lift.to_csv(cwd / "data_output" / f"lift_{name}.csv", index=False)
+
+    logger.info(f"\n{summary}")
+    ref, eq = summary.iloc[0], summary.iloc[1]
+    logger.info(
+        f"Relative L2 error on phase-aligned cl(t) (P1P1 vs P2P1): "
+        f"{eq['err_cl_aligned']}"
+    )
+    for coef in ["cd0", "cl_rms", "cl_amplitude", "St"]:
+        logger.info(
+            f"{coef}: P2P1={ref[coef]:.4f}, P1P1={eq[coef]:.4f}, "
+            f"relative error={eq[f'err_{coef}']:.2e}"
+        )
+    logger.info(
+        f"DOF ratio: {summary.ndof[0] / summary.ndof[1]:.2f}, "
+        f"speedup per step: {summary.runtime_per_step[0] / summary.runtime_per_step[1]:.2f}"
+    )
+    logger.info(f"Total elapsed: {time.time() - t000}")
@@ -302,7 +302,7 @@ if __name__ == "__main__":
     Kss = Controller.from_file(file=cwd / "data_input" / "Kopt_reduced13.mat", x0=0)
 
     for _ in range(fs.params_time.num_steps):
-        y_meas = flu.MpiUtils.mpi_broadcast(fs.y_meas)
+        y_meas = flu.MpiUtils.mpi_broadcast(fs.y_meas, comm=fs.comm)
         u_ctrl = Kss.step(y=-y_meas[0], dt=fs.params_time.dt)
         fs.step(u_ctrl=[u_ctrl[0], u_ctrl[0]])
         # or
@@ -340,7 +340,7 @@ if __name__ == "__main__":
     fs_restart.initialize_time_stepping(Tstart=fs_restart.params_time.Tstart)
 
     for _ in range(fs_restart.params_time.num_steps):
-        y_meas = flu.MpiUtils.mpi_broadcast(fs_restart.y_meas)
+        y_meas = flu.MpiUtils.mpi_broadcast(fs_restart.y_meas, comm=fs_restart.comm)
         u_ctrl = Kss.step(y=-y_meas[0], dt=fs_restart.params_time.dt)
         fs_restart.step(u_ctrl=np.repeat(u_ctrl, repeats=2, axis=0))
 
@@ -4,6 +4,10 @@ import numpy as np
 from pathlib import Path
 import utils_flowsolver as flu
 import youla_utils as yu
+import logging
+import weakref
+
+logger = logging.getLogger(__name__)
 
 
 class Controller(control.StateSpace):
@@ -13,6 +17,7 @@ class Controller(control.StateSpace):
     attributes:
       * the _file_ from which a Controller was read,
       * the Controller internal state _x_.
+    Zero-order hold discretizations used for stepping are cached by time step.
     """
 
     def __init__(
@@ -41,6 +46,7 @@ class Controller(control.StateSpace):
         self.x = x0
         if x0 is None:
             self.x = np.zeros((self.nstates,))
+        self._zoh = dict()
 
     @classmethod
     def from_file(cls, file: Path = None, x0: np.ndarray | None = None) -> Controller:
@@ -88,10 +94,26 @@ class Controller(control.StateSpace):
         """
         return cls(A, B, C, D, x0=x0, file=file)
 
+    def discretize(self, dt: float) -> tuple[np.ndarray, np.ndarray]:
+        """Return zero-order hold discretization (Ad, Bd) of Controller
+        on time step dt, computed once per dt (see flu.c2d_zoh).
+
+        Args:
+            dt (float): Time step.
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: discrete-time matrices Ad, Bd.
+        """
+        if dt not in self._zoh:
+            self._zoh[dt] = flu.c2d_zoh(self.A, self.B, dt)
+        return self._zoh[dt]
+
     def step(self, y: float, dt: float) -> np.ndarray:
         """Simulate Controller from its current state self.x on the
         time interval [0, dt] with input y, to produce a control
         output u. MIMO-compatible.
+        Input y is held constant on [0, dt] (zero-order hold), so that the
+        simulation is exact: u = C x + D y, then x <- Ad x + Bd y.
 
         Args:
             y (np.ndarray): Controller input (e.g. Plant output).
@@ -100,13 +122,11 @@ class Controller(control.StateSpace):
         Returns:
             np.ndarray: control output u.
         """
-        y_rep = np.repeat(np.atleast_2d(y), repeats=2, axis=0).T
-        Tsim = [0, dt]
-        _, yout, xout = control.forced_response(
-            self, U=y_rep, T=Tsim, X0=self.x, interpolate=False, return_x=True
-        )
-        u = np.atleast_2d(yout)[:, 0]
-        self.x = xout[:, 1]
+        Ad, Bd = self.discretize(dt)
+        y = np.atleast_1d(np.asarray(y, dtype=float)).ravel()
+        x = np.broadcast_to(np.asarray(self.x, dtype=float), (self.nstates,))
+        u = self.C @ x + self.D @ y
+        self.x = Ad @ x + Bd @ y
         return u
 
     def __add__(self, other: Controller) -> Controller:
@@ -164,6 +184,219 @@ class Controller(control.StateSpace):
         return K
 
 
+class ControllerBank:
+    """Bank of K continuous-time controllers of equal order, simulated at once.
+
+    Controllers are discretized with zero-order hold on time step dt
+    (see Controller.discretize) and stored as stacked arrays:
+    Ad (K, n, n), Bd (K, n, ny), C (K, nu, n), D (K, nu, ny), so that
+    all internal states x (K, n) are advanced with batched mat-vecs.
+    Inputs may be shared by all controllers (y of shape (ny,), e.g. screening
+    on recorded measurements) or specific to each controller (y of shape (K, ny),
+    e.g. ensemble of plants).
+    """
+
+    def __init__(
+        self,
+        controllers: list[control.StateSpace],
+        dt: float,
+        x0: np.ndarray | None = None,
+    ):
+        """Initialize ControllerBank from list of controllers, with given time step.
+
+        Args:
+            controllers (list[control.StateSpace]): controllers of equal order and
+                dimensions (e.g. Controller, or youla_utils.youla output).
+            dt (float): Time step for discretization.
+            x0 (np.ndarray | None, optional): Internal states (K, n). Defaults to
+                states of Controller instances, or 0.
+        """
+        shapes = {(K.nstates, K.ninputs, K.noutputs) for K in controllers}
+        if len(shapes) != 1:
+            raise ValueError(
+                f"Controllers in bank must have equal order and dimensions: {shapes}"
+            )
+        self.controllers = list(controllers)
+        self.dt = dt
+        zoh = [
+            K.discretize(dt) if isinstance(K, Controller) else flu.c2d_zoh(K.A, K.B, dt)
+            for K in controllers
+        ]
+        self.Ad = np.stack([Ad for Ad, _ in zoh])
+        self.Bd = np.stack([Bd for _, Bd in zoh])
+        self.C = np.stack([np.asarray(K.C, dtype=float) for K in controllers])
+        self.D = np.stack([np.asarray(K.D, dtype=float) for K in controllers])
+        self.nbank, self.nstates, self.ninputs = self.Bd.shape
+        self.noutputs = self.C.shape[1]
+
+        if x0 is None:
+            x0 = [
+                K.x if isinstance(K, Controller) else np.zeros((self.nstates,))
+                for K in controllers
+            ]
+        self.x = self._broadcast(x0, self.nstates)
+
+    def __len__(self) -> int:
+        return self.nbank
+
+    def _broadcast(self, v: np.ndarray, dim: int) -> np.ndarray:
+        """Broadcast shared vector (dim,) or stacked vectors to (K, dim)"""
+        return np.array(np.broadcast_to(np.asarray(v, dtype=float), (self.nbank, dim)))
+
+    def step(self, y: np.ndarray) -> np.ndarray:
+        """Simulate all controllers on one time step with input y held
+        constant (see Controller.step): u = C x + D y, then x <- Ad x + Bd y.
+
+        Args:
+            y (np.ndarray): Controllers input, shared (ny,) or per controller (K, ny).
+
+        Returns:
+            np.ndarray: control outputs u (K, nu).
+        """
+        y = self._broadcast(np.reshape(y, (-1, self.ninputs)), self.ninputs)
+        u = np.einsum("kij,kj->ki", self.C, self.x) + np.einsum("kij,kj->ki", self.D, y)
+        self.x = np.einsum("kij,kj->ki", self.Ad, self.x) + np.einsum(
+            "kij,kj->ki", self.Bd, y
+        )
+        return u
+
+    def simulate_closed_loop(
+        self,
+        G: control.StateSpace,
+        num_steps: int,
+        xG0: np.ndarray | None = None,
+        sign: float = -1.0,
+    ) -> tuple[np.ndarray, np.ndarray]:
+        """Simulate all controllers in closed loop with the same (reduced-order)
+        linear plant G (e.g. from balred_utils or sysid_utils), discretized
+        with zero-order hold on the same time step. As in a FlowSolver loop,
+        u(k) = K(sign * y(k)) and y(k+1) = G(u(k)). The plant must be strictly
+        proper (D = 0).
+
+        Args:
+            G (control.StateSpace): continuous-time plant.
+            num_steps (int): number of time steps.
+            xG0 (np.ndarray | None, optional): plant initial states, shared (nG,) or
+                per controller (K, nG). Defaults to 0.
+            sign (float, optional): feedback sign. Defaults to -1 (negative feedback).
+
+        Returns:
+            tuple[np.ndarray, np.ndarray]: plant outputs y (num_steps+1, K, ny) and
+                control inputs u (num_steps, K, nu).
+        """
+        if np.any(np.asarray(G.D) != 0):
+            raise ValueError("Plant must be strictly proper for closed-loop stepping")
+        AG, BG = flu.c2d_zoh(G.A, G.B, self.dt)
+        CG = np.asarray(G.C, dtype=float)
+        xG = self._broadcast(np.zeros((G.nstates,)) if xG0 is None else xG0, G.nstates)
+
+        y = np.zeros((num_steps + 1, self.nbank, G.noutputs))
+        u = np.zeros((num_steps, self.nbank, G.ninputs))
+        y[0] = xG @ CG.T
+        for ii in range(num_steps):
+            u[ii] = self.step(sign * y[ii])
+            xG = xG @ AG.T + u[ii] @ BG.T
+            y[ii + 1] = xG @ CG.T
+        return y, u
+
+    def __getitem__(self, k: int) -> Controller:
+        """Return controller k as Controller, with its current state"""
+        Kk = self.controllers[k]
+        return Controller(Kk.A, Kk.B, Kk.C, Kk.D, x0=self.x[k].copy())
+
+
+class ControllerSwitcher:
+    """Online bumpless switching between controllers during time-stepping.
+
+    The switcher steps the active Controller (see Controller.step) and keeps
+    a rolling window of its inputs y and outputs u. When switching to a new
+    Controller, the state of the latter is conditioned on the window
+    (see youla_utils.CondSwitch), so that it would have produced (nearly)
+    the same past outputs and the control signal does not jump.
+    Conditioning factorizations are cached per controller (weakly, so that the
+    cache does not keep discarded controllers alive) and per window length.
+    """
+
+    def __init__(
+        self,
+        controller: Controller,
+        dt: float,
+        window: int,
+        w_y: float = 1.0,
+        w_u: float = 1.0,
+        w_decay: float = 1.0,
+    ):
+        """Initialize ControllerSwitcher with active controller.
+
+        Args:
+            controller (Controller): active controller.
+            dt (float): Time step.
+            window (int): number of past samples used for conditioning.
+            w_y (float, optional): weight on fictitious inputs. Defaults to 1.0.
+            w_u (float, optional): weight on past outputs. Defaults to 1.0.
+            w_decay (float, optional): forgetting factor. Defaults to 1.0.
+        """
+        self.controller = controller
+        self.dt = dt
+        self.window = window
+        self.weights = (w_y, w_u, w_decay)
+        self.y_window = np.zeros((window, controller.ninputs))
+        self.u_window = np.zeros((window, controller.noutputs))
+        self.count = 0
+        self._condswitch = weakref.WeakKeyDictionary()
+
+    def step(self, y: np.ndarray) -> np.ndarray:
+        """Step active controller (see Controller.step) and record (y, u)
+
+        Args:
+            y (np.ndarray): Controller input (e.g. Plant output).
+
+        Returns:
+            np.ndarray: control output u.
+        """
+        u = self.controller.step(y, self.dt)
+        self.record(y, u)
+        return u
+
+    def record(self, y: np.ndarray, u: np.ndarray) -> None:
+        """Append (y, u) to rolling window (circular buffer)"""
+        idx = self.count % self.window
+        self.y_window[idx] = np.ravel(y)
+        self.u_window[idx] = np.ravel(u)
+        self.count += 1
+
+    def get_window(self) -> tuple[np.ndarray, np.ndarray]:
+        """Return recorded (y, u), oldest first (at most window samples)"""
+        r = min(self.count, self.window)
+        order = (self.count - r + np.arange(r)) % self.window
+        return self.y_window[order], self.u_window[order]
+
+    def switch(self, controller: Controller) -> Controller:
+        """Switch to new controller with conditioned initial state.
+
+        Args:
+            controller (Controller): new controller (same dimensions).
+
+        Returns:
+            Controller: new active controller.
+        """
+        yr, ur = self.get_window()
+        r = len(yr)
+        if r * controller.noutputs < controller.nstates:
+            logger.warning(
+                f"Switching with {r} samples: state of order {controller.nstates} "
+                "not fully conditioned, reset to 0"
+            )
+            controller.x = np.zeros((controller.nstates,))
+        else:
+            condswitch = self._condswitch.setdefault(controller, dict())
+            if r not in condswitch:
+                condswitch[r] = yu.CondSwitch(controller, self.dt, r, *self.weights)
+            controller.x, _, _ = condswitch[r](ur, yr)
+        self.controller = controller
+        return controller
+
+
 if __name__ == "__main__":
     cwd = Path(__file__).parent
     sspath = (
@@ -219,3 +452,69 @@ if __name__ == "__main__":
         uu = Kmimo.step(yy, dt)
         print(f"output {uu}")
         print(f"states {Kmimo.x}")
+
+    # Benchmark against control.forced_response
+    print("***** Benchmark *****")
+    import time
+
+    def step_forced_response(K, x, y, dt):
+        y_rep = np.repeat(np.atleast_2d(y), repeats=2, axis=0).T
+        _, yout, xout = control.forced_response(
+            K, U=y_rep, T=[0, dt], X0=x, interpolate=False, return_x=True
+        )
+        return np.atleast_2d(yout)[:, 0], xout[:, 1]
+
+    num_steps = 1000
+    x_ref = np.zeros((K1.nstates,))
+    K1.x = x_ref.copy()
+    err = scale = 0.0
+    t_ref = t_zoh = 0.0
+    for ii in range(num_steps):
+        yy = [np.sin(ii * dt)]
+        t0 = time.perf_counter()
+        u_ref, x_ref = step_forced_response(K1, x_ref, yy, dt)
+        t1 = time.perf_counter()
+        uu = K1.step(yy, dt)
+        t2 = time.perf_counter()
+        t_ref += t1 - t0
+        t_zoh += t2 - t1
+        err = max(err, np.max(np.abs(K1.x - x_ref)))
+        scale = max(scale, np.max(np.abs(x_ref)))
+    print(f"max relative difference with forced_response: {err / scale}")
+    print(f"forced_response: {t_ref / num_steps * 1e6:.1f} us/step")
+    print(f"Controller.step: {t_zoh / num_steps * 1e6:.1f} us/step")
+
+    # Test ControllerBank
+    print("***** Test ControllerBank *****")
+    gains = np.linspace(0.5, 2.0, 4)
+    Klist = [
+        Controller.from_matrices(A=Kmimo.A, B=Kmimo.B, C=g * Kmimo.C, D=Kmimo.D)
+        for g in gains
+    ]
+    bank = ControllerBank(Klist, dt=dt)
+    yy = np.array([[1.2, -1.3]]) * gains[:, None]  # 1 input per controller
+    err = 0.0
+    for _ in range(num_steps):
+        ubank = bank.step(yy)
+        for k, Kk in enumerate(Klist):
+            uu = Kk.step(yy[k], dt)
+            err = max(err, np.max(np.abs(uu - ubank[k])) / max(np.max(np.abs(uu)), 1))
+    print(f"max relative difference with Controller.step: {err}")
+
+    # Test ControllerSwitcher
+    print("***** Test ControllerSwitcher *****")
+    Ka = Controller.from_matrices(
+        A=np.array([[-1.0, 2.0], [-2.0, -1.0]]),
+        B=np.array([[1.0], [0.0]]),
+        C=np.array([[1.0, 1.0]]),
+        D=0,
+    )
+    Kb = Controller.from_matrices(A=2 * Ka.A, B=Ka.B, C=2 * Ka.C, D=0)
+    Kb_ref = Controller.from_matrices(A=Kb.A, B=Kb.B, C=Kb.C, D=Kb.D)
+    switcher = ControllerSwitcher(Ka, dt=dt, window=50, w_y=1e3, w_decay=0.98)
+    for ii in range(200):
+        yy = [np.sin(ii * dt)]
+        switcher.step(yy)
+        Kb_ref.step(yy, dt)  # as if Kb had been in the loop
+    switcher.switch(Kb)
+    print(f"conditioned state: {Kb.x}, reference state: {Kb_ref.x}")
@@ -0,0 +1,102 @@
+from __future__ import annotations
+
+import dolfin
+import logging
+
+from flowsolver import FlowSolver
+
+logger = logging.getLogger(__name__)
+
+
+class FieldTransfer:
+    """Transfer fields from a FlowSolver to another FlowSolver defined on a different
+    mesh (e.g. coarse to fine), for example to seed a steady-state computation or
+    to restart time-stepping on another mesh.
+
+    Interpolation matrices between FunctionSpaces (V and P) are assembled once
+    with dolfin.PETScDMCollection (parallel-safe) and cached, so that any number of
+    fields may then be transferred at the cost of a sparse matrix-vector product.
+    Both meshes should cover the same domain.
+
+    Args:
+        fs_from (FlowSolver): FlowSolver on which fields are known (e.g. coarse mesh)
+        fs_to (FlowSolver): FlowSolver on which fields are needed (e.g. fine mesh)
+    """
+
+    def __init__(self, fs_from: FlowSolver, fs_to: FlowSolver) -> None:
+        self.fs_from = fs_from
+        self.fs_to = fs_to
+        self._transfer_matrices: dict[str, dolfin.PETScMatrix] = dict()
+
+    def _get_transfer_matrix(self, space: str) -> dolfin.PETScMatrix:
+        """Get (and compute if not cached) interpolation matrix between
+        FunctionSpaces of both FlowSolvers.
+
+        Args:
+            space (str): name of the FunctionSpace ("V" or "P")
+
+        Returns:
+            dolfin.PETScMatrix: interpolation matrix from fs_from.space to fs_to.space
+        """
+        if space not in self._transfer_matrices:
+            logger.info(f"Computing transfer matrix for FunctionSpace {space}...")
+            self._transfer_matrices[space] = (
+                dolfin.PETScDMCollection.create_transfer_matrix(
+                    getattr(self.fs_from, space), getattr(self.fs_to, space)
+                )
+            )
+        return self._transfer_matrices[space]
+
+    def transfer(self, f: dolfin.Function, space: str) -> dolfin.Function:
+        """Transfer field f from fs_from.space to fs_to.space.
+
+        Args:
+            f (dolfin.Function): field in fs_from.space
+            space (str): name of the FunctionSpace ("V" or "P")
+
+        Returns:
+            dolfin.Function: interpolated field in fs_to.space
+        """
+        M = self._get_transfer_matrix(space)
+        f_to = dolfin.Function(getattr(self.fs_to, space))
+        M.mult(f.vector(), f_to.vector())
+        f_to.vector().apply("insert")
+        return f_to
+
+    def transfer_up(self, up: dolfin.Function) -> dolfin.Function:
+        """Transfer mixed field up from fs_from.W to fs_to.W. Velocity and
+        pressure are transferred separately, then merged.
+
+        Args:
+            up (dolfin.Function): mixed field in fs_from.W
+
+        Returns:
+            dolfin.Function: interpolated mixed field in fs_to.W
+        """
+        u, p = up.split(deepcopy=True)
+        return self.fs_to.merge(
+            u=self.transfer(u, space="V"), p=self.transfer(p, space="P")
+        )
+
+    def transfer_steady_state(self) -> dolfin.Function:
+        """Transfer steady state of fs_from to fs_to. Intended to be used as
+        fs_to.compute_steady_state(method="newton", initial_guess=...).
+
+        Returns:
+            dolfin.Function: steady state UP0 interpolated in fs_to.W
+        """
+        return self.transfer_up(self.fs_from.fields.UP0)
+
+    def transfer_perturbation(self) -> dolfin.Function:
+        """Transfer current perturbation field of fs_from to fs_to. Intended to
+        be used as fs_to.initialize_time_stepping(ic=...), in order to restart
+        time-stepping on another mesh (e.g. from an attractor state computed on
+        a coarse mesh). As for any ic, the first step is performed at order 1.
+
+        Returns:
+            dolfin.Function: current perturbation field (u_, p_) interpolated in fs_to.W
+        """
+        return self.fs_to.merge(
+            u=self.transfer(self.fs_from.fields.u_, space="V"),
+            p=self.transfer(self.fs_from.fields.p_, space="P"),
+        )
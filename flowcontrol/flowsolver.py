@@ -1,5 +1,5 @@
 from __future__ import print_function
-from typing import Any, Iterable
+from typing import Any, Callable, Iterable
 from actuator import ACTUATOR_TYPE
 import flowsolverparameters
 from flowfield import FlowField, FlowFieldCollection
@@ -47,6 +47,7 @@ class FlowSolver(ABC):
         params_control: flowsolverparameters.ParamControl,
         params_ic: flowsolverparameters.ParamIC,
         verbose: int = 1,
+        comm: Any = None,
     ) -> None:
         """Initialize FlowSolver object with Parameters objects and
         setup FlowSolver object.
@@ -61,7 +62,11 @@ class FlowSolver(ABC):
             params_control (flowsolverparameters.ParamControl): see flowsolverparameters
             params_ic (flowsolverparameters.ParamIC): see flowsolerparameters
             verbose (int, optional): print every _verbose_ iteration. Defaults to 1.
+            comm (MPI.Comm, optional): MPI communicator of mesh, solvers and I/O
+                (e.g. sub-communicator of an ensemble, see flowsolverensemble).
+                Defaults to dolfin.MPI.comm_world.
         """
+        self.comm = dolfin.MPI.comm_world if comm is None else comm
         self.params_flow = params_flow
         self.params_time = params_time
         self.params_save = params_save
@@ -78,6 +83,7 @@ class FlowSolver(ABC):
         """Define class attributes common to all FlowSolver problems."""
         self.first_step = True
         self.fields = FlowFieldCollection()
+        self.step_callbacks: list[Callable] = []
 
         self.paths = self._define_paths()
         self.mesh = self._make_mesh()
@@ -151,10 +157,8 @@ class FlowSolver(ABC):
 
         logger.info(f"Mesh exists @: {self.params_mesh.meshpath}")
 
-        mesh = dolfin.Mesh(dolfin.MPI.comm_world)
-        with dolfin.XDMFFile(
-            dolfin.MPI.comm_world, str(self.params_mesh.meshpath)
-        ) as fm:
+        mesh = dolfin.Mesh(self.comm)
+        with dolfin.XDMFFile(self.comm, str(self.params_mesh.meshpath)) as fm:
             fm.read(mesh)
 
         logger.info(f"Mesh has: {mesh.num_cells()} cells")
@@ -166,11 +170,16 @@ class FlowSolver(ABC):
 
         Default is Continuous-Galerkin (CG)
         for each velocity component (order 2) and pressure (order 1).
+        If ParamSolver.is_equal_order, velocity is of order 1 as well and
+        the variational formulations are stabilized (see _make_stabilization).
 
         Returns:
             tuple[dolfin.FunctionSpace, ...]: all FunctionSpaces (V, P, W)
         """
-        Ve = dolfin.VectorElement("CG", self.mesh.ufl_cell(), 2)  # was 'P'
+        velocity_order = 1 if self.params_solver.is_equal_order else 2
+        Ve = dolfin.VectorElement(
+            "CG", self.mesh.ufl_cell(), velocity_order
+        )  # was 'P'
         Pe = dolfin.FiniteElement("CG", self.mesh.ufl_cell(), 1)  # was 'P'
         We = dolfin.MixedElement([Ve, Pe])
         V = dolfin.FunctionSpace(self.mesh, Ve)
@@ -178,7 +187,8 @@ class FlowSolver(ABC):
         W = dolfin.FunctionSpace(self.mesh, We)
 
         logger.debug(
-            f"Function Space [V(CG2), P(CG1)] has: {P.dim()}+{V.dim()}={W.dim()} DOFs"
+            f"Function Space [V(CG{velocity_order}), P(CG1)] has: "
+            f"{P.dim()}+{V.dim()}={W.dim()} DOFs"
         )
 
         return V, P, W
@@ -234,6 +244,8 @@ class FlowSolver(ABC):
         self.fields.u_n = u_n
         self.fields.u_nn = u_nn
         self.fields.p_n = p_n
+        # varfs refer to previous fields: rebuild them at next step
+        self.first_step = True
 
         self.timeseries = self._initialize_timeseries()
 
@@ -387,7 +399,7 @@ class FlowSolver(ABC):
         # other possibilities: dolfin.KrylovSolver("bicgstab", "jacobi")
         # then solverparam = solver.paramters
         # solverparam[""]=...
-        return dolfin.LUSolver("mumps")
+        return dolfin.LUSolver(self.comm, "mumps")
 
     def _make_varf(self, order: int, **kwargs) -> dolfin.Form:
         """Metamethod for defining variational formulations (varf) of order 1 and 2
@@ -451,6 +463,22 @@ class FlowSolver(ABC):
             - dot(f, v) * dx
             - shift * dot(u, v) * dx
         )
+
+        if self.params_solver.is_equal_order:
+            residual = (
+                (u - u_n) / dt
+                + dot(U0, nabla_grad(u))
+                + dot(u, nabla_grad(U0))
+                - invRe * div(nabla_grad(u))
+                + dolfin.Constant(b0_1) * dot(u_n, nabla_grad(u_n))
+                + dolfin.grad(p)
+                - f
+                - shift * u
+            )
+            F1 += self._make_stabilization(
+                residual=residual, U0=U0, vq=vq, dt=self.params_time.dt
+            )
+
         return F1
 
     def _make_varf_order2(
@@ -500,8 +528,72 @@ class FlowSolver(ABC):
             - dot(f, v) * dx
             - shift * dot(u, v) * dx
         )
+
+        if self.params_solver.is_equal_order:
+            residual = (
+                (3 * u - 4 * u_n + u_nn) / (2 * dt)
+                + dot(U0, nabla_grad(u))
+                + dot(u, nabla_grad(U0))
+                - invRe * div(nabla_grad(u))
+                + dolfin.Constant(b0_2) * dot(u_n, nabla_grad(u_n))
+                + dolfin.Constant(b1_2) * dot(u_nn, nabla_grad(u_nn))
+                + dolfin.grad(p)
+                - f
+                - shift * u
+            )
+            F2 += self._make_stabilization(
+                residual=residual, U0=U0, vq=vq, dt=self.params_time.dt
+            )
+
         return F2
 
+    def _make_stabilization(
+        self,
+        residual: Any,
+        U0: Any,
+        vq: tuple[dolfin.TestFunction, dolfin.TestFunction],
+        dt: float | None = None,
+    ) -> dolfin.Form:
+        """Define PSPG/SUPG stabilization terms for equal-order (P1-P1) elements
+        (see ParamSolver.is_equal_order). The strong residual of the momentum
+        equation is tested against the streamline derivative of the velocity test
+        function (SUPG) and against the gradient of the pressure test function
+        (PSPG), which makes the P1-P1 pair inf-sup stable.
+
+        The stabilization parameter is the usual
+        tau = ((2/dt)^2 + (2|U0|/h)^2 + (4/(Re*h^2))^2)^(-1/2),
+        where the temporal term is omitted for steady problems (dt=None).
+        Time-stepping uses the dt-dependent tau, while the steady state and the
+        linearized operators (see OperatorGetter.get_A, get_E) use the steady tau,
+        so that the continuous-time linear model does not depend on dt: the
+        linearization of the time-stepper thus differs slightly from (E, A).
+
+        Args:
+            residual (Any): strong residual of the momentum equation (UFL expression)
+            U0 (Any): advecting velocity field (usually the base flow)
+            vq (tuple[dolfin.TestFunction, dolfin.TestFunction]): test functions
+            dt (float | None, optional): time step. Defaults to None (steady).
+
+        Returns:
+            dolfin.Form: stabilization terms to be added to the varf
+        """
+        (v, q) = vq
+        h = dolfin.CellDiameter(self.mesh)
+        invRe = dolfin.Constant(1 / self.params_flow.Re)
+        # regularize |U0| so that tau remains differentiable at U0=0 (Newton)
+        U0_norm = dolfin.sqrt(dot(U0, U0) + dolfin.Constant(dolfin.DOLFIN_EPS))
+
+        tau_inv2 = (2 * U0_norm / h) ** 2 + (4 * invRe / h**2) ** 2
+        if dt is not None:
+            tau_inv2 += (2 / dolfin.Constant(dt)) ** 2
+        tau = 1 / dolfin.sqrt(tau_inv2)
+
+        # continuity is written -div(u)*q in this class, hence the PSPG sign
+        return (
+            tau * dot(residual, dot(U0, nabla_grad(v))) * dx
+            - tau * dot(residual, dolfin.grad(q)) * dx
+        )
+
     def _gather_actuators_expressions(self) -> dolfin.Expression | dolfin.Constant:
         """Gathers actuators that have type ACTUATOR_TYPE.FORCE
         and sums their expressions, in order to integrate them in
@@ -669,8 +761,22 @@ class FlowSolver(ABC):
             self._export_fields_xdmf(u_n, u_nn, p_n, self.t, adjust_baseflow=+1)
             self.write_timeseries()
 
+        # Callbacks (e.g. streaming modal analyses)
+        for callback in self.step_callbacks:
+            callback(self)
+
         return self.y_meas
 
+    def add_step_callback(self, callback: Callable) -> None:
+        """Register a callable, called as callback(self) at the end of each
+        successful step (e.g. modal_utils.IncrementalPOD to process snapshots
+        on the fly instead of exporting them).
+
+        Args:
+            callback (Callable): function of FlowSolver
+        """
+        self.step_callbacks.append(callback)
+
     def _solver_diverged(self, field: dolfin.Function) -> bool:
         """Check whether the solver has diverged
 
@@ -721,6 +827,17 @@ class FlowSolver(ABC):
         for ii, actuator in enumerate(self.params_control.actuator_list):
             actuator.expression.u_ctrl = u_ctrl[ii]
 
+    def _get_actuators_u_ctrl(self) -> list:
+        """Get current control amplitudes of each actuator
+
+        Returns:
+            list: control values assigned to each actuator
+        """
+        return [
+            actuator.expression.u_ctrl
+            for actuator in self.params_control.actuator_list
+        ]
+
     def _flush_actuators_u_ctrl(self) -> None:
         """Set control amplitudes for each actuator to zero."""
         self._set_actuators_u_ctrl([0] * self.params_control.actuator_number)
@@ -922,6 +1039,7 @@ class FlowSolver(ABC):
         u, p = dolfin.TrialFunctions(self.W)
         v, q = dolfin.TestFunctions(self.W)
 
+        # interpolate accepts both a dolfin.Function on W and a dolfin.Expression
         UP0.interpolate(self._default_steady_state_initial_guess())
         U0 = dolfin.as_vector((UP0[0], UP0[1]))
 
@@ -931,12 +1049,17 @@ class FlowSolver(ABC):
             - p * div(v) * dx
             - q * div(u) * dx
         )  # steady dolfin.lhs
+        if self.params_solver.is_equal_order:
+            residual = (
+                dot(U0, nabla_grad(u)) - invRe * div(nabla_grad(u)) + dolfin.grad(p)
+            )
+            ap += self._make_stabilization(residual=residual, U0=U0, vq=(v, q))
         Lp = (
             dolfin.Constant(0) * inner(U0, v) * dx + dolfin.Constant(0) * q * dx
         )  # zero dolfin.rhs
         bp = dolfin.assemble(Lp)
 
-        solverp = dolfin.LUSolver("mumps")
+        solverp = dolfin.LUSolver(self.comm, "mumps")
 
         for iter in range(max_iter):
             Ap = dolfin.assemble(ap)
@@ -989,6 +1112,13 @@ class FlowSolver(ABC):
             - q * div(U0) * dx
             #    - dot(f, v) * dx
         )
+        if self.params_solver.is_equal_order:
+            residual = (
+                dot(U0, nabla_grad(U0))
+                - invRe * div(nabla_grad(U0))
+                + dolfin.grad(P0)
+            )
+            F0 += self._make_stabilization(residual=residual, U0=U0, vq=(v, q))
         return F0, UP0
 
     def _make_BCs(self) -> dict[str, Any]:
@@ -1031,7 +1161,7 @@ class FlowSolver(ABC):
 
     def write_timeseries(self) -> None:
         """Write timeseries (pandas DataFrame) to file."""
-        if flu.MpiUtils.get_rank() == 0:  # TODO async?
+        if flu.MpiUtils.get_rank(self.comm) == 0:  # TODO async?
             # zipfile = '.zip' if self.compress_csv else ''
             self.timeseries.to_csv(self.paths["timeseries"], sep=",", index=False)
 
@@ -1078,20 +1208,23 @@ class FlowSolver(ABC):
             flu.write_xdmf(filename, Efield, "E")
         return Efield
 
-    def _default_steady_state_initial_guess(self) -> dolfin.UserExpression:
+    def _default_steady_state_initial_guess(
+        self,
+    ) -> dolfin.Function | dolfin.UserExpression:
         """Default initial guess for computing steady state. The method may
-        be overriden to propose an initial guess deemed closer to the steady state."""
-
-        class default_initial_guess(dolfin.UserExpression):
-            def eval(self, value, x):
-                value[0] = 1.0
-                value[1] = 0.0
-                value[2] = 0.0
-
-            def value_shape(self):
-                return (3,)
-
-        return default_initial_guess()
+        be overriden to propose an initial guess deemed closer to the steady state.
+        See flu.interpolate_numpy for defining fields from numpy callables.
+        Note: this method now returns a dolfin.Function on W (it used to return a
+        dolfin.UserExpression); overrides returning an expression on W are still
+        supported, since the guess is interpolated on W."""
+        return flu.interpolate_numpy(
+            [
+                lambda x: np.ones(x.shape[0]),
+                lambda x: np.zeros(x.shape[0]),
+                lambda x: np.zeros(x.shape[0]),
+            ],
+            self.W,
+        )
 
     def _default_initial_perturbation(
         self, xloc: float = 0.0, yloc: float = 0.0, radius: float = 1.0
@@ -0,0 +1,95 @@
+from __future__ import annotations
+
+import logging
+from typing import Any, Callable
+
+from mpi4py import MPI as mpi
+
+import utils_flowsolver as flu
+
+logger = logging.getLogger(__name__)
+
+
+class FlowSolverEnsemble:
+    """Run independent flow simulations in parallel within a single mpirun.
+
+    COMM_WORLD is split into n_groups sub-communicators of contiguous processes
+    (see flu.MpiUtils.split_comm). Each group runs its own FlowSolver (built with
+    comm=subcommunicator, so that mesh, solvers and I/O are restricted to the
+    group), e.g. for the parallel evaluation of optimization candidates or of
+    phases of a limit cycle. Members are distributed over groups in a round-robin
+    fashion, and processed sequentially within a group.
+
+    Members should write to distinct paths (e.g. ParamSave.path_out per member),
+    as only rank 0 of each group writes time series.
+
+    Example:
+        def run(member, comm):
+            fs = CylinderFlowSolver(..., params_save=ParamSave(path_out=path/str(member)),
+                                    comm=comm)
+            fs.load_steady_state()
+            fs.initialize_time_stepping()
+            ...
+            return J
+        ensemble = FlowSolverEnsemble(n_groups=4)
+        J_list = ensemble.map(run, members=theta_list)
+        ensemble.close()
+
+    Args:
+        n_groups (int): number of groups (at most the number of processes)
+        comm (MPI.Comm, optional): communicator to split. Defaults to COMM_WORLD.
+    """
+
+    def __init__(self, n_groups: int, comm: Any = None) -> None:
+        self.comm_world = mpi.COMM_WORLD if comm is None else comm
+        self.n_groups = min(n_groups, self.comm_world.Get_size())
+        self.color, self.comm = flu.MpiUtils.split_comm(self.n_groups, self.comm_world)
+        logger.info(
+            f"Process {self.comm_world.Get_rank()} in group {self.color} "
+            f"({self.comm.Get_size()} processes)"
+        )
+
+    def is_group_root(self) -> bool:
+        """Return True on rank 0 of the group of current process"""
+        return self.comm.Get_rank() == 0
+
+    def members_of_group(self, n_members: int) -> list[int]:
+        """Return indices of members run by the group of current process"""
+        return list(range(self.color, n_members, self.n_groups))
+
+    def map(self, fun: Callable[[Any, Any], Any], members: list[Any]) -> list[Any]:
+        """Run fun(member, comm) for all members, each member on the group
+        it is assigned to, with comm the sub-communicator of the group.
+        fun typically builds a FlowSolver with comm, runs it and returns a cost.
+
+        Args:
+            fun (Callable[[Any, Any], Any]): function of (member, comm)
+            members (list[Any]): e.g. controller parameters
+
+        Returns:
+            list[Any]: results of fun (as returned on rank 0 of each group),
+                in the order of members, on all processes
+        """
+
+        def run_member(index: int) -> Any:
+            logger.info(f"Group {self.color} running member {index}")
+            return fun(members[index], self.comm)
+
+        return flu.MpiUtils.map_groups(
+            run_member,
+            len(members),
+            self.color,
+            self.n_groups,
+            self.comm,
+            self.comm_world,
+        )
+
+    def barrier(self) -> None:
+        """Synchronize all processes of all groups"""
+        self.comm_world.Barrier()
+
+    def close(self) -> None:
+        """Free the sub-communicator of the group. FlowSolvers built on it
+        must not be used afterwards."""
+        if self.comm != mpi.COMM_NULL:
+            self.comm.Free()
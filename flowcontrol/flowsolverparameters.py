@@ -125,12 +125,16 @@ class ParamSolver(ParamFlowSolver):
         shift (float): shift equations by -_shift_*int(u * v * dx)
         is_eq_nonlinear (bool): if False, simulate equations linearized around base flow (i.e. the
             nonlinear term for the perturbation: (u.div)u, is neglected)
+        is_equal_order (bool): if True, use equal-order P1-P1 elements stabilized with
+            PSPG/SUPG instead of Taylor-Hood P2-P1 elements (roughly 3x fewer DOFs on the same
+            mesh, at the cost of accuracy)
     """
 
     throw_error: bool = True
     ic_add_perturbation: float = 0.0
     shift: float = 0.0
     is_eq_nonlinear: bool = True
+    is_equal_order: bool = False
 
 
 @dataclass
@@ -0,0 +1,288 @@
+from __future__ import annotations
+
+import dolfin
+from dolfin import dot, nabla_grad, inner, dx, div
+import numpy as np
+import scipy.linalg as la
+import logging
+
+import utils_flowsolver as flu
+from actuator import ACTUATOR_TYPE
+from flowsolver import FlowSolver
+
+logger = logging.getLogger(__name__)
+
+
+class GalerkinROM:
+    """Galerkin reduced-order model of the perturbation equations of FlowSolver
+    (see FlowSolver._make_varf_order2) projected on a basis of modes (e.g. POD):
+        u = sum_j a_j phi_j + sum_m c_m psi_m
+    where phi_j are modes satisfying homogeneous boundary conditions and psi_m are
+    lifting fields of boundary actuators (c_m being their control amplitude).
+    With z = [a, c], the model reads:
+        M_aa da/dt + M_ac dc/dt = L z + N(z, z) + B u_ctrl
+    where all tensors are precomputed (see from_flowsolver), and y = C z.
+    The pressure term vanishes because modes are (discretely) divergence-free
+    (stabilization terms of ParamSolver.is_equal_order are not projected).
+    Time-stepping is the same as FlowSolver: BDF2 (BDF1 at first step) with
+    nonlinear term extrapolated from previous steps, so that each step only costs
+    a small LU solve and the evaluation of the quadratic term.
+
+    The ROM exposes the same interface as FlowSolver for time-stepping:
+    step(u_ctrl) -> y_meas, so it may be used in existing driver loops
+    (e.g. for screening controllers before running the full-order model).
+
+    Args:
+        M (np.ndarray): mass matrix (r, r+m)
+        L (np.ndarray): linear operator (r, r+m)
+        N (np.ndarray): quadratic tensor (r, r+m, r+m)
+        B (np.ndarray): input matrix of force actuators (r, nu)
+        C (np.ndarray): output matrix (ny, r+m)
+        dt (float): time step
+        lift_index (list[int]): index (in u_ctrl) of actuators with lifting fields
+    """
+
+    def __init__(
+        self,
+        M: np.ndarray,
+        L: np.ndarray,
+        N: np.ndarray,
+        B: np.ndarray,
+        C: np.ndarray,
+        dt: float,
+        lift_index: list[int] | None = None,
+    ) -> None:
+        self.M = M
+        self.L = L
+        self.N = N
+        self.B = B
+        self.C = C
+        self.dt = dt
+        self.lift_index = [] if lift_index is None else list(lift_index)
+        self.r = M.shape[0]
+
+        # implicit part: BDF on a, linear term on a
+        M_aa, L_aa = M[:, : self.r], L[:, : self.r]
+        self.lu = {
+            1: la.lu_factor(M_aa / dt - L_aa),
+            2: la.lu_factor(3 * M_aa / (2 * dt) - L_aa),
+        }
+        self.initialize_time_stepping()
+
+    @classmethod
+    def from_flowsolver(
+        cls, fs: FlowSolver, basis: np.ndarray, lifting: bool = True
+    ) -> GalerkinROM:
+        """Build ROM by projecting equations of FlowSolver on basis. The base flow
+        fs.fields.U0 should be computed or loaded.
+
+        Args:
+            fs (FlowSolver): flow solver
+            basis (np.ndarray): local rows of modes on fs.W (n_local, r), e.g.
+                modal_utils.IncrementalPOD.U
+            lifting (bool, optional): compute lifting fields of actuators of type
+                ACTUATOR_TYPE.BC (see compute_lifting). Defaults to True.
+
+        Returns:
+            GalerkinROM: reduced-order model
+        """
+        logger.info("Building Galerkin ROM...")
+        up = dolfin.Function(fs.W)
+        modes = []
+        for k in range(basis.shape[1]):
+            up.vector().set_local(basis[:, k])
+            up.vector().apply("insert")
+            modes.append(up.copy(deepcopy=True))
+        r = len(modes)
+
+        actuators = fs.params_control.actuator_list
+        lift_index = [
+            ii
+            for ii, actuator in enumerate(actuators)
+            if actuator.actuator_type is ACTUATOR_TYPE.BC
+        ]
+        if lift_index and not lifting:
+            logger.warning("Boundary actuators are ignored in ROM (lifting=False)")
+            lift_index = []
+        for ii in lift_index:
+            modes.append(cls.compute_lifting(fs, ii))
+
+        # split gives functions on collapsed W.sub(0), whose dof ordering differs
+        # from fs.V on which operators are assembled
+        velocities = [
+            flu.projectm(mode.split(deepcopy=True)[0], fs.V) for mode in modes
+        ]
+        u = dolfin.TrialFunction(fs.V)
+        v = dolfin.TestFunction(fs.V)
+        U0 = fs.fields.U0
+        invRe = dolfin.Constant(1 / fs.params_flow.Re)
+        shift = dolfin.Constant(fs.params_solver.shift)
+
+        def project(K: dolfin.Matrix) -> np.ndarray:
+            """Project operator on (test: modes, trial: modes + liftings)"""
+            Kphi = [K * vel.vector() for vel in velocities]
+            return np.array(
+                [[velocities[i].vector().inner(Kj) for Kj in Kphi] for i in range(r)]
+            )
+
+        M = project(dolfin.assemble(dot(u, v) * dx))
+        L = project(
+            dolfin.assemble(
+                -dot(dot(U0, nabla_grad(u)), v) * dx
+                - dot(dot(u, nabla_grad(U0)), v) * dx
+                - invRe * inner(nabla_grad(u), nabla_grad(v)) * dx
+                + shift * dot(u, v) * dx
+            )
+        )
+
+        # quadratic term: N[i, j, k] = -((phi_j.grad)phi_k, phi_i)
+        nz = len(velocities)
+        N = np.zeros((r, nz, nz))
+        if fs.params_solver.is_eq_nonlinear:
+            for j in range(nz):
+                for k in range(nz):
+                    Njk = dolfin.assemble(
+                        -dot(dot(velocities[j], nabla_grad(velocities[k])), v) * dx
+                    )
+                    N[:, j, k] = [velocities[i].vector().inner(Njk) for i in range(r)]
+
+        # force actuators: unit amplitude, control amplitudes restored afterwards
+        B = np.zeros((r, len(actuators)))
+        u_ctrl = fs._get_actuators_u_ctrl()
+        try:
+            for ii, actuator in enumerate(actuators):
+                if actuator.actuator_type is ACTUATOR_TYPE.FORCE:
+                    fs._set_actuators_u_ctrl(np.eye(len(actuators))[ii])
+                    Bi = dolfin.assemble(dot(actuator.expression, v) * dx)
+                    B[:, ii] = [velocities[i].vector().inner(Bi) for i in range(r)]
+        finally:
+            fs._set_actuators_u_ctrl(u_ctrl)
+
+        C = np.array([fs.make_measurement(up=mode) for mode in modes]).T
+
+        logger.info(f"Galerkin ROM built with {r} modes and {len(lift_index)} liftings")
+        return cls(
+            M=M, L=L, N=N, B=B, C=C, dt=fs.params_time.dt, lift_index=lift_index
+        )
+
+    @staticmethod
+    def compute_lifting(fs: FlowSolver, actuator_index: int) -> dolfin.Function:
+        """Compute lifting field of a boundary actuator: Stokes flow with unit
+        amplitude on the actuator and homogeneous boundary conditions elsewhere
+        (divergence-free, as the POD modes). Control amplitudes of the actuators
+        are restored afterwards.
+
+        Args:
+            fs (FlowSolver): flow solver
+            actuator_index (int): index of actuator in actuator_list
+
+        Returns:
+            dolfin.Function: lifting field in fs.W
+        """
+        u, p = dolfin.TrialFunctions(fs.W)
+        v, q = dolfin.TestFunctions(fs.W)
+        invRe = dolfin.Constant(1 / fs.params_flow.Re)
+        a = (
+            invRe * inner(nabla_grad(u), nabla_grad(v)) * dx
+            - p * div(v) * dx
+            - div(u) * q * dx
+        )
+        f = dot(dolfin.Constant((0, 0)), v) * dx
+
+        u_ctrl = fs._get_actuators_u_ctrl()
+        lifting = dolfin.Function(fs.W)
+        try:
+            fs._set_actuators_u_ctrl(
+                np.eye(fs.params_control.actuator_number)[actuator_index]
+            )
+            dolfin.solve(
+                a == f,
+                lifting,
+                fs.bc["bcu"],
+                solver_parameters={"linear_solver": "mumps"},
+            )
+        finally:
+            fs._set_actuators_u_ctrl(u_ctrl)
+        return lifting
+
+    def initialize_time_stepping(self, a0: np.ndarray | None = None) -> None:
+        """Initialize time-stepping from modal coordinates a0 (default: 0).
+        As in FlowSolver, the first step is performed at order 1.
+
+        Args:
+            a0 (np.ndarray | None, optional): initial coordinates. Defaults to None.
+        """
+        nc = len(self.lift_index)
+        a0 = np.zeros((self.r,)) if a0 is None else np.asarray(a0, dtype=float)
+        self.z_n = np.concatenate((a0, np.zeros((nc,))))
+        self.z_nn = self.z_n.copy()
+        self.t = 0.0
+        self.iter = 0
+        self.order = 1
+        self.y_meas = self.C @ self.z_n
+
+    def _quadratic(self, z: np.ndarray) -> np.ndarray:
+        """Quadratic term N(z, z)"""
+        return np.einsum("ijk,j,k->i", self.N, z, z)
+
+    def step(self, u_ctrl: np.ndarray[int, float]) -> np.ndarray[int, float]:
+        """Simulate the ROM on one time-step (same scheme as FlowSolver.step).
+
+        Args:
+            u_ctrl (np.ndarray[int, float]): control input list
+
+        Returns:
+            np.ndarray[int, float]: value of measurement y after step
+        """
+        u_ctrl = np.asarray(u_ctrl, dtype=float).ravel()
+        r, dt = self.r, self.dt
+        c = u_ctrl[self.lift_index]
+        a_n, c_n = self.z_n[:r], self.z_n[r:]
+        a_nn, c_nn = self.z_nn[:r], self.z_nn[r:]
+        M_aa, M_ac = self.M[:, :r], self.M[:, r:]
+        L_ac = self.L[:, r:]
+
+        if self.order == 1:
+            rhs = M_aa @ a_n / dt - M_ac @ (c - c_n) / dt
+            rhs += self._quadratic(self.z_n)
+        else:
+            rhs = M_aa @ (4 * a_n - a_nn) / (2 * dt)
+            rhs -= M_ac @ (3 * c - 4 * c_n + c_nn) / (2 * dt)
+            rhs += 2 * self._quadratic(self.z_n) - self._quadratic(self.z_nn)
+        rhs += L_ac @ c + self.B @ u_ctrl
+        a = la.lu_solve(self.lu[self.order], rhs)
+
+        self.z_nn = self.z_n
+        self.z_n = np.concatenate((a, c))
+        self.iter += 1
+        self.t = self.iter * dt
+        self.order = 2
+        self.y_meas = self.C @ self.z_n
+        return self.y_meas
+
+    def save(self, filename: str) -> None:
+        """Save ROM tensors to npz file (see from_file)"""
+        np.savez(
+            filename,
+            M=self.M,
+            L=self.L,
+            N=self.N,
+            B=self.B,
+            C=self.C,
+            dt=self.dt,
+            lift_index=np.array(self.lift_index, dtype=int),
+        )
+
+    @classmethod
+    def from_file(cls, filename: str) -> GalerkinROM:
+        """Load ROM from npz file (see save)"""
+        data = np.load(filename)
+        return cls(
+            M=data["M"],
+            L=data["L"],
+            N=data["N"],
+            B=data["B"],
+            C=data["C"],
+            dt=float(data["dt"]),
+            lift_index=list(data["lift_index"]),
+        )
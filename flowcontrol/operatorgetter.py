@@ -1,422 +1,435 @@
-"""Class dedicated to operator computation on flows
-For now: not working, just copied-pasted operator getters from FlowSolver to make room"""
+"""Class dedicated to operator computation on flows: state-space matrices
+(A, B, C) and mass matrix E of the linearized perturbation equations, such that:
+    E dx/dt = A x + B u
+          y = C x
+for any FlowSolver, using its own actuators and sensors."""
 
 import dolfin
 from dolfin import dot, div, nabla_grad, dx, inner
 import utils_flowsolver as flu
 import logging
 import time
+import hashlib
 import numpy as np
-from abc import ABC, abstractmethod
+import scipy.sparse as spr
 import flowsolver
+from mpi4py import MPI as mpi
+from sensor import SensorPoint, SensorIntegral, SENSOR_TYPE
 
 logger = logging.getLogger(__name__)
 FORMAT = "[%(asctime)s %(filename)s->%(funcName)s():%(lineno)s]: %(message)s"
 logging.basicConfig(format=FORMAT, level=logging.INFO)
 
 
-class OperatorGetter(ABC):
-    def __init__(self, flowsolver: flowsolver.FlowSolver):
-        self.flowsolver.flowsolver = flowsolver
+class OperatorGetter:
+    """Compute operators of the perturbation equations linearized around some
+    base flow, for a given FlowSolver:
+        - A: linearized Navier-Stokes operator (Jacobian),
+        - B: actuation matrix (1 column per Actuator in ParamControl.actuator_list),
+        - C: measurement matrix (1 row per Sensor in ParamControl.sensor_list),
+        - E: mass matrix.
+
+    Dirichlet rows (see FlowSolver._make_bcs) are identity in A and zero in E, so
+    that boundary actuators (ACTUATOR_TYPE.BC) impose x = profile*u on their boundary
+    through B, while force actuators (ACTUATOR_TYPE.FORCE) enter B as load vectors.
+
+    Operators are cached: A is cached for each (base flow, shift) pair, where the
+    base flow is identified by a hash of its coefficients; B, C, E are computed once
+    (E is cached per base flow with equal-order elements, see get_E).
+    Operators are returned as dolfin.PETScMatrix (A, E) or np.ndarray (B, C),
+    or as scipy.sparse matrices with sparse=True.
 
-    @abstractmethod
-    def get_A(self):
-        pass
+    Args:
+        flowsolver (flowsolver.FlowSolver): FlowSolver with actuators and sensors loaded
+    """
 
-    @abstractmethod
-    def get_B(self):
-        pass
+    def __init__(self, flowsolver: flowsolver.FlowSolver):
+        self.flowsolver = flowsolver
+        self._cache = dict()
+
+    def _hash_field(self, up: dolfin.Function) -> str:
+        """Compute hash of field coefficients, identical on all MPI processes.
+
+        Args:
+            up (dolfin.Function): field to hash (e.g. base flow)
+
+        Returns:
+            str: hash of field
+        """
+        local_hash = hashlib.sha1(up.vector().get_local().tobytes()).hexdigest()
+        comm = flu.MpiUtils.mpi4py_comm(self.flowsolver.mesh.mpi_comm())
+        return hashlib.sha1("".join(comm.allgather(local_hash)).encode()).hexdigest()
+
+    def _from_cache(self, key: tuple, compute, sparse: bool):
+        """Get operator from cache, or compute and cache it.
+
+        Args:
+            key (tuple): cache key
+            compute (Callable): function computing the operator if not cached
+            sparse (bool): if True, return operator as scipy.sparse matrix
+
+        Returns:
+            Any: cached operator
+        """
+        if key not in self._cache:
+            t0 = time.time()
+            self._cache[key] = compute()
+            logger.info(f"Elapsed time: {time.time() - t0}")
+        else:
+            logger.debug(f"Operator {key[0]} found in cache")
 
-    @abstractmethod
-    def get_C(self):
-        pass
+        operator = self._cache[key]
+        if sparse:
+            return flu.dense_to_sparse(operator, eliminate_zeros=False)
+        return operator
 
+    def clear_cache(self) -> None:
+        """Clear all cached operators."""
+        self._cache = dict()
 
-class CylinderOperatorGetter(OperatorGetter):
-    # Matrix computations
     def get_A(
-        self, perturbations=True, shift=0.0, timeit=True, UP0=None
-    ):  # TODO idk, merge with make_mixed_form?
-        """Get state-space dynamic matrix A linearized around some field UP0"""
-        logger.info("Computing jacobian A...")
+        self, UP0: dolfin.Function | None = None, shift: float = 0.0, sparse=False
+    ) -> dolfin.PETScMatrix | spr.csr_matrix:
+        """Get state-space dynamic matrix A linearized around some field UP0.
+
+        Args:
+            UP0 (dolfin.Function | None, optional): field around which the equations
+                are linearized. Defaults to None (use FlowSolver base flow).
+            shift (float, optional): shift A as A - shift*E. Defaults to 0.0.
+            sparse (bool, optional): return scipy.sparse matrix. Defaults to False.
+
+        Returns:
+            dolfin.PETScMatrix | spr.csr_matrix: linearized operator A
+        """
+        if UP0 is None:
+            UP0 = self.flowsolver.fields.UP0
 
-        if timeit:
-            t0 = time.time()
+        key = ("A", self._hash_field(UP0), shift)
+        return self._from_cache(
+            key, lambda: self._compute_A(UP0=UP0, shift=shift), sparse=sparse
+        )
 
-        Jac = dolfin.PETScMatrix()
-        v, q = dolfin.TestFunctions(self.flowsolver.flowsolver.W)
-        iRe = dolfin.Constant(1 / self.flowsolver.flowsolver.params_flow.Re)
-        shift = dolfin.Constant(shift)
+    def _compute_A(self, UP0: dolfin.Function, shift: float) -> dolfin.PETScMatrix:
+        """Assemble linearized operator A (see get_A)."""
+        logger.info("Computing jacobian A...")
+        fs = self.flowsolver
 
-        if UP0 is None:
-            UP_ = self.flowsolver.fields.UP0  # base flow
-        else:
-            UP_ = UP0
-        U_, p_ = UP_.split()
-
-        if perturbations:  # perturbation equations linearized
-            up = dolfin.TrialFunction(self.flowsolver.W)
-            u, p = dolfin.split(up)
-            dF0 = (
-                -dot(dot(U_, nabla_grad(u)), v) * dx
-                - dot(dot(u, nabla_grad(U_)), v) * dx
-                - iRe * inner(nabla_grad(u), nabla_grad(v)) * dx
-                + p * div(v) * dx
-                + div(u) * q * dx
-                - shift * dot(u, v) * dx
-            )  # sum u, v but not p
-            # create zeroBC for perturbation formulation
-            bcu_inlet = dolfin.DirichletBC(
-                self.flowsolver.W.sub(0),
-                dolfin.Constant((0, 0)),
-                self.flowsolver.boundaries.loc["inlet"].subdomain,
-            )
-            bcu_walls = dolfin.DirichletBC(
-                self.flowsolver.W.sub(0).sub(1),
-                dolfin.Constant(0),
-                self.flowsolver.boundaries.loc["walls"].subdomain,
-            )
-            bcu_cylinder = dolfin.DirichletBC(
-                self.flowsolver.W.sub(0),
-                dolfin.Constant((0, 0)),
-                self.flowsolver.boundaries.loc["cylinder"].subdomain,
-            )
-            bcu_actuation_up = dolfin.DirichletBC(
-                self.flowsolver.W.sub(0),
-                self.flowsolver.actuator_expression,
-                self.flowsolver.boundaries.loc["actuator_up"].subdomain,
-            )
-            bcu_actuation_lo = dolfin.DirichletBC(
-                self.flowsolver.W.sub(0),
-                self.flowsolver.actuator_expression,
-                self.flowsolver.boundaries.loc["actuator_lo"].subdomain,
-            )
-            bcu = [
-                bcu_inlet,
-                bcu_walls,
-                bcu_cylinder,
-                bcu_actuation_up,
-                bcu_actuation_lo,
-            ]
-            self.flowsolver.actuator_expression.ampl = 0.0
-            bcs = bcu
-        else:
-            F0 = (
-                -dot(dot(U_, nabla_grad(U_)), v) * dx
-                - iRe * inner(nabla_grad(U_), nabla_grad(v)) * dx
-                + p_ * div(v) * dx
-                + q * div(U_) * dx
-                - shift * dot(U_, v) * dx
+        v, q = dolfin.TestFunctions(fs.W)
+        u, p = dolfin.TrialFunctions(fs.W)
+        iRe = dolfin.Constant(1 / fs.params_flow.Re)
+        shift = dolfin.Constant(shift)
+        U0, _ = dolfin.split(UP0)
+
+        dF0 = (
+            -dot(dot(U0, nabla_grad(u)), v) * dx
+            - dot(dot(u, nabla_grad(U0)), v) * dx
+            - iRe * inner(nabla_grad(u), nabla_grad(v)) * dx
+            + p * div(v) * dx
+            + div(u) * q * dx
+            - shift * dot(u, v) * dx
+        )  # sum u, v but not p
+        if fs.params_solver.is_equal_order:
+            residual = (
+                dot(U0, nabla_grad(u))
+                + dot(u, nabla_grad(U0))
+                - iRe * div(nabla_grad(u))
+                + dolfin.grad(p)
+                + shift * u
             )
-            # prepare derivation
-            du = dolfin.TrialFunction(self.flowsolver.W)
-            dF0 = dolfin.derivative(F0, UP_, du=du)
-            # import pdb
-            # pdb.set_trace()
-            ## shift
-            # dF0 = dF0 - shift*dot(U_,v)*dx
-            # bcs)
-            self.flowsolver.actuator_expression.ampl = 0.0
-            bcs = self.flowsolver.bc["bcu"]
+            dF0 -= fs._make_stabilization(residual=residual, U0=U0, vq=(v, q))
 
+        Jac = dolfin.PETScMatrix()
         dolfin.assemble(dF0, tensor=Jac)
-        [bc.apply(Jac) for bc in bcs]
-
-        if timeit:
-            logger.info(f"Elapsed time: {time.time() - t0}")
+        [bc.apply(Jac) for bc in fs.bc["bcu"]]
 
         return Jac
 
-    def get_B(self, export=False, timeit=True):  # TODO keep here
-        """Get actuation matrix B"""
+    def get_B(self, sparse=False) -> np.ndarray | spr.csr_matrix:
+        """Get actuation matrix B, with 1 column per actuator.
+
+        Args:
+            sparse (bool, optional): return scipy.sparse matrix. Defaults to False.
+
+        Returns:
+            np.ndarray | spr.csr_matrix: actuation matrix B of shape (ndof, nu),
+                with ndof the global number of DOFs
+        """
+        return self._from_cache(("B",), self._compute_B, sparse=sparse)
+
+    def _compute_B(self) -> np.ndarray:
+        """Compute actuation matrix B (see get_B). Each actuator is switched on
+        in turn with unit amplitude: force actuators are assembled as load vectors,
+        boundary actuators are read from the Dirichlet values of FlowSolver.bc.
+        Each process computes the rows of its owned DOFs, which are then gathered
+        on all processes (as in _compute_C). Control amplitudes of the actuators
+        are restored afterwards."""
         logger.info("Computing actuation matrix B...")
+        fs = self.flowsolver
+        v, _ = dolfin.TestFunctions(fs.W)
+        nu = fs.params_control.actuator_number
+
+        dof_start, dof_end = fs.W.dofmap().ownership_range()
+        B_local = np.zeros((dof_end - dof_start, nu))
+        # actuation of the (possibly live) solver is restored after extraction
+        u_ctrl = fs._get_actuators_u_ctrl()
+        try:
+            for ii in range(nu):
+                fs._set_actuators_u_ctrl(np.eye(nu)[ii])
+
+                f = fs._gather_actuators_expressions()
+                Bi = dolfin.assemble(dot(f, v) * dx).get_local()
+                Bi = Bi[: B_local.shape[0]]
+
+                for bc in fs.bc["bcu"]:
+                    bc_values = bc.get_boundary_values()
+                    bc_dofs = np.fromiter(bc_values.keys(), dtype=int)
+                    bc_vals = np.fromiter(bc_values.values(), dtype=float)
+                    is_owned = bc_dofs < B_local.shape[0]
+                    # E dx/dt = A x + B u with identity rows in A => x = -B u there
+                    Bi[bc_dofs[is_owned]] = -bc_vals[is_owned]
+
+                B_local[:, ii] = Bi
+        finally:
+            fs._set_actuators_u_ctrl(u_ctrl)
+
+        # gather owned rows from all processes
+        comm = flu.MpiUtils.mpi4py_comm(fs.mesh.mpi_comm())
+        B = np.zeros((fs.W.dim(), nu))
+        for start, B_rows in comm.allgather((dof_start, B_local)):
+            B[start : start + B_rows.shape[0]] = B_rows
 
-        if timeit:
-            t0 = time.time()
-
-        # for an exponential actuator -> just evaluate actuator_exp on every coordinate, kinda?
-        # for a boundary actuator -> evaluate actuator on boundary
-        actuator_ampl_old = self.flowsolver.actuator_expression.ampl
-        self.flowsolver.actuator_expression.ampl = 1.0
-
-        # Method 1
-        # restriction of actuation of boundary
-        class RestrictFunction(dolfin.UserExpression):
-            def __init__(self, boundary, fun, **kwargs):
-                self.boundary = boundary
-                self.fun = fun
-                super(RestrictFunction, self).__init__(**kwargs)
-
-            def eval(self, values, x):
-                values[0] = 0
-                values[1] = 0
-                values[2] = 0
-                if self.boundary.inside(x, True):
-                    evalval = self.fun(x)
-                    values[0] = evalval[0]
-                    values[1] = evalval[1]
-
-            def value_shape(self):
-                return (3,)
-
-        Bi = []
-        for actuator_name in ["actuator_up", "actuator_lo"]:
-            actuator_restricted = RestrictFunction(
-                boundary=self.flowsolver.boundaries.loc[actuator_name].subdomain,
-                fun=self.flowsolver.actuator_expression,
-            )
-            actuator_restricted = dolfin.interpolate(
-                actuator_restricted, self.flowsolver.W
-            )
-            # actuator_restricted = flu.projectm(actuator_restricted, self.flowsolver.W)
-            Bi.append(actuator_restricted)
-
-        # this is supposedly B
-        B_all_actuator = flu.projectm(sum(Bi), self.flowsolver.W)
-        # get vector
-        B = B_all_actuator.vector().get_local()
         # remove very small values (should be 0 but are not)
-        B = flu.dense_to_sparse(
-            B, eliminate_zeros=True, eliminate_under=1e-14
-        ).toarray()
-        B = B.T  # vertical B
-
-        if export:
-            vv = dolfin.Function(self.flowsolver.V)
-            ww = dolfin.Function(self.flowsolver.W)
-            ww.assign(B_all_actuator)
-            vv, pp = ww.split()
-            flu.write_xdmf("B.xdmf", vv, "B")
-
-        self.flowsolver.actuator_expression.ampl = actuator_ampl_old
-
-        if timeit:
-            logger.info(f"Elapsed time: {time.time() - t0}")
-
+        B[np.abs(B) < 1e-14] = 0
         return B
 
-    def get_C(self, timeit=True, check=False):  # TODO keep here
-        """Get measurement matrix C"""
+    def get_C(self, sparse=False) -> np.ndarray | spr.csr_matrix:
+        """Get measurement matrix C, with 1 row per sensor.
+
+        Args:
+            sparse (bool, optional): return scipy.sparse matrix. Defaults to False.
+
+        Returns:
+            np.ndarray | spr.csr_matrix: measurement matrix C of shape (ny, ndof)
+        """
+        C = self._from_cache(("C",), self._compute_C, sparse=True)
+        if sparse:
+            return C
+        return C.toarray()
+
+    def _compute_C(self) -> spr.csr_matrix:
+        """Compute measurement matrix C (see get_C) from the linear functional
+        of each sensor:
+            - SensorPoint: interpolation weights of the basis functions of the cell
+            containing the probe,
+            - SensorIntegral: assembled vector of the sensor form, obtained by
+            evaluating the sensor on a TestFunction (Sensor.eval must then be a
+            dolfin.assemble of a form that is linear in up),
+            - other sensors: brute-force evaluation (see _compute_C_bruteforce).
+        """
         logger.info("Computing measurement matrix C...")
-
-        if timeit:
-            t0 = time.time()
-
-        fspace = self.flowsolver.W
-        uvp = dolfin.Function(fspace)
-        uvp_vec = uvp.vector()
-        dofmap = fspace.dofmap()
-
-        ndof = fspace.dim()
-        ns = self.flowsolver.params_flow.sensor_nr
-        C = np.zeros((ns, ndof))
-
-        idof_old = 0
-        # Iteratively put each DOF at 1 and evaluate measurement on said DOF
-        for idof in dofmap.dofs():
-            uvp_vec[idof] = 1
-            if idof_old > 0:
-                uvp_vec[idof_old] = 0
-            idof_old = idof
-            C[:, idof] = self.flowsolver.make_measurement(mixed_field=uvp)
-
-        # check:
-        if check:
-            for i in range(ns):
-                sensor_types = dict(u=0, v=1, p=2)
-                logger.debug(
-                    f"True probe: {self.flowsolver.up0(self.flowsolver.sensor_location[i])[sensor_types[self.flowsolver.sensor_type[0]]]}"
+        fs = self.flowsolver
+
+        rows, cols, vals = [], [], []
+        for ii, sensor in enumerate(fs.params_control.sensor_list):
+            if isinstance(sensor, SensorPoint):
+                cols_i, vals_i = self._compute_C_row_point(sensor)
+            elif isinstance(sensor, SensorIntegral):
+                cols_i, vals_i = self._compute_C_row_integral(sensor)
+            else:
+                logger.warning(
+                    f"No linear functional known for sensor {ii}, using brute force"
                 )
-                logger.debug(
-                    f"\t with fun: {self.flowsolver.make_measurement(mixed_field=self.flowsolver.up0)}"
-                )
-                logger.debug(
-                    f"\t with C@x: {C[i] @ self.flowsolver.up0.vector().get_local()}"
-                )
-
-        if timeit:
-            logger.info(f"Elapsed time: {time.time() - t0}")
+                C_row = self._compute_C_bruteforce(sensor_list=[sensor])
+                cols_i = np.flatnonzero(C_row)
+                vals_i = C_row[0, cols_i]
+            rows.append(ii * np.ones(len(cols_i), dtype=int))
+            cols.append(np.asarray(cols_i, dtype=int))
+            vals.append(np.asarray(vals_i, dtype=float))
+
+        # gather entries from all processes
+        comm = flu.MpiUtils.mpi4py_comm(fs.mesh.mpi_comm())
+        rows, cols, vals = [
+            np.concatenate(comm.allgather(np.concatenate(x))) for x in [rows, cols, vals]
+        ]
+        return spr.csr_matrix(
+            (vals, (rows, cols)),
+            shape=(fs.params_control.sensor_number, fs.W.dim()),
+        )
+
+    def _compute_C_row_point(self, sensor: SensorPoint) -> tuple[np.ndarray, ...]:
+        """Compute row of C for point probe: the field at the probe is the sum of
+        the basis functions of the cell containing the probe, weighted by their DOFs.
+        The row is computed only on the first process owning the probe.
+
+        Args:
+            sensor (SensorPoint): point probe
+
+        Returns:
+            tuple[np.ndarray, ...]: global DOF indices and associated weights
+        """
+        fs = self.flowsolver
+        mesh = fs.mesh
+        subspaces = {
+            SENSOR_TYPE.U: fs.W.sub(0).sub(0),
+            SENSOR_TYPE.V: fs.W.sub(0).sub(1),
+            SENSOR_TYPE.P: fs.W.sub(1),
+        }
+        subspace = subspaces[sensor.sensor_type]
+
+        x = np.array(sensor.position, dtype=float)
+        cell_index = mesh.bounding_box_tree().compute_first_entity_collision(
+            dolfin.Point(*x)
+        )
+        has_point = cell_index < mesh.num_cells()
+
+        comm = flu.MpiUtils.mpi4py_comm(mesh.mpi_comm())
+        owner = comm.allreduce(comm.rank if has_point else comm.size, op=mpi.MIN)
+        if owner == comm.size:
+            raise ValueError(f"Sensor position {x} is outside of the mesh")
+        if comm.rank != owner:
+            return np.zeros(0, dtype=int), np.zeros(0)
+
+        cell = dolfin.Cell(mesh, cell_index)
+        weights = subspace.element().evaluate_basis_all(
+            x, cell.get_vertex_coordinates(), 0
+        )
+        local_dofs = subspace.dofmap().cell_dofs(cell_index)
+        global_dofs = fs.W.dofmap().tabulate_local_to_global_dofs()[local_dofs]
+        return global_dofs, weights
+
+    def _compute_C_row_integral(
+        self, sensor: SensorIntegral
+    ) -> tuple[np.ndarray, ...]:
+        """Compute row of C for integral sensor, by assembling the sensor form
+        on a TestFunction. Each process returns its owned DOFs.
+
+        Args:
+            sensor (SensorIntegral): integral sensor
+
+        Returns:
+            tuple[np.ndarray, ...]: global DOF indices and associated weights
+        """
+        C_row = sensor.eval(up=dolfin.TestFunction(self.flowsolver.W))
+        C_row_local = C_row.get_local()
+        nonzero = np.flatnonzero(C_row_local)
+        return C_row.local_range()[0] + nonzero, C_row_local[nonzero]
+
+    def _compute_C_bruteforce(self, sensor_list: list | None = None) -> np.ndarray:
+        """Compute measurement matrix C by setting each DOF to 1
+        in turn and evaluating sensors on the resulting field. This requires
+        ndof evaluations of each sensor and should be restricted to small meshes
+        (e.g. for checking _compute_C, see check_C). In parallel, all processes
+        loop over all global DOFs (sensor evaluations are collective) and only
+        the owner of a DOF sets it in its local part of the field.
+
+        Args:
+            sensor_list (list | None, optional): sensors to evaluate. Defaults to None
+                (all sensors from ParamControl.sensor_list).
+
+        Returns:
+            np.ndarray: measurement matrix C of shape (len(sensor_list), ndof)
+        """
+        fs = self.flowsolver
+        if sensor_list is None:
+            sensor_list = fs.params_control.sensor_list
+
+        uvp = dolfin.Function(fs.W)
+        uvp_vec = uvp.vector()
+        dof_start, dof_end = uvp_vec.local_range()
+        values = np.zeros(dof_end - dof_start)
+        C = np.zeros((len(sensor_list), fs.W.dim()))
+
+        for idof in range(fs.W.dim()):
+            values[:] = 0
+            if dof_start <= idof < dof_end:
+                values[idof - dof_start] = 1
+            uvp_vec.set_local(values)
+            uvp_vec.apply("insert")
+            C[:, idof] = [sensor.eval(up=uvp) for sensor in sensor_list]
 
         return C
 
+    def check_C(self, rtol: float = 1e-8) -> bool:
+        """Check consistency of C (see _compute_C) against brute-force computation
+        (see _compute_C_bruteforce). Intended for small meshes only.
 
-class CavityOperatorGetter(OperatorGetter):
-    def get_A(self, perturbations=True, shift=0.0, timeit=True, up_0=None):
-        """Get state-space dynamic matrix A around some state up_0"""
-        if timeit:
-            print("Computing jacobian A...")
-            t0 = time.time()
-
-        Jac = dolfin.PETScMatrix()
-        v, q = dolfin.TestFunctions(self.flowsolver.W)
-        iRe = dolfin.Constant(1 / self.flowsolver.Re)
-        shift = dolfin.Constant(shift)
-        self.flowsolver.actuator_expression.ampl = 0.0
-
-        if up_0 is None:
-            up_ = self.flowsolver.up0  # base flow
-        else:
-            up_ = up_0
-        u_, p_ = up_.dolfin.split()
-
-        if perturbations:  # perturbation equations lidolfin.nearized
-            up = dolfin.TrialFunction(self.flowsolver.W)
-            u, p = dolfin.split(up)
-            dF0 = (
-                -dot(dot(u_, nabla_grad(u)), v) * dx
-                - dot(dot(u, nabla_grad(u_)), v) * dx
-                - iRe * inner(nabla_grad(u), nabla_grad(v)) * dx
-                + p * div(v) * dx
-                + div(u) * q * dx
-                - shift * dot(u, v) * dx
-            )  # sum u, v but not p
-            bcu = self.flowsolver.bc_p["bcu"]
-            bcs = bcu
-        else:  # full ns + derivative
-            up_ = self.flowsolver.up0
-            u_, p_ = dolfin.split(up_)
-            F0 = (
-                -dot(dot(u_, nabla_grad(u_)), v) * dx
-                - iRe * inner(nabla_grad(u_), nabla_grad(v)) * dx
-                + p_ * div(v) * dx
-                + q * div(u_) * dx
-                - shift * dot(u_, v) * dx
-            )
-            # prepare derivation
-            du = dolfin.TrialFunction(self.flowsolver.W)
-            dF0 = dolfin.derivative(F0, up_, du=du)
-            bcs = self.flowsolver.bc["bcu"]
-
-        dolfin.assemble(dF0, tensor=Jac)
-        [bc.apply(Jac) for bc in bcs]
-
-        if timeit:
-            print("Elapsed time: ", time.time() - t0)
-
-        return Jac
-
-    def get_B(self, export=False, timeit=True):
-        """Get actuation matrix B"""
-        print("Computing actuation matrix B...")
-
-        if timeit:
-            t0 = time.time()
-
-        # for an exponential actuator -> just evaluate actuator_exp on every coordinate, kinda?
-        # for a boundary actuator -> evaluate actuator on boundary
-        actuator_ampl_old = self.flowsolver.actuator_expression.ampl
-        self.flowsolver.actuator_expression.ampl = 1.0
-
-        # Method 2
-        # Projet actuator expression on W
-        class ExpandFunctionSpace(dolfin.UserExpression):
-            """Expand function from space [V1, V2] to [V1, V2, P]"""
-
-            def __init__(self, fun, **kwargs):
-                self.fun = fun
-                super(ExpandFunctionSpace, self).__init__(**kwargs)
-
-            def eval(self, values, x):
-                evalval = self.fun(x)
-                values[0] = evalval[0]
-                values[1] = evalval[1]
-                values[2] = 0
+        Args:
+            rtol (float, optional): relative tolerance on each row. Defaults to 1e-8.
 
-            def value_shape(self):
-                return (3,)
+        Returns:
+            bool: True if all rows match within tolerance
+        """
+        C = self.get_C(sparse=False)
+        C_bruteforce = self._compute_C_bruteforce()
 
-        actuator_extended = ExpandFunctionSpace(fun=self.actuator_expression)
-        actuator_extended = dolfin.interpolate(actuator_extended, self.flowsolver.W)
-        B_proj = flu.projectm(actuator_extended, self.flowsolver.W)
-        B = B_proj.vector().get_local()
-
-        # remove very small values (should be 0 but are not)
-        B = flu.dense_to_sparse(
-            B, eliminate_zeros=True, eliminate_under=1e-14
-        ).toarray()
-        B = B.T  # vertical B
-
-        if export:
-            fa = dolfin.FunctionAssigner(
-                [self.flowsolver.V, self.flowsolver.P], self.flowsolver.W
+        is_consistent = True
+        for ii in range(C.shape[0]):
+            err = np.linalg.norm(C[ii] - C_bruteforce[ii]) / max(
+                np.linalg.norm(C_bruteforce[ii]), dolfin.DOLFIN_EPS
             )
-            vv = dolfin.Function(self.flowsolver.V)
-            pp = dolfin.Function(self.flowsolver.P)
-            ww = dolfin.Function(self.flowsolver.W)
-            ww.assign(B_proj)
-            fa.assign([vv, pp], ww)
-            flu.write_xdmf("B.xdmf", vv, "B")
-
-        self.flowsolver.actuator_expression.ampl = actuator_ampl_old
+            logger.info(f"Sensor {ii}: relative error on C with brute force: {err}")
+            is_consistent = is_consistent and err <= rtol
+
+        return is_consistent
+
+    def get_E(
+        self, UP0: dolfin.Function | None = None, sparse=False
+    ) -> dolfin.PETScMatrix | spr.csr_matrix:
+        """Get mass matrix E (on velocity only, zero on Dirichlet rows).
+        With equal-order elements (see ParamSolver.is_equal_order), E also contains
+        the PSPG/SUPG terms of the time derivative, which depend on the base flow,
+        with the steady stabilization parameter as A (not the dt-dependent one of
+        time-stepping, see FlowSolver._make_stabilization).
+
+        Args:
+            UP0 (dolfin.Function | None, optional): base flow of the stabilization
+                terms, only used if ParamSolver.is_equal_order. Defaults to None
+                (use FlowSolver base flow).
+            sparse (bool, optional): return scipy.sparse matrix. Defaults to False.
+
+        Returns:
+            dolfin.PETScMatrix | spr.csr_matrix: mass matrix E
+        """
+        if not self.flowsolver.params_solver.is_equal_order:
+            return self._from_cache(("E",), self._compute_E, sparse=sparse)
 
-        if timeit:
-            print("Elapsed time: ", time.time() - t0)
-
-        return B
-
-    def get_C(self, timeit=True, check=False, verbose=False):
-        """Get measurement matrix C"""
-        # Solution to make it faster:
-        # localize the region of dofs where C is going to be nonzero
-        # and only account for dofs in this region
-        print("Computing measurement matrix C...")
-
-        if timeit:
-            t0 = time.time()
-
-        # Initialize
-        fspace = self.flowsolver.W  # function space
-        uvp = dolfin.Function(fspace)  # function to store C
-        uvp_vec = uvp.vector()  # as vector
-        ndof = fspace.dim()  # size of C
-        ns = self.flowsolver.params_control.sensor_number
-        C = np.zeros((ns, ndof))
-
-        dofmap = fspace.dofmap()  # indices of dofs
-        dofmap_x = fspace.tabulate_dof_coordinates()  # coordinates of dofs
-
-        # Box that encapsulates all dofs on sensor
-        margin = 0.05
-        xmin = 1 - margin
-        xmax = 1.1 + margin
-        ymin = 0 - margin
-        ymax = 0 + margin
-        xymin = np.array([xmin, ymin]).reshape(1, -1)
-        xymax = np.array([xmax, ymax]).reshape(1, -1)
-        # keep dofs with coordinates inside box
-        dof_in_box = (
-            np.greater_equal(dofmap_x, xymin) * np.less_equal(dofmap_x, xymax)
-        ).all(axis=1)
-        # retrieve said dof index
-        dof_in_box_idx = np.array(dofmap.dofs())[dof_in_box]
-
-        # Iteratively put each DOF at 1
-        # And evaluate measurement on said DOF
-        idof_old = 0
-        ii = 0  # counter of the number of dofs evaluated
-        for idof in dof_in_box_idx:
-            ii += 1
-            if verbose and not ii % 1000:
-                print("get_C::eval iter {0} - dof n°{1}/{2}".format(ii, idof, ndof))
-            # set field 1 at said dof
-            uvp_vec[idof] = 1
-            uvp_vec[idof_old] = 0
-            idof_old = idof
-            # retrieve coordinates
-            # dof_x = dofmap_x[idof] # not needed for measurement
-            # evaluate measurement
-            C[:, idof] = self.flowsolver.make_measurement(mixed_field=uvp)
-
-        # check:
-        if check:
-            for i in range(ns):
-                print(
-                    "\t with fun:",
-                    self.flowsolver.make_measurement(mixed_field=self.flowsolver.up0),
-                )
-                print("\t with C@x: ", C[i] @ self.flowsolver.up0.vector().get_local())
-
-        if timeit:
-            print("Elapsed time: ", time.time() - t0)
-
-        return C
+        if UP0 is None:
+            UP0 = self.flowsolver.fields.UP0
+
+        key = ("E", self._hash_field(UP0))
+        return self._from_cache(key, lambda: self._compute_E(UP0=UP0), sparse=sparse)
+
+    def _compute_E(self, UP0: dolfin.Function | None = None) -> dolfin.PETScMatrix:
+        """Assemble mass matrix E (see get_E)."""
+        logger.info("Computing mass matrix E...")
+        fs = self.flowsolver
+        v, q = dolfin.TestFunctions(fs.W)
+        u, _ = dolfin.TrialFunctions(fs.W)
+
+        mass = dot(u, v) * dx  # sum u, v but not p
+        if fs.params_solver.is_equal_order:
+            # time derivative in the strong residual, with the same (steady) tau as A
+            U0, _ = dolfin.split(UP0)
+            mass += fs._make_stabilization(residual=u, U0=U0, vq=(v, q))
+
+        E = dolfin.PETScMatrix()
+        dolfin.assemble(mass, tensor=E)
+        [bc.zero(E) for bc in fs.bc["bcu"]]
+
+        return E
+
+    def get_all(self, sparse=False) -> tuple:
+        """Get all operators (A, B, C, E) around FlowSolver base flow.
+
+        Args:
+            sparse (bool, optional): return scipy.sparse matrices. Defaults to False.
+
+        Returns:
+            tuple: A, B, C, E
+        """
+        return (
+            self.get_A(sparse=sparse),
+            self.get_B(sparse=sparse),
+            self.get_C(sparse=sparse),
+            self.get_E(sparse=sparse),
+        )
@@ -0,0 +1,301 @@
+"""
+Low-rank balanced truncation utility: balanced reduced-order models of the
+large-scale linearized model E x' = A x + B u, y = C x (e.g. from OperatorGetter,
+with E singular on pressure and Dirichlet DOFs), computed from low-rank factors
+of the Gramians obtained with LR-ADI (no dense operator is ever formed)
+"""
+
+import numpy as np
+import scipy.linalg as la
+import scipy.sparse as spr
+import scipy.sparse.linalg as spr_la
+import control
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class ShiftedSolver:
+    """Sparse LU factorizations of A + p E (or transposed), cached by shift p"""
+
+    def __init__(self, A, E, transpose=False):
+        self.A = spr.csc_matrix(A.T if transpose else A)
+        self.E = spr.csc_matrix(E.T if transpose else E)
+        self.lu = dict()
+
+    def solve(self, p, W):
+        """Return (A + p E)^-1 W"""
+        if p not in self.lu:
+            p_ = np.real(p) if np.imag(p) == 0 else p
+            self.lu[p] = spr_la.splu((self.A + p_ * self.E).tocsc())
+        lu = self.lu[p]
+        if np.iscomplexobj(W) and lu.L.dtype != complex:
+            return lu.solve(np.real(W)) + 1j * lu.solve(np.imag(W))
+        return lu.solve(W)
+
+
+def _real_basis(X, tol=1e-10):
+    """Orthonormal real basis of span(Re X, Im X)"""
+    U, s, _ = la.svd(np.hstack((np.real(X), np.imag(X))), full_matrices=False)
+    return U[:, s > tol * s[0]]
+
+
+def _compress(Z, tol=1e-12):
+    """Real low-rank factor Zr (n, k) with Zr Zr^T = Re(Z Z^H), truncated"""
+    Z = np.hstack((np.real(Z), np.imag(Z)))
+    Qz, Rz = la.qr(Z, mode="economic")
+    U, s, _ = la.svd(Rz, full_matrices=False)
+    keep = s > tol * s[0]
+    return Qz @ (U[:, keep] * s[keep])
+
+
+def _projection_shifts(A, E, V, n_shifts):
+    """Shifts for LR-ADI: stable Ritz values of (A, E) on span(V), closed
+    under conjugation (Benner, Kuerschner & Saak, 2014)"""
+    Qv = _real_basis(V)
+    ritz = la.eigvals(Qv.T @ (A @ Qv), Qv.T @ (E @ Qv))
+    ritz = ritz[np.isfinite(ritz) & (np.real(ritz) < 0)]
+    ritz = ritz[np.imag(ritz) >= 0]
+    ritz = ritz[np.argsort(np.abs(ritz))][:n_shifts]
+    shifts = []
+    for p in ritz:
+        shifts += [p] if np.imag(p) == 0 else [p, np.conj(p)]
+    return shifts
+
+
+def lr_adi(
+    A,
+    E,
+    B,
+    tol=1e-8,
+    max_iter=200,
+    n_shifts=8,
+    transpose=False,
+    solver=None,
+    projector=None,
+):
+    """Low-rank ADI (Penzl, 1999; Benner, Kuerschner & Saak, 2013) for the
+    generalized Lyapunov equation
+        A X E^T + E X A^T + B B^T = 0   (or A^T X E + E^T X A + B B^T = 0 if transpose)
+    with stable (A, E) and B in the range of E on the proper subspace
+    (see balanced_truncation). Shifts are projection shifts, updated after each
+    cycle with the last iterates.
+    If (A, E) has unstable modes, B must be projected on the stable subspace and
+    projector (callable V -> projected V) is applied to each new iterate before it
+    enters the factor and the residual, so that roundoff in unstable directions is
+    not amplified by the shifted solves.
+
+    Return real low-rank factor Z (n, k) with X ~ Z Z^T, and relative residual norms
+    """
+    solver = ShiftedSolver(A, E, transpose=transpose) if solver is None else solver
+    At, Et = solver.A, solver.E
+    W = np.asarray(B, dtype=complex).reshape(A.shape[0], -1)
+    nB = np.linalg.norm(W, 2)
+    project = (lambda V: V) if projector is None else projector
+    V = project(solver.solve(-1.0, W))  # for initial shifts only
+    shifts = _projection_shifts(At, Et, V, n_shifts) or [-1.0]
+
+    Z = []
+    residuals = []
+    it = 0
+    while it < max_iter:
+        for p in shifts:
+            V = project(solver.solve(p, W))
+            W = W - 2 * np.real(p) * (Et @ V)
+            Z.append(np.sqrt(-2 * np.real(p)) * V)
+            residuals.append(np.linalg.norm(W, 2) / nB)
+            it += 1
+            if residuals[-1] < tol or it >= max_iter:
+                break
+        if residuals[-1] < tol:
+            break
+        shifts = _projection_shifts(At, Et, np.hstack(Z[-len(shifts) :]), n_shifts)
+        shifts = shifts or [-1.0]
+
+    logger.info(f"LR-ADI: {it} iterations, relative residual {residuals[-1]}")
+    return _compress(np.hstack(Z)), np.array(residuals)
+
+
+def unstable_subspace(A, E, n_eig=20, sigma=0.0, rtol=1e-6):
+    """Real bases Vu, Wu of right and left invariant subspaces of (A, E) for
+    eigenvalues with positive real part, among n_eig eigenvalues closest to sigma
+    (real). Right and left eigenvalues (computed separately) are paired by nearest
+    match, up to complex conjugation (relative tolerance rtol), and only unstable
+    eigenvalues found on both sides are kept.
+    Return Vu, Wu with the same number of columns (possibly 0)"""
+    n_eig = min(n_eig, A.shape[0] - 2)
+    L, V = spr_la.eigs(spr.csc_matrix(A), k=n_eig, M=spr.csc_matrix(E), sigma=sigma)
+    Lt, W = spr_la.eigs(
+        spr.csc_matrix(A.T), k=n_eig, M=spr.csc_matrix(E.T), sigma=sigma
+    )
+
+    # pair unstable right/left eigenvalues (conjugate pairs span the same subspace)
+    idx_right, idx_left = [], []
+    is_free = np.real(Lt) > 0
+    for ii in np.flatnonzero(np.real(L) > 0):
+        dist = np.abs(np.real(Lt) - np.real(L[ii])) + np.abs(
+            np.abs(np.imag(Lt)) - np.abs(np.imag(L[ii]))
+        )
+        dist[~is_free] = np.inf
+        jj = np.argmin(dist)
+        if dist[jj] <= rtol * max(1.0, np.abs(L[ii])):
+            idx_right.append(ii)
+            idx_left.append(jj)
+            is_free[jj] = False
+        else:
+            logger.warning(f"No left eigenvalue matching {L[ii]}: discarded")
+
+    logger.info(f"Unstable eigenvalues: {L[idx_right]}")
+    n = A.shape[0]
+    if not idx_right:
+        return np.zeros((n, 0)), np.zeros((n, 0))
+    Vu, Wu = _real_basis(V[:, idx_right]), _real_basis(W[:, idx_left])
+    if Vu.shape[1] != Wu.shape[1]:
+        raise ValueError(
+            f"Right and left unstable subspaces have different dimensions "
+            f"({Vu.shape[1]} and {Wu.shape[1]})"
+        )
+    return Vu, Wu
+
+
+def balanced_truncation(
+    A,
+    E,
+    B,
+    C,
+    order=None,
+    hsv_threshold=1e-6,
+    unstable=None,
+    n_eig=20,
+    sigma=0.0,
+    tol=1e-10,
+    max_iter=200,
+    n_shifts=8,
+):
+    """Balanced truncation of the large-scale descriptor system
+        E x' = A x + B u,  y = C x
+    with sparse A, E, B, C (e.g. OperatorGetter.get_all(sparse=True)).
+
+    - Inputs and outputs are lifted with A^-1: with x_l = -A^-1 B, y_l = -A^-T C^T
+    and H(s) = y_l^T E (sE-A)^-1 E x_l, the transfer function is
+        G(s) = G(0) - s y_l^T E x_l + s^2 H(s).
+    Input and output vectors of H are in the range of E (resp. E^T) on
+    divergence-free fields, so that LR-ADI converges, whatever the actuators
+    (boundary or force) and sensors.
+    - Unstable modes of (A, E) (unstable, or computed with unstable_subspace) are
+    kept exactly, and Gramians are computed on the complementary stable subspace,
+    obtained by projection with the right/left unstable invariant subspaces.
+    - The stable part of H is reduced by square-root balanced truncation with
+    low-rank Gramian factors (see lr_adi). With H = (Ah, Bh, Ch) the realization
+    (unstable and stable parts), (Ah, Ah Bh, Ch Ah, D) realizes
+    s^2 H(s) - s Ch Bh - Ch Ah Bh + D. For the full H, Ch Bh = y_l^T E x_l and
+    Ch Ah Bh = y_l^T A x_l = -G(0), so that G is recovered with D = 0. For the
+    truncated H, these identities only hold approximately: the feedthrough
+    D = G(0) + Ch Ah Bh (zero up to truncation error) is added so that the DC gain
+    G(0) = C x_l is preserved exactly, while the s-term Ch Bh remains approximate.
+
+    Args:
+        order: order of the stable part (default: from hsv_threshold)
+        hsv_threshold: relative threshold on Hankel singular values (as balred_rel)
+        unstable: tuple (Vu, Wu) of real bases of right and left unstable subspaces
+            (default: computed with unstable_subspace(A, E, n_eig, sigma))
+
+    Return control.StateSpace, Hankel singular values of H (inf for unstable modes,
+    as youla_utils.sys_hsv)
+    """
+    A = spr.csc_matrix(A)
+    E = spr.csc_matrix(E)
+    B = np.asarray(B.toarray() if spr.issparse(B) else B).reshape(A.shape[0], -1)
+    C = np.asarray(C.toarray() if spr.issparse(C) else C).reshape(-1, A.shape[0])
+
+    # lifting
+    logger.info("Lifting inputs and outputs...")
+    lu_A = spr_la.splu(A)
+    x_l = -lu_A.solve(B)
+    y_l = -lu_A.solve(C.T, trans="T")
+    B_E = E @ x_l
+    C_E = (E.T @ y_l).T
+
+    # unstable subspace
+    Vu, Wu = unstable_subspace(A, E, n_eig, sigma) if unstable is None else unstable
+    nu = Vu.shape[1]
+    if nu:
+        Eu = Wu.T @ (E @ Vu)
+        Au = la.solve(Eu, Wu.T @ (A @ Vu))
+        Bu = la.solve(Eu, Wu.T @ B_E)
+        Cu = C_E @ Vu
+        # projection on stable subspace
+        B_E = B_E - E @ (Vu @ Bu)
+        C_E = C_E - (Cu @ la.solve(Eu, Wu.T)) @ E
+
+        def project_right(V):
+            return V - Vu @ la.solve(Eu, Wu.T @ (E @ V))
+
+        def project_left(W):
+            return W - Wu @ la.solve(Eu.T, Vu.T @ (E.T @ W))
+
+    else:
+        project_right = project_left = None
+        Au = np.zeros((0, 0))
+        Bu = np.zeros((0, B.shape[1]))
+        Cu = np.zeros((C.shape[0], 0))
+
+    # Gramians
+    logger.info("Computing controllability Gramian...")
+    Zc, _ = lr_adi(
+        A,
+        E,
+        B_E,
+        tol=tol,
+        max_iter=max_iter,
+        n_shifts=n_shifts,
+        projector=project_right,
+    )
+    logger.info("Computing observability Gramian...")
+    Zo, _ = lr_adi(
+        A,
+        E,
+        C_E.T,
+        tol=tol,
+        max_iter=max_iter,
+        n_shifts=n_shifts,
+        transpose=True,
+        projector=project_left,
+    )
+
+    # square-root balanced truncation
+    U, hsv, Vh = la.svd(Zo.T @ (E @ Zc), full_matrices=False)
+    if order is None:
+        order = int(np.sum(hsv / hsv[0] >= hsv_threshold))
+    order = min(order, len(hsv))
+    sqrt_hsv = np.sqrt(hsv[:order])
+    T = Zc @ Vh[:order].T / sqrt_hsv
+    S = Zo @ U[:, :order] / sqrt_hsv
+    Ar = S.T @ (A @ T)
+    Br = S.T @ B_E
+    Cr = C_E @ T
+
+    Ah = la.block_diag(Au, Ar)
+    Bh = np.vstack((Bu, Br))
+    Ch = np.hstack((Cu, Cr))
+    # feedthrough correction: DC gain -Ch Ah Bh + D of the realization is G(0)
+    D = C @ x_l + Ch @ (Ah @ Bh)
+    G = control.StateSpace(Ah, Ah @ Bh, Ch @ Ah, D)
+    logger.info(f"Reduced model: {nu} unstable + {order} stable states")
+    return G, np.concatenate((np.full(nu, np.inf), hsv))
+
+
+def balanced_truncation_flowsolver(fs, **kwargs):
+    """Balanced truncation (see balanced_truncation) of the linearized model of
+    FlowSolver around its base flow (see OperatorGetter)"""
+    from operatorgetter import OperatorGetter  # avoid circular import
+
+    opget = OperatorGetter(fs)
+    return balanced_truncation(
+        opget.get_A(sparse=True),
+        opget.get_E(sparse=True),
+        opget.get_B(sparse=True),
+        opget.get_C(sparse=True),
+        **kwargs,
+    )
@@ -40,11 +40,7 @@ if __name__=='__main__':
     print('--- from sparse...')
     AA = spr.load_npz(save_npz_path + 'A_mean.npz') 
     BB = spr.load_npz(save_npz_path + 'Q.npz') 
-    print('--- ... to petscmat')
-    seq = True
-    AA = sparse_to_petscmat(AA, sequential=seq)
-    BB = sparse_to_petscmat(BB, sequential=seq)
-    sz = AA.size[0]
+    sz = AA.shape[0]
     # targets
     #targets = np.array([[0.8+10j], [0.5+13j], [0.45+8j], [0.01+16j], [0]])
     #neiglist = np.array([[1],[1],[1],[1],[20]]) 
@@ -61,55 +57,22 @@ if __name__=='__main__':
     def savemat(outfile, mat, matname):
         sio.savemat(outfile, mdict={matname: spr.csc_matrix(mat)})
 
-    # solve A@x = Q*L@x
-    LAMBDA = np.zeros((0,), dtype=complex)
-    V = np.zeros((sz, 0), dtype=complex)
-    print('--- Starting solve A x = Q L x ')
-    for target, neig in zip(targets, neiglist):
-        print('Current target: ', target)
-        L, v, eigensolver = get_mat_vp_slepc(
-            A = AA, 
-            B = BB,
-            target = target, 
-            n=neig,
-            return_eigensolver=True, 
-            verbose=True,
-            precond_type=PETSc.PC.Type.LU, 
-            eps_type=SLEPc.EPS.Type.KRYLOVSCHUR,
-            ksp_type=PETSc.KSP.Type.PREONLY,
-            tol=1e-9)
-
-        LAMBDA = np.hstack((LAMBDA, L))
-        V = np.hstack((V, v)) 
-    np.save(save_npz_path + 'muk_py', LAMBDA)
-    np.save(save_npz_path + 'rk_py', V)
-    savemat(outfile=save_npz_path + 'muk_py.mat', mat=LAMBDA, matname='muk')
-    savemat(outfile=save_npz_path + 'rk_py.mat', mat=V, matname='rk')
-
-
-    print('--- Starting solve A^H x = Q L* x ')
-    LAMBDA = np.zeros((0,), dtype=complex)
-    V = np.zeros((sz, 0), dtype=complex)
-    for target, neig in zip(targets, neiglist):
-        print('Current target: ', target)
-        L, v, eigensolver = get_mat_vp_slepc(
-            A = np.conj(AA.transpose()), 
-            B = np.conj(BB.transpose()),
-            target = np.conj(target), 
-            n=neig,
-            return_eigensolver=True, 
-            verbose=True,
-            precond_type=PETSc.PC.Type.LU, 
-            eps_type=SLEPc.EPS.Type.KRYLOVSCHUR,
-            ksp_type=PETSc.KSP.Type.PREONLY,
-            tol=1e-9)
-
-        LAMBDA = np.hstack((LAMBDA, L))
-        V = np.hstack((V, v)) 
-    np.save(save_npz_path + 'mukstar_py', LAMBDA)
-    np.save(save_npz_path + 'lk_py', V)
-    savemat(outfile=save_npz_path + 'mukstar_py.mat', mat=LAMBDA, matname='mukstar')
-    savemat(outfile=save_npz_path + 'lk_py.mat', mat=V, matname='lk')
+    # solve A@x = Q*L@x and A^H@x = Q^H*L*@x with the same factorizations
+    # store (warm start for continuation, e.g. when the base flow changes)
+    store = EigenStore(save_npz_path + 'eig_store.h5')
+    print('--- Starting solve A x = Q L x and A^H x = Q^H L* x')
+    LAMBDA, V, W = compute_eig_targets(A=AA, Q=BB, targets=targets,
+                                       neiglist=neiglist, tol=1e-9, verbose=True,
+                                       store=store)
+    if PETSc.COMM_WORLD.getRank() == 0:
+        np.save(save_npz_path + 'muk_py', LAMBDA)
+        np.save(save_npz_path + 'rk_py', V)
+        savemat(outfile=save_npz_path + 'muk_py.mat', mat=LAMBDA, matname='muk')
+        savemat(outfile=save_npz_path + 'rk_py.mat', mat=V, matname='rk')
+        np.save(save_npz_path + 'mukstar_py', np.conj(LAMBDA))
+        np.save(save_npz_path + 'lk_py', W)
+        savemat(outfile=save_npz_path + 'mukstar_py.mat', mat=np.conj(LAMBDA), matname='mukstar')
+        savemat(outfile=save_npz_path + 'lk_py.mat', mat=W, matname='lk')
 
     print('Elapsed: %f' %(time.time() - t0))
     print('...............................')
@@ -22,6 +22,17 @@ import functools
 
 import pdb
 import warnings
+import hashlib
+import h5py
+
+try:
+    import mpi_utils
+except ImportError:
+    # utils/ not on the path: mpi_utils lives in the parent directory
+    import os
+    import sys
+    sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    import mpi_utils
 
 
 # PETSc, scipy.sparse utility # GOTO ##########################################
@@ -236,6 +247,333 @@ def get_mat_vp_slepc(A, B=None, n=10, DEBUG=False, target=0.0,
     return LAMBDA, V, eigensolver
 
 
+# Eig driver (direct + adjoint, shared factorization) # GOTO ##################
+def sparse_to_petscmat_comm(A, comm):
+    '''Cast global scipy.sparse matrix A to PETSc.Mat() distributed on comm'''
+    A = A.tocsr()
+    Amat = PETSc.Mat().create(comm=comm)
+    Amat.setSizes(A.shape)
+    Amat.setType(PETSc.Mat.Type.AIJ)
+    Amat.setUp()
+    istart, iend = Amat.getOwnershipRange()
+    Amat.setPreallocationCSR((
+        A.indptr[istart:iend+1] - A.indptr[istart],
+        A.indices[A.indptr[istart]:A.indptr[iend]],
+        A.data[A.indptr[istart]:A.indptr[iend]]))
+    Amat.assemble()
+    return Amat
+
+
+def group_targets(targets, neiglist, radius=0.0):
+    '''Group targets closer than radius to each other into a single shift
+    (their mean), requesting the sum of their number of eigenvalues,
+    so that they share a single factorization of A - shift*Q'''
+    targets = np.asarray(targets, dtype=complex).ravel()
+    neiglist = np.asarray(neiglist, dtype=int).ravel()
+    groups = []
+    for target, neig in zip(targets, neiglist):
+        for group in groups:
+            if np.min(np.abs(np.array(group[0]) - target)) <= radius:
+                group[0].append(target)
+                group[1] += neig
+                break
+        else:
+            groups.append([[target], neig])
+    shifts = np.array([np.mean(group[0]) for group in groups])
+    nevs = np.array([group[1] for group in groups])
+    return shifts, nevs
+
+
+def array_to_petscvecs(X, A):
+    '''Cast global array X (n, k) to list of PETSc.Vec() with the layout of A
+    (real and imaginary parts as separate vectors if PETSc scalars are real,
+    zero parts being dropped consistently on all processes of A)'''
+    istart, iend = A.getOwnershipRange()
+    X = np.asarray(X).reshape(A.size[0], -1)[istart:iend]
+    if np.iscomplexobj(PETSc.ScalarType()):
+        cols = [X[:, i] for i in range(X.shape[1])]
+    else:
+        parts = [part[:, i] for i in range(X.shape[1])
+                 for part in (np.real(X), np.imag(X))]
+        is_nonzero = [bool(np.any(part)) for part in parts]
+        is_nonzero = np.any(A.getComm().tompi4py().allgather(is_nonzero), axis=0)
+        cols = [part for part, keep in zip(parts, is_nonzero) if keep]
+    vecs = []
+    for col in cols:
+        vec = A.createVecRight()
+        vec.setArray(col)
+        vecs.append(vec)
+    return vecs
+
+
+def get_eig_direct_adjoint(A, B, shift, n, tol=1e-9, niter=1000, verbose=False,
+                           V0=None, W0=None):
+    '''Get n eigenvalues of (A, B) closest to shift, with direct (A v = L B v)
+    and adjoint (A^H w = conj(L) B^H w) eigenvectors.
+    A single LU factorization of A - shift*B is performed (shift-invert), and
+    adjoint eigenvectors are obtained as left eigenvectors with two-sided
+    Krylov-Schur, i.e. with transpose solves reusing the same factorization.
+    Initial right (resp. left) subspace may be given as global arrays V0 (resp. W0),
+    e.g. eigenvectors of a nearby operator (see EigenStore).
+    A,B::PETSc.Mat (possibly distributed)'''
+    eigensolver = SLEPc.EPS().create(comm=A.getComm())
+    eigensolver.setType(SLEPc.EPS.Type.KRYLOVSCHUR)
+    eigensolver.setProblemType(SLEPc.EPS.ProblemType.GNHEP)
+    eigensolver.setTwoSided(True)
+    eigensolver.setOperators(A, B)
+    eigensolver.setTarget(shift)
+    eigensolver.setWhichEigenpairs(SLEPc.EPS.Which.TARGET_MAGNITUDE)
+    eigensolver.setTolerances(tol, niter)
+    eigensolver.setDimensions(nev=n)
+
+    st = eigensolver.getST()
+    st.setType(SLEPc.ST.Type.SINVERT)
+    ksp = st.getKSP()
+    ksp.setType(PETSc.KSP.Type.PREONLY)
+    pc = ksp.getPC()
+    pc.setType(PETSc.PC.Type.LU)
+    pc.setFactorSolverType('mumps')
+    eigensolver.setFromOptions()
+
+    if V0 is not None:
+        eigensolver.setInitialSpace(array_to_petscvecs(V0, A))
+    if W0 is not None:
+        eigensolver.setLeftInitialSpace(array_to_petscvecs(W0, A))
+
+    eigensolver.solve()
+    nconv = eigensolver.getConverged()
+    if verbose:
+        print('Shift %s: %d converged in %d iterations'
+              %(shift, nconv, eigensolver.getIterationNumber()))
+
+    comm = A.getComm().tompi4py()
+    def gather(Vr, Vi):
+        return np.concatenate(comm.allgather(Vr.getArray() + 1j*Vi.getArray()))
+
+    sz = A.size[0]
+    nkeep = min(n, nconv)
+    valp = np.zeros((nkeep,), dtype=complex)
+    V = np.zeros((sz, nkeep), dtype=complex)
+    W = np.zeros((sz, nkeep), dtype=complex)
+    Vr, Vi = A.createVecs()
+    for i in range(nkeep):
+        valp[i] = eigensolver.getEigenpair(i, Vr=Vr, Vi=Vi)
+        V[:, i] = gather(Vr, Vi)
+        eigensolver.getLeftEigenvector(i, Vr, Vi)
+        W[:, i] = gather(Vr, Vi)
+        if verbose:
+            print('Eig%2d = %9f + %9f*j' % (i+1, np.real(valp[i]), np.imag(valp[i])))
+
+    return valp, V, W, eigensolver
+
+
+def normalize_adjoint(V, W, Q):
+    '''Scale adjoint eigenvectors W such that W[:, i]^H Q V[:, i] = 1'''
+    scale = np.sum(W.conj() * (Q @ V), axis=0)
+    return W / scale.conj()
+
+
+def compute_eig_targets(A, Q, targets, neiglist, radius=0.0, n_groups=None,
+                        tol=1e-9, verbose=False, store=None, follow=False,
+                        return_groups=False, comm=None):
+    '''Compute direct and adjoint eigenpairs of (A, Q) around several targets.
+    Targets closer than radius share a shift (see group_targets). Shifts are
+    distributed between n_groups sub-communicators of comm (default: COMM_WORLD, 1 group
+    per process), each one computing its shifts with get_eig_direct_adjoint.
+    If store (EigenStore) is given, eigenpairs of the exact same operator and
+    targets (i.e. same shifts and number of eigenvalues) are read from it, otherwise the computation is warm-started with the eigenvectors of the
+    closest operator in store (for each shift, those of the closest previous shift),
+    and the result is added to store. If follow, shifts requesting a single
+    eigenvalue are moved to the matching previous eigenvalue (continuation).
+    A,Q::scipy.sparse (global)
+    Return eigenvalues L, direct V and adjoint W eigenvectors (normalized such that
+    W^H Q V = I), gathered on all processes, sorted by shift
+    (and if return_groups: shifts and index of shift for each eigenvalue)'''
+    if comm is None:
+        comm = PETSc.COMM_WORLD
+    comm = mpi_utils.mpi4py_comm(comm)
+    shifts, nevs = group_targets(targets, neiglist, radius=radius)
+
+    previous = None
+    if store is not None:
+        key = store.get_key(A, Q, shifts, nevs)
+        if key in store:
+            if verbose:
+                print('Eigenpairs read from store: %s' %(key))
+            L, V, W, shifts, groups = store.read(key)
+            if return_groups:
+                return L, V, W, shifts, groups
+            return L, V, W
+        previous = store.read_nearest(A, Q)
+
+    init = [(None, None)] * len(shifts)
+    if previous is not None:
+        L0, V0, W0, shifts0, groups0 = previous
+        for ii, shift in enumerate(shifts):
+            jj = np.argmin(np.abs(shifts0 - shift))
+            in_group = groups0 == jj
+            if not np.any(in_group):
+                # no converged eigenvalue at closest previous shift: keep target
+                continue
+            init[ii] = (V0[:, in_group], W0[:, in_group])
+            if follow and nevs[ii] == 1:
+                shifts[ii] = L0[in_group][np.argmin(np.abs(L0[in_group] - shift))]
+
+    if n_groups is None:
+        n_groups = comm.Get_size()
+    n_groups = min(n_groups, comm.Get_size())
+    color, subcomm = mpi_utils.split_comm(n_groups, comm)
+
+    Amat = sparse_to_petscmat_comm(A, PETSc.Comm(subcomm))
+    Qmat = sparse_to_petscmat_comm(Q, PETSc.Comm(subcomm))
+
+    def eig_at(ii):
+        L, V, W, _ = get_eig_direct_adjoint(Amat, Qmat, shift=shifts[ii],
+                                            n=nevs[ii], tol=tol, verbose=verbose,
+                                            V0=init[ii][0], W0=init[ii][1])
+        return L, V, W
+
+    all_results = mpi_utils.map_groups(eig_at, len(shifts), color, n_groups,
+                                       subcomm, comm)
+    subcomm.Free()
+
+    L = np.concatenate([all_results[ii][0] for ii in range(len(shifts))])
+    V = np.hstack([all_results[ii][1] for ii in range(len(shifts))])
+    W = normalize_adjoint(V, np.hstack([all_results[ii][2] for ii in range(len(shifts))]), Q)
+    groups = np.concatenate([np.full(len(all_results[ii][0]), ii)
+                             for ii in range(len(shifts))])
+
+    if store is not None:
+        store.write(key, A, Q, L, V, W, shifts, groups)
+    if return_groups:
+        return L, V, W, shifts, groups
+    return L, V, W
+
+
+class EigenStore():
+    '''Persistent store of eigenpairs in an HDF5 file, keyed by hash of the operator
+    and of the requested shifts.
+    Each entry holds eigenvalues L, direct V and adjoint W eigenvectors, shifts
+    and shift index of each eigenvalue (see compute_eig_targets), as well as
+    the sparsity pattern hash and a random sketch of the values of (A, Q),
+    used to find the closest operator (e.g. previous base flow in a Re sweep).
+    Writing is done by rank 0 of comm (default: COMM_WORLD) only, and comm
+    should be the communicator passed to compute_eig_targets.'''
+    def __init__(self, path, n_sketch=16, seed=0, comm=None):
+        self.path = str(path)
+        self.n_sketch = n_sketch
+        self.seed = seed
+        if comm is None:
+            comm = PETSc.COMM_WORLD
+        self.comm = mpi_utils.mpi4py_comm(comm)
+
+    @staticmethod
+    def _hash_arrays(*arrays):
+        '''Hash of the content of arrays'''
+        sha = hashlib.sha1()
+        for array in arrays:
+            sha.update(np.ascontiguousarray(array).view(np.uint8))
+        return sha.hexdigest()
+
+    def get_pattern(self, A, Q):
+        '''Hash of the sparsity pattern of (A, Q), i.e. of the discretization'''
+        A, Q = A.tocsr(), Q.tocsr()
+        return self._hash_arrays(np.array(A.shape), A.indptr, A.indices,
+                                 Q.indptr, Q.indices)
+
+    def get_key(self, A, Q, shifts, nevs):
+        '''Hash of (A, Q), pattern and values, and of the requested shifts and
+        number of eigenvalues per shift (see group_targets)'''
+        A, Q = A.tocsr(), Q.tocsr()
+        return self._hash_arrays(np.array(A.shape), A.indptr, A.indices, A.data,
+                                 Q.indptr, Q.indices, Q.data,
+                                 np.asarray(shifts, dtype=complex),
+                                 np.asarray(nevs, dtype=np.int64))
+
+    def get_sketch(self, A, Q):
+        '''Random projection of the values of (A, Q): the distance between sketches
+        approximates the Frobenius distance between operators of same pattern'''
+        data = np.concatenate((A.tocsr().data, Q.tocsr().data))
+        rng = np.random.default_rng(self.seed)
+        sketch = np.zeros((self.n_sketch,), dtype=data.dtype)
+        chunk = 2**20
+        for istart in range(0, len(data), chunk):
+            block = data[istart:istart+chunk]
+            sketch += rng.standard_normal((self.n_sketch, len(block))) @ block
+        return sketch / np.sqrt(self.n_sketch)
+
+    def __contains__(self, key):
+        contains = False
+        if self.comm.Get_rank() == 0:
+            try:
+                with h5py.File(self.path, 'r') as f:
+                    contains = key in f
+            except OSError:
+                pass
+        return self.comm.bcast(contains, root=0)
+
+    def keys(self):
+        '''Keys of entries in store'''
+        keys = []
+        if self.comm.Get_rank() == 0:
+            try:
+                with h5py.File(self.path, 'r') as f:
+                    keys = list(f.keys())
+            except OSError:
+                pass
+        return self.comm.bcast(keys, root=0)
+
+    def write(self, key, A, Q, L, V, W, shifts, groups):
+        '''Write entry (see compute_eig_targets for content)'''
+        if self.comm.Get_rank() == 0:
+            with h5py.File(self.path, 'a') as f:
+                if key in f:
+                    del f[key]
+                grp = f.create_group(key)
+                grp.attrs['pattern'] = self.get_pattern(A, Q)
+                grp.create_dataset('sketch', data=self.get_sketch(A, Q))
+                for name, data in zip(['L', 'V', 'W', 'shifts', 'groups'],
+                                      [L, V, W, shifts, groups]):
+                    grp.create_dataset(name, data=data)
+        self.comm.Barrier()
+
+    def read(self, key):
+        '''Read entry, return L, V, W, shifts, groups'''
+        entry = None
+        if self.comm.Get_rank() == 0:
+            with h5py.File(self.path, 'r') as f:
+                entry = tuple(f[key][name][()] for name in
+                              ['L', 'V', 'W', 'shifts', 'groups'])
+        return self.comm.bcast(entry, root=0)
+
+    def find_nearest(self, A, Q):
+        '''Key of the entry with same pattern as (A, Q) and closest sketch
+        (None if no such entry)'''
+        nearest = None
+        if self.comm.Get_rank() == 0:
+            pattern = self.get_pattern(A, Q)
+            sketch = self.get_sketch(A, Q)
+            dmin = np.inf
+            try:
+                with h5py.File(self.path, 'r') as f:
+                    for key, grp in f.items():
+                        if grp.attrs['pattern'] != pattern:
+                            continue
+                        dist = np.linalg.norm(grp['sketch'][()] - sketch)
+                        if dist < dmin:
+                            nearest, dmin = key, dist
+            except OSError:
+                pass
+        return self.comm.bcast(nearest, root=0)
+
+    def read_nearest(self, A, Q):
+        '''Read entry of closest operator (see find_nearest), or None'''
+        key = self.find_nearest(A, Q)
+        if key is None:
+            return None
+        return self.read(key)
+
+
 #################################################################################
 #################################################################################
 #################################################################################
@@ -0,0 +1,327 @@
+"""
+Frequency response utility: fast frequency responses of (batches of) state-space
+systems from their Hessenberg form, singular values, H2 and Hinf norms, for the
+screening of many candidate controllers (e.g. youla_utils.YoulaLaguerre.matrices_batch)
+"""
+
+import numpy as np
+import scipy.linalg as la
+import control
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def ssdata_batch(sys_list):
+    """Stack matrices of systems of equal order and dimensions (or a single system)
+    Return A (nb, n, n), B (nb, n, nu), C (nb, ny, n), D (nb, ny, nu)"""
+    if isinstance(sys_list, control.StateSpace):
+        sys_list = [sys_list]
+    return tuple(
+        np.stack([np.asarray(M, dtype=float) for M in Ms])
+        for Ms in zip(*[control.ssdata(sys) for sys in sys_list])
+    )
+
+
+def _atleast_3d(*mats):
+    """Add batch dimension to matrices given for a single system"""
+    return tuple(np.asarray(M)[None] if np.ndim(M) == 2 else np.asarray(M) for M in mats)
+
+
+def hessenberg_ss(A, B, C):
+    """Orthogonal similarity to upper Hessenberg form, for each system of a batch:
+    H = Q^T A Q, Bh = Q^T B, Ch = C Q (same transfer function).
+    Return H, Bh, Ch with batch dimension"""
+    A, B, C = _atleast_3d(A, B, C)
+    H = np.empty_like(A)
+    Bh = np.empty_like(B)
+    Ch = np.empty_like(C)
+    for k in range(A.shape[0]):
+        H[k], Q = la.hessenberg(A[k], calc_q=True)
+        Bh[k] = Q.T @ B[k]
+        Ch[k] = C[k] @ Q
+    return H, Bh, Ch
+
+
+def _solve_shifted_hessenberg(H, B, s):
+    """Solve (s I - H) X = B for upper Hessenberg H (nb, n, n), B (nb, n, nu) and
+    all s (nw,), by Gaussian elimination with partial pivoting on the subdiagonal,
+    vectorized over systems and frequencies: O(n^2) per system and frequency.
+    Pivoting modifies the rows of each (system, frequency) pair differently, so
+    an n x n working copy is made for each of the nb * nw pairs: callers bound
+    nb * nw (see freqresp).
+    Return X (nb, nw, n, nu)"""
+    nb, n, nu = B.shape
+    nw = len(s)
+    # systems and frequencies on last axis, so that row operations are contiguous
+    M = np.empty((n, n, nb, nw), dtype=complex)
+    M[:] = -H.transpose(1, 2, 0)[..., None]
+    M[np.arange(n), np.arange(n)] += s
+    M = M.reshape(n, n, nb * nw)
+    X = np.empty((n, nu, nb, nw), dtype=complex)
+    X[:] = B.transpose(1, 2, 0)[..., None]
+    X = X.reshape(n, nu, nb * nw)
+    for k in range(n - 1):
+        # pivoting between rows k and k+1 (the only nonzero entries of column k)
+        swap = np.abs(M[k + 1, k]) > np.abs(M[k, k])
+        if np.any(swap):
+            Mk = M[k, k:, swap]
+            M[k, k:, swap] = M[k + 1, k:, swap]
+            M[k + 1, k:, swap] = Mk
+            Xk = X[k, :, swap]
+            X[k, :, swap] = X[k + 1, :, swap]
+            X[k + 1, :, swap] = Xk
+        l = M[k + 1, k] / M[k, k]
+        M[k + 1, k:] -= l * M[k, k:]
+        X[k + 1] -= l * X[k]
+    # back substitution
+    for k in range(n - 1, -1, -1):
+        X[k] -= np.einsum("jp,jmp->mp", M[k, k + 1 :], X[k + 1 :])
+        X[k] /= M[k, k]
+    return X.reshape(n, nu, nb, nw).transpose(2, 3, 0, 1)
+
+
+def freqresp(A, B, C, D, w, hessenberg=False, chunk=256):
+    """Frequency responses C (jw I - A)^-1 B + D of a batch of systems
+    (matrices stacked as in ssdata_batch, or a single system) on pulsations w.
+    Systems are reduced once to Hessenberg form (unless hessenberg=True, i.e.
+    matrices are already from hessenberg_ss), then each frequency costs a
+    Hessenberg solve. The elimination works on one n x n copy per (system,
+    frequency) pair, so systems and frequencies are processed by blocks of at
+    most chunk pairs: working memory is O(chunk n^2), whatever the batch size.
+    Return H (nb, nw, ny, nu)"""
+    A, B, C, D = _atleast_3d(A, B, C, D)
+    if not hessenberg:
+        A, B, C = hessenberg_ss(A, B, C)
+    w = np.atleast_1d(np.asarray(w, dtype=float))
+    nb, ny, nu = D.shape
+    nw_blk = max(1, min(len(w), chunk))
+    nb_blk = max(1, chunk // nw_blk)
+    Hw = np.empty((nb, len(w), ny, nu), dtype=complex)
+    for b0 in range(0, nb, nb_blk):
+        bs = slice(b0, b0 + nb_blk)
+        for i0 in range(0, len(w), nw_blk):
+            ws = slice(i0, i0 + nw_blk)
+            X = _solve_shifted_hessenberg(A[bs], B[bs], 1j * w[ws])
+            Hw[bs, ws] = np.einsum("bij,bwjm->bwim", C[bs], X) + D[bs, None]
+    return Hw
+
+
+def sigma(A, B, C, D, w, **kwargs):
+    """Singular values of frequency responses (see freqresp)
+    Return s (nb, nw, min(ny, nu)), decreasing"""
+    return np.linalg.svd(freqresp(A, B, C, D, w, **kwargs), compute_uv=False)
+
+
+def spectral_abscissa(A):
+    """Largest real part of eigenvalues of A, for a batch of matrices (nb, n, n)"""
+    (A,) = _atleast_3d(A)
+    if A.shape[-1] == 0:
+        return np.full((A.shape[0],), -np.inf)
+    return np.max(np.real(np.linalg.eigvals(A)), axis=-1)
+
+
+def h2norm(A, B, C, D):
+    """H2 norms of a batch of systems: sqrt(trace(C X C^T)) with A X + X A^T + B B^T = 0
+    (inf if unstable or D != 0). Return array (nb,)"""
+    A, B, C, D = _atleast_3d(A, B, C, D)
+    abscissa = spectral_abscissa(A)
+    norms = np.full((A.shape[0],), np.inf)
+    for k in range(A.shape[0]):
+        if abscissa[k] < 0 and np.allclose(D[k], 0):
+            X = la.solve_continuous_lyapunov(A[k], -B[k] @ B[k].T)
+            norms[k] = np.sqrt(np.trace(C[k] @ X @ C[k].T))
+    return norms
+
+
+def _hamiltonian_imag_frequencies(A, B, C, D, gamma, eig_tol=1e-8):
+    """Pulsations w >= 0 such that gamma is a singular value of G(jw), from the
+    imaginary eigenvalues of the Hamiltonian matrix (Boyd & Balakrishnan, 1990).
+    With D = 0 (usual for plants and Laguerre controllers), the Hamiltonian is
+    [A, B B^T / gamma; -C^T C / gamma, -A^T] and no inversion is needed."""
+    if np.allclose(D, 0):
+        Ham = np.block([[A, B @ B.T / gamma], [-C.T @ C / gamma, -A.T]])
+    else:
+        R = D.T @ D - gamma**2 * np.eye(D.shape[1])
+        S = D @ D.T - gamma**2 * np.eye(D.shape[0])
+        Ar = A - B @ la.solve(R, D.T @ C)
+        Ham = np.block(
+            [[Ar, -gamma * B @ la.solve(R, B.T)], [gamma * C.T @ la.solve(S, C), -Ar.T]]
+        )
+    eigs = la.eigvals(Ham, overwrite_a=True, check_finite=False)
+    scale = max(1.0, np.max(np.abs(eigs))) if eigs.size else 1.0
+    imag = eigs[np.abs(np.real(eigs)) <= eig_tol * scale]
+    return np.unique(np.abs(np.imag(imag)))
+
+
+def hinfnorm(A, B, C, D, w=None, hinf_tol=1e-6, eig_tol=1e-8, max_iter=50):
+    """Hinf norms of a batch of systems, with the BBBS algorithm (Bruinsma &
+    Steinbuch, 1990; Boyd & Balakrishnan, 1990) as youla_utils.norm, but:
+    - the lower bound is initialized from the frequency grid w (default: log grid
+    around the eigenvalues moduli) and the pulsations of eigenvalues, evaluated at
+    once with the Hessenberg frequency response,
+    - frequency responses at interval midpoints also use the Hessenberg form,
+    - the Hamiltonian for D = 0 requires no inversion.
+    Return norms (nb,) (inf if unstable), pulsations of peaks (nb,)"""
+    A, B, C, D = _atleast_3d(A, B, C, D)
+    H, Bh, Ch = hessenberg_ss(A, B, C)
+    nb = A.shape[0]
+    norms = np.full((nb,), np.inf)
+    w_peak = np.full((nb,), np.nan)
+    for k in range(nb):
+        eigs = la.eigvals(H[k])
+        if eigs.size and np.max(np.real(eigs)) >= 0:
+            continue
+        wk = _default_grid(eigs) if w is None else np.asarray(w, dtype=float)
+        wk = np.concatenate(([0.0], wk, np.abs(np.imag(eigs))))
+        s = sigma(H[k], Bh[k], Ch[k], D[k], wk, hessenberg=True)[0, :, 0]
+        gamma_lb = max(np.max(s), la.norm(D[k], 2))
+        w_peak[k] = wk[np.argmax(s)]
+        for _ in range(max_iter):
+            gamma = gamma_lb * (1 + 2 * hinf_tol)
+            w_i = _hamiltonian_imag_frequencies(A[k], B[k], C[k], D[k], gamma, eig_tol)
+            if w_i.size < 2:
+                break
+            w_mid = (w_i[1:] + w_i[:-1]) / 2
+            s = sigma(H[k], Bh[k], Ch[k], D[k], w_mid, hessenberg=True)[0, :, 0]
+            if np.max(s) <= gamma_lb:
+                break
+            gamma_lb = np.max(s)
+            w_peak[k] = w_mid[np.argmax(s)]
+        norms[k] = gamma_lb
+    return norms, w_peak
+
+
+def hinfnorm_below(A, B, C, D, gamma, w, eig_tol=1e-8):
+    """Screening test ||G||inf < gamma for a batch of systems, with a single
+    Hamiltonian check per system (no imaginary eigenvalue: no crossing of gamma),
+    systems being first rejected if unstable or if their response on the frequency
+    grid w already exceeds gamma. Return boolean array (nb,)"""
+    A, B, C, D = _atleast_3d(A, B, C, D)
+    below = spectral_abscissa(A) < 0
+    below &= np.max(sigma(A, B, C, D, w)[..., 0], axis=1) < gamma
+    for k in np.flatnonzero(below):
+        if la.norm(D[k], 2) >= gamma:
+            below[k] = False
+        elif _hamiltonian_imag_frequencies(A[k], B[k], C[k], D[k], gamma, eig_tol).size:
+            below[k] = False
+    return below
+
+
+def _default_grid(eigs, n_w=200):
+    """Log grid of pulsations covering the moduli of eigenvalues"""
+    moduli = np.abs(eigs[np.abs(eigs) > 0]) if eigs.size else np.ones((1,))
+    if not moduli.size:
+        moduli = np.ones((1,))
+    return np.logspace(
+        np.log10(np.min(moduli)) - 2, np.log10(np.max(moduli)) + 2, n_w
+    )
+
+
+def feedback_batch(G, AK, BK, CK, DK, sign=+1):
+    """State matrices of closed loops feedback(G, K_k, sign) for a batch of
+    controllers K_k (stacked matrices, see ssdata_batch), with plant G.
+    As control.feedback: y = G(u), u = sign * K(y) (+1 in youla_utils).
+    Return Acl (nb, nG+nK, nG+nK), states ordered as [xG, xK]"""
+    AG, BG, CG, DG = (np.asarray(M, dtype=float) for M in control.ssdata(G))
+    AK, BK, CK, DK = _atleast_3d(AK, BK, CK, DK)
+    nb, nK = AK.shape[:2]
+    nG, nu = BG.shape
+    # u = U_G xG + U_K xK, with u = sign (CK xK + DK (CG xG + DG u))
+    F = np.linalg.inv(np.eye(nu) - sign * DK @ DG)
+    U_G = sign * F @ DK @ CG
+    U_K = sign * F @ CK
+    Acl = np.empty((nb, nG + nK, nG + nK))
+    Acl[:, :nG, :nG] = AG + BG @ U_G
+    Acl[:, :nG, nG:] = BG @ U_K
+    Acl[:, nG:, :nG] = BK @ (CG + DG @ U_G)
+    Acl[:, nG:, nG:] = AK + BK @ DG @ U_K
+    return Acl
+
+
+def _crossings(f, w):
+    """Linear interpolation weights of sign changes of f (..., nw) between
+    consecutive pulsations. Return mask (..., nw-1), weights t (..., nw-1)"""
+    f0, f1 = f[..., :-1], f[..., 1:]
+    mask = (f0 == 0) | (f0 * f1 < 0)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = np.where(f0 == f1, 0.0, f0 / (f0 - f1))
+    return mask, t
+
+
+def loop_margins(Lw, w):
+    """Stability margins of SISO loop transfers L(jw) (..., nw) on pulsations w,
+    for a negative feedback 1 + L (see screen_controllers):
+    - gain margin: 1/|L| at phase crossovers (L real negative), the most critical
+    one (closest to 1 in log scale), inf if none,
+    - phase margin (deg): 180 + arg(L) at gain crossovers (|L| = 1), the smallest
+    in absolute value, inf if none,
+    - modulus margin: min |1 + L| (distance to critical point).
+    Crossings are linearly interpolated between grid points.
+    Return gm, pm, mm"""
+    # phase crossover: Im(L) = 0 with Re(L) < 0
+    mask, t = _crossings(np.imag(Lw), w)
+    re = (1 - t) * np.real(Lw[..., :-1]) + t * np.real(Lw[..., 1:])
+    mask &= re < 0
+    with np.errstate(divide="ignore"):
+        log_gm = np.where(mask, -np.log(np.abs(re)), np.inf)
+    idx = np.argmin(np.abs(log_gm), axis=-1)[..., None]
+    gm = np.exp(np.take_along_axis(log_gm, idx, axis=-1)[..., 0])
+
+    # gain crossover: |L| = 1
+    with np.errstate(divide="ignore"):
+        mask, t = _crossings(np.log(np.abs(Lw)), w)
+    phase = np.unwrap(np.angle(Lw), axis=-1)
+    phase = (1 - t) * phase[..., :-1] + t * phase[..., 1:]
+    pm = np.degrees(np.angle(-np.exp(1j * phase)))  # 180 + arg(L) in (-180, 180]
+    pm = np.where(mask, pm, np.inf)
+    idx = np.argmin(np.abs(pm), axis=-1)[..., None]
+    pm = np.take_along_axis(pm, idx, axis=-1)[..., 0]
+
+    mm = np.min(np.abs(1 + Lw), axis=-1)
+    return gm, pm, mm
+
+
+def screen_controllers(
+    G, K, w, sign=+1, abscissa_max=0.0, min_modulus_margin=0.0, chunk=256
+):
+    """Screen a population of controllers K against plant G before any flow
+    simulation: closed-loop spectral abscissa for all candidates at once
+    (see feedback_batch), then stability margins of the stable ones on the
+    shared pulsation grid w, with the loop broken at the plant input:
+    L = -sign K G (see loop_margins; only modulus margin if several inputs).
+
+    Args:
+        G: plant (control.StateSpace)
+        K: list of controllers of equal order (control.StateSpace), or stacked
+            matrices (AK, BK, CK, DK), e.g. YoulaLaguerre.matrices_batch(theta)
+        w: pulsations grid
+        sign: feedback sign (+1 as in youla_utils)
+        abscissa_max: candidates with closed-loop spectral abscissa above are rejected
+        min_modulus_margin: candidates with modulus margin below are rejected
+
+    Return dict of arrays (nb,): abscissa, gm, pm, mm (nan if rejected as unstable),
+    accepted (boolean)
+    """
+    AK, BK, CK, DK = ssdata_batch(K) if not isinstance(K, tuple) else K
+    AK, BK, CK, DK = _atleast_3d(AK, BK, CK, DK)
+    nb = AK.shape[0]
+    abscissa = spectral_abscissa(feedback_batch(G, AK, BK, CK, DK, sign=sign))
+    stable = abscissa < abscissa_max
+    logger.info(f"Screening: {np.sum(stable)}/{nb} closed-loop stable controllers")
+
+    gm, pm, mm = (np.full((nb,), np.nan) for _ in range(3))
+    idx = np.flatnonzero(stable)
+    if idx.size:
+        Gw = freqresp(*(np.asarray(M) for M in control.ssdata(G)), w, chunk=chunk)[0]
+        Kw = freqresp(AK[idx], BK[idx], CK[idx], DK[idx], w, chunk=chunk)
+        Lw = -sign * Kw @ Gw  # (ns, nw, nu, nu)
+        if Lw.shape[-1] == 1:
+            gm[idx], pm[idx], mm[idx] = loop_margins(Lw[..., 0, 0], w)
+        else:
+            ILw = np.eye(Lw.shape[-1]) + Lw
+            mm[idx] = np.min(np.linalg.svd(ILw, compute_uv=False)[..., -1], axis=-1)
+
+    accepted = stable & ~(mm < min_modulus_margin)
+    return dict(abscissa=abscissa, gm=gm, pm=pm, mm=mm, accepted=accepted)
@@ -0,0 +1,351 @@
+"""
+Modal analysis utility: streaming modal decompositions of snapshots, computed on
+the fly during time-stepping (see FlowSolver.add_step_callback) instead of
+post-processing exported snapshot series
+"""
+
+import numpy as np
+import scipy.linalg as la
+import scipy.signal as ss
+import dolfin
+from dolfin import inner
+from mpi4py import MPI as mpi
+
+import utils_flowsolver as flu
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class WeightedSnapshots:
+    """Inner product of snapshots on fs.W weighted by the velocity mass matrix
+    (i.e. kinetic energy, pressure is carried along but not weighted).
+    Snapshots are local parts of distributed vectors (see dolfin local_range),
+    reductions are done over the communicator of the mesh of fs."""
+
+    def __init__(self, fs):
+        u, _ = dolfin.TrialFunctions(fs.W)
+        v, _ = dolfin.TestFunctions(fs.W)
+        self.Q = dolfin.as_backend_type(dolfin.assemble(inner(u, v) * fs.dx))
+        self.x = dolfin.Function(fs.W).vector()
+        self.Qx = dolfin.Function(fs.W).vector()
+        self.comm = flu.MpiUtils.mpi4py_comm(fs.mesh.mpi_comm())
+
+    def mult(self, x):
+        """Return local part of Q x"""
+        self.x.set_local(x)
+        self.x.apply("insert")
+        self.Q.mult(self.x, self.Qx)
+        return self.Qx.get_local()
+
+    def dot(self, X, Y):
+        """Return global X^T Y for local arrays X (n, k) or (n,), Y (n, l) or (n,)"""
+        return self.comm.allreduce(X.T @ Y, op=mpi.SUM)
+
+
+class IncrementalPOD:
+    """Streaming POD of perturbation snapshots fs.fields.up_ with an incremental,
+    rank-truncated SVD in the kinetic energy inner product (Brand, 2006):
+        X ~ U diag(S) V^T = U coefficients^T
+    with U Q-orthonormal (snapshot k ~ U coefficients[k]). Memory is bounded by
+    max_rank: only the basis U (local rows), singular values S and the time
+    coefficients are stored.
+    Optionally, online DMD (Hemati et al., 2014) is computed in the POD
+    coordinates with the (max_rank, max_rank) matrices
+        G = sum a_k a_k^T,  P = sum a_k+1 a_k^T
+    rotated whenever the basis is updated, so that growth rates and frequencies
+    may be estimated at any time (see dmd).
+
+    Usage: fs.add_step_callback(IncrementalPOD(fs, max_rank=20, every=10))
+
+    Args:
+        fs (FlowSolver): flow solver providing snapshots and function spaces
+        max_rank (int): maximum number of POD modes kept
+        every (int): take 1 snapshot every _every_ time steps
+        tol (float): relative tolerance for discarding singular values and
+            directions already in the basis
+        dmd (bool): compute online DMD
+        store_coefficients (bool): store time coefficients of snapshots
+    """
+
+    def __init__(
+        self, fs, max_rank=20, every=1, tol=1e-10, dmd=True, store_coefficients=True
+    ):
+        self.max_rank = max_rank
+        self.every = every
+        self.tol = tol
+        self.is_dmd = dmd
+        self.store_coefficients = store_coefficients
+        self.dt = fs.params_time.dt * every
+        self.inner = WeightedSnapshots(fs)
+
+        self.U = np.zeros((self.inner.x.local_size(), 0))
+        self.S = np.zeros((0,))
+        self.coefficients = np.zeros((0, 0))
+        self.times = []
+        self.G = np.zeros((0, 0))
+        self.P = np.zeros((0, 0))
+        self.a_last = None
+
+    def __call__(self, fs):
+        """Step callback: add snapshot every _every_ iterations"""
+        if fs.iter % self.every == 0:
+            self.update(fs.fields.up_.vector().get_local())
+            self.times.append(fs.t)
+
+    def _project(self, x):
+        """Coordinates p of x in basis U and Q-orthogonal residual e, norm(e),
+        with 1 step of reorthogonalization"""
+        p = self.inner.dot(self.U, self.inner.mult(x))
+        e = x - self.U @ p
+        Qe = self.inner.mult(e)
+        dp = self.inner.dot(self.U, Qe)
+        e = e - self.U @ dp
+        p = p + dp
+        ne = np.sqrt(max(self.inner.dot(e, self.inner.mult(e)), 0.0))
+        return p, e, ne
+
+    def update(self, x):
+        """Add snapshot x (local part of distributed vector on fs.W)"""
+        r = len(self.S)
+        p, e, ne = self._project(x)
+        nx = np.sqrt(np.sum(p**2) + ne**2)
+        if ne <= self.tol * max(nx, 1e-300):
+            ne = 0.0
+
+        # K = [diag(S) p; 0 ne] = Uk diag(Sk) Vk^T
+        K = np.zeros((r + 1, r + 1))
+        K[:r, :r] = np.diag(self.S)
+        K[:r, r] = p
+        K[r, r] = ne
+        Uk, Sk, _ = la.svd(K)
+        n_keep = min(self.max_rank, int(np.sum(Sk > self.tol * max(Sk[0], 1e-300))))
+        Uk, Sk = Uk[:, :n_keep], Sk[:n_keep]
+
+        e = e / ne if ne > 0 else np.zeros_like(e)
+        self.U = np.hstack((self.U, e[:, None])) @ Uk
+        self.S = Sk
+
+        # coordinates in new basis: a' = Uk^T [a; 0], new snapshot: Uk^T [p; ne]
+        T = Uk[:r, :].T
+        a_new = Uk.T @ np.append(p, ne)
+        if self.store_coefficients:
+            self.coefficients = np.vstack(
+                (self.coefficients @ T.T, a_new[None, :])
+            )
+        if self.is_dmd:
+            self.G = T @ self.G @ T.T
+            self.P = T @ self.P @ T.T
+            if self.a_last is not None:
+                a_last = T @ self.a_last
+                self.G += np.outer(a_last, a_last)
+                self.P += np.outer(a_new, a_last)
+            self.a_last = a_new
+
+    def dmd(self):
+        """Online DMD in POD coordinates: reduced operator Ar = P G^+
+
+        Returns:
+            eigenvalues mu (discrete-time, per snapshot interval), growth rates
+            and pulsations (log(mu)/dt), DMD modes (local rows, on fs.W)
+        """
+        if not self.is_dmd:
+            raise ValueError("IncrementalPOD was created with dmd=False")
+        Ar = self.P @ np.linalg.pinv(self.G, rcond=self.tol)
+        mu, Wr = la.eig(Ar)
+        lam = np.log(mu.astype(complex)) / self.dt
+        order = np.argsort(-np.real(lam))
+        return mu[order], np.real(lam[order]), np.imag(lam[order]), self.U @ Wr[:, order]
+
+    def energy(self):
+        """Energy fraction of each POD mode"""
+        return self.S**2 / np.sum(self.S**2)
+
+    def export_modes(self, fs, path, n_modes=None):
+        """Export velocity of POD modes to xdmf file in path (1 time step per mode)"""
+        n_modes = len(self.S) if n_modes is None else min(n_modes, len(self.S))
+        up = dolfin.Function(fs.W)
+        filename = path / "pod_modes.xdmf"
+        for k in range(n_modes):
+            up.vector().set_local(self.U[:, k])
+            up.vector().apply("insert")
+            u, _ = up.split(deepcopy=True)
+            flu.write_xdmf(
+                filename, u, "pod_mode", time_step=k, append=k > 0, write_mesh=k == 0
+            )
+        logger.info(f"Exported {n_modes} POD modes to: {filename}")
+
+    def save(self, path):
+        """Save singular values, time coefficients and DMD matrices on rank 0
+        (modes should be exported with export_modes)"""
+        if flu.MpiUtils.get_rank(self.inner.comm) == 0:
+            np.savez(
+                path,
+                S=self.S,
+                coefficients=self.coefficients,
+                times=np.asarray(self.times),
+                G=self.G,
+                P=self.P,
+            )
+
+
+class StreamingSPOD:
+    """Streaming spectral POD (Towne, Schmidt & Colonius, 2018) of perturbation
+    snapshots fs.fields.up_ with Welch's method: snapshots fill a buffer of
+    n_fft snapshots and, every n_fft-n_overlap snapshots, the windowed FFT of the
+    buffer (1 block) is spilled to a memory-mapped .npy file in path. The full time
+    series is never held in memory, and each process only stores its local rows
+    (spatial dimension distributed as in FlowSolver).
+    Fluctuations are taken with respect to the running mean at the time each
+    block is completed.
+
+    Usage:
+        spod = StreamingSPOD(fs, path, n_fft=128, n_overlap=64, every=10)
+        fs.add_step_callback(spod)
+        ...
+        freq, L = spod.compute(n_modes=3)
+
+    Args:
+        fs (FlowSolver): flow solver providing snapshots and function spaces
+        path (Path): directory for spilled blocks
+        n_fft (int): number of snapshots per block
+        n_overlap (int): number of snapshots shared by consecutive blocks
+        every (int): take 1 snapshot every _every_ time steps
+        window (str): window of blocks (see scipy.signal.get_window)
+    """
+
+    def __init__(self, fs, path, n_fft=128, n_overlap=64, every=1, window="hann"):
+        if not 0 <= n_overlap < n_fft:
+            raise ValueError("n_overlap should be in [0, n_fft)")
+        self.path = path
+        self.n_fft = n_fft
+        self.n_overlap = n_overlap
+        self.every = every
+        self.dt = fs.params_time.dt * every
+        self.window = ss.get_window(window, n_fft)
+        self.inner = WeightedSnapshots(fs)
+        self.rank = flu.MpiUtils.get_rank(self.inner.comm)
+
+        self.buffer = np.zeros((n_fft, self.inner.x.local_size()))
+        self.n_snapshots = 0
+        self.mean = np.zeros((self.inner.x.local_size(),))
+        self.blocks = []
+        self.freq = np.fft.rfftfreq(n_fft, d=self.dt)
+        self.eigs = dict()
+
+    def __call__(self, fs):
+        """Step callback: add snapshot every _every_ iterations"""
+        if fs.iter % self.every == 0:
+            self.update(fs.fields.up_.vector().get_local())
+
+    def update(self, x):
+        """Add snapshot x (local part of distributed vector on fs.W)"""
+        self.buffer[self.n_snapshots % self.n_fft] = x
+        self.n_snapshots += 1
+        self.mean += (x - self.mean) / self.n_snapshots
+        n_shift = self.n_fft - self.n_overlap
+        if (
+            self.n_snapshots >= self.n_fft
+            and (self.n_snapshots - self.n_fft) % n_shift == 0
+        ):
+            self._spill_block()
+
+    def _spill_block(self):
+        """FFT of (windowed, ordered) buffer, written to a memory-mapped file"""
+        istart = self.n_snapshots % self.n_fft
+        block = np.roll(self.buffer, -istart, axis=0) - self.mean
+        block_hat = np.fft.rfft(self.window[:, None] * block, axis=0)
+        filename = self.path / f"spod_block_{len(self.blocks)}_rank{self.rank}.npy"
+        block_mm = np.lib.format.open_memmap(
+            filename, mode="w+", dtype=complex, shape=block_hat.shape
+        )
+        block_mm[:] = block_hat
+        block_mm.flush()
+        del block_mm
+        self.blocks.append(filename)
+        self.eigs = dict()
+        logger.debug(f"SPOD block {len(self.blocks)} spilled to: {filename}")
+
+    def _get_Qhat(self, ifreq):
+        """Scaled Fourier coefficients of all blocks at frequency index ifreq,
+        read from memory-mapped files: array (n_local, n_blocks).
+        Snapshots are real and only non-negative frequencies are kept, so that the
+        spectrum is one-sided: energy of negative frequencies is added with a factor
+        2, except at zero and Nyquist frequencies (as scipy.signal.welch)."""
+        scale = np.sqrt(self.dt / (np.sum(self.window**2) * len(self.blocks)))
+        is_nyquist = self.n_fft % 2 == 0 and ifreq == len(self.freq) - 1
+        if ifreq != 0 and not is_nyquist:
+            scale *= np.sqrt(2)
+        return scale * np.array(
+            [np.load(filename, mmap_mode="r")[ifreq] for filename in self.blocks]
+        ).T
+
+    def _mult_complex(self, X):
+        """Return local part of Q X for complex X (n_local, k)"""
+        return np.array(
+            [
+                self.inner.mult(np.real(x)) + 1j * self.inner.mult(np.imag(x))
+                for x in X.T
+            ]
+        ).T
+
+    def _eig_frequency(self, ifreq):
+        """Eigendecomposition of the weighted cross-spectral density matrix
+        M = Qhat^H Q Qhat (n_blocks, n_blocks) at frequency index ifreq"""
+        if ifreq not in self.eigs:
+            Qhat = self._get_Qhat(ifreq)
+            M = self.inner.comm.allreduce(
+                Qhat.conj().T @ self._mult_complex(Qhat), op=mpi.SUM
+            )
+            L, Theta = la.eigh((M + M.conj().T) / 2)
+            order = np.argsort(L)[::-1]
+            self.eigs[ifreq] = (L[order], Theta[:, order])
+        return self.eigs[ifreq]
+
+    def compute(self, n_modes=None):
+        """Compute SPOD spectra on spilled blocks
+
+        Returns:
+            non-negative frequencies (n_freq,), SPOD energies (n_freq, n_modes)
+            as one-sided power spectral density (see _get_Qhat)
+        """
+        if not self.blocks:
+            raise ValueError("No complete block: more snapshots are required")
+        n_modes = len(self.blocks) if n_modes is None else min(n_modes, len(self.blocks))
+        logger.info(
+            f"Computing SPOD with {len(self.blocks)} blocks on {len(self.freq)} frequencies..."
+        )
+        L = np.array(
+            [self._eig_frequency(ifreq)[0][:n_modes] for ifreq in range(len(self.freq))]
+        )
+        return self.freq, L
+
+    def get_modes(self, ifreq, n_modes=1):
+        """SPOD modes (local rows, Q-orthonormal) at frequency index ifreq:
+        Psi = Qhat Theta L^(-1/2)"""
+        L, Theta = self._eig_frequency(ifreq)
+        n_modes = min(n_modes, len(L))
+        Qhat = self._get_Qhat(ifreq)
+        return Qhat @ Theta[:, :n_modes] / np.sqrt(np.maximum(L[:n_modes], 1e-300))
+
+    def export_modes(self, fs, path, ifreqs, n_modes=1):
+        """Export real part of velocity of SPOD modes at frequency indices ifreqs
+        to xdmf files in path (1 file per mode, 1 time step per frequency)"""
+        up = dolfin.Function(fs.W)
+        modes = [self.get_modes(ifreq, n_modes) for ifreq in ifreqs]
+        for k in range(min(n_modes, modes[0].shape[1])):
+            filename = path / f"spod_mode_{k}.xdmf"
+            for ii, ifreq in enumerate(ifreqs):
+                up.vector().set_local(np.real(modes[ii][:, k]))
+                up.vector().apply("insert")
+                u, _ = up.split(deepcopy=True)
+                flu.write_xdmf(
+                    filename,
+                    u,
+                    "spod_mode",
+                    time_step=self.freq[ifreq],
+                    append=ii > 0,
+                    write_mesh=ii == 0,
+                )
+        logger.info(f"Exported SPOD modes to: {path}")
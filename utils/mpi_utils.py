@@ -0,0 +1,43 @@
+"""
+MPI utility depending on mpi4py only, shared by utils_flowsolver (MpiUtils)
+and the SLEPc environment of eig/eig_utils (no dolfin import)
+"""
+
+from mpi4py import MPI as mpi
+
+
+def mpi4py_comm(comm):
+    """Get mpi4py communicator"""
+    try:
+        return comm.tompi4py()
+    except AttributeError:
+        return comm
+
+
+def split_comm(n_groups, comm=None):
+    """Split comm (default: COMM_WORLD) into n_groups sub-communicators of
+    contiguous processes, return (color, subcomm) of current process"""
+    if comm is None:
+        comm = mpi.COMM_WORLD
+    n_groups = min(n_groups, comm.Get_size())
+    color = comm.Get_rank() * n_groups // comm.Get_size()
+    return color, comm.Split(color=color, key=comm.Get_rank())
+
+
+def map_groups(fun, n_items, color, n_groups, subcomm, comm=None):
+    """Evaluate fun(ii) for ii in range(n_items), where item ii is handled by
+    group ii % n_groups (see split_comm, with color and subcomm of current process).
+    Results returned on rank 0 of each group are gathered on all processes
+    of comm (default: COMM_WORLD), in the order of items"""
+    if comm is None:
+        comm = mpi.COMM_WORLD
+    results = dict()
+    for ii in range(color, n_items, n_groups):
+        result = fun(ii)
+        if subcomm.Get_rank() == 0:
+            results[ii] = result
+
+    all_results = dict()
+    for results_group in comm.allgather(results):
+        all_results.update(results_group)
+    return [all_results[ii] for ii in range(n_items)]
@@ -0,0 +1,369 @@
+"""
+Rational approximation utility for frequency responses:
+AAA algorithm in barycentric form, vector fitting and
+fitting of real, stable state-space models
+"""
+
+import numpy as np
+import scipy.linalg as la
+import control
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def aaa(z, F, tol=1e-13, mmax=100):
+    """Set-valued AAA rational approximation (Nakatsukasa, Sete & Trefethen, 2018):
+    all columns of F share the same support points and weights.
+
+    z: sample points (M,), e.g. 1j*w
+    F: sampled values (M,) or (M, K)
+    tol: relative tolerance on max|F - r(z)|
+    mmax: maximum number of support points (degree mmax-1)
+
+    Return zj (m,), fj (m, K), wj (m,) describing
+    r(z) = sum_j wj fj / (z - zj) / sum_j wj / (z - zj) (see aaa_eval)
+    """
+    z = np.asarray(z).ravel()
+    F = np.asarray(F).reshape(len(z), -1)
+    M = len(z)
+    mmax = min(mmax, M - 1)
+
+    Fmax = np.max(np.abs(F))
+    J = np.ones(M, dtype=bool)  # points not in support
+    support = []
+    R = np.tile(np.mean(F, axis=0), (M, 1))
+    for _ in range(mmax):
+        err = np.linalg.norm(F - R, axis=1)
+        j = np.argmax(np.where(J, err, -1))
+        support.append(j)
+        J[j] = False
+
+        zj, fj = z[support], F[support]
+        C = 1 / (z[J, None] - zj[None, :])
+        Loewner = np.vstack(
+            [F[J, k, None] * C - C * fj[None, :, k] for k in range(F.shape[1])]
+        )
+        _, _, Vh = la.svd(Loewner, full_matrices=True)
+        wj = Vh[-1].conj()
+
+        R = F.copy()
+        R[J] = (C @ (wj[:, None] * fj)) / (C @ wj)[:, None]
+        if np.max(np.abs(F - R)) <= tol * Fmax:
+            break
+
+    return z[support], F[support], wj
+
+
+def aaa_eval(zz, zj, fj, wj):
+    """Evaluate AAA rational approximation (see aaa) at points zz
+    Return array of shape (len(zz), K)"""
+    zz = np.asarray(zz).ravel()
+    with np.errstate(divide="ignore", invalid="ignore"):
+        CC = 1 / (zz[:, None] - zj[None, :])
+        r = (CC @ (wj[:, None] * fj)) / (CC @ wj)[:, None]
+    # exact value at support points
+    ii, jj = np.nonzero(zz[:, None] == zj[None, :])
+    r[ii] = fj[jj]
+    return r
+
+
+def _initial_poles(w, n_poles):
+    """Initial poles for vector fitting: complex pairs with imaginary parts
+    log-spaced on the band of w and small damping, plus a real pole if n_poles is odd"""
+    n_pairs = n_poles // 2
+    beta = np.logspace(np.log10(max(w.min(), 1e-3 * w.max())), np.log10(w.max()), n_pairs)
+    poles = []
+    for b in beta:
+        poles += [-b / 100 + 1j * b, -b / 100 - 1j * b]
+    if n_poles % 2:
+        poles.append(-w.max())
+    return np.array(poles)
+
+
+def _sort_poles(poles, tol=1e-8):
+    """Sort poles as real poles, then complex pairs (p, conj(p)) with imag(p)>0"""
+    poles = np.asarray(poles, dtype=complex)
+    scale = np.maximum(np.abs(poles), 1)
+    real_poles = np.real(poles[np.abs(poles.imag) <= tol * scale])
+    upper = poles[poles.imag > tol * scale]
+    sorted_poles = list(real_poles.astype(complex))
+    for p in upper:
+        sorted_poles += [p, np.conj(p)]
+    return np.array(sorted_poles)
+
+
+def _pole_basis(s, poles):
+    """Real partial-fraction basis of size (len(s), len(poles)): 1/(s-p) for a real
+    pole, 1/(s-p)+1/(s-p*) and j/(s-p)-j/(s-p*) for a complex pair (p, p*)"""
+    Phi = np.zeros((len(s), len(poles)), dtype=complex)
+    ii = 0
+    while ii < len(poles):
+        p = poles[ii]
+        if p.imag == 0:
+            Phi[:, ii] = 1 / (s - p)
+            ii += 1
+        else:
+            Phi[:, ii] = 1 / (s - p) + 1 / (s - np.conj(p))
+            Phi[:, ii + 1] = 1j / (s - p) - 1j / (s - np.conj(p))
+            ii += 2
+    return Phi
+
+
+def _pole_realization(poles):
+    """Real realization (A, b) of the pole basis (see _pole_basis), i.e. such that
+    basis = (sI-A)^-1 b element-wise"""
+    n = len(poles)
+    A = np.zeros((n, n))
+    b = np.zeros(n)
+    ii = 0
+    while ii < n:
+        p = poles[ii]
+        if p.imag == 0:
+            A[ii, ii] = p.real
+            b[ii] = 1
+            ii += 1
+        else:
+            A[ii : ii + 2, ii : ii + 2] = [[p.real, p.imag], [-p.imag, p.real]]
+            b[ii : ii + 2] = [2, 0]
+            ii += 2
+    return A, b
+
+
+def _real_lstsq(M, rhs):
+    """Real least-squares solution of complex system M x = rhs"""
+    Mr = np.vstack([M.real, M.imag])
+    rr = np.concatenate([rhs.real, rhs.imag], axis=0)
+    return la.lstsq(Mr, rr)[0]
+
+
+def vector_fitting(w, H, n_poles, n_iter=10, poles=None, stable=True):
+    """Vector fitting (Gustavsen & Semlyen, 1999) of frequency response samples
+    with common real-stable poles for all input/output pairs.
+
+    w: pulsations (nw,)
+    H: samples (nw,), (nw, K) or (nw, ny, nu)
+    n_poles: number of poles (per input, see vf_to_ss)
+    poles: initial poles (default: see _initial_poles), e.g. from aaa
+    stable: if True, unstable poles are flipped to the left half-plane
+
+    Return poles (n_poles,), residues (n_poles, K) as real coefficients of
+    the pole basis (see _pole_basis), direct term d (K,)
+    """
+    w = np.asarray(w, dtype=float)
+    s = 1j * w
+    F = np.asarray(H).reshape(len(w), -1)
+    K = F.shape[1]
+
+    poles = _initial_poles(w, n_poles) if poles is None else _sort_poles(poles)
+    for _ in range(n_iter):
+        Phi = _pole_basis(s, poles)
+        N = len(poles)
+        # pole relocation: sigma(s)*F_k(s) = f_k(s), with common sigma
+        # QR of each column system keeps only rows acting on sigma coefficients
+        rows = []
+        rhs = []
+        for k in range(K):
+            Mk = np.hstack([Phi, np.ones((len(s), 1)), -F[:, k, None] * Phi])
+            Mk = np.vstack([Mk.real, Mk.imag])
+            fk = np.concatenate([F[:, k].real, F[:, k].imag])
+            Qk, Rk = la.qr(Mk, mode="economic")
+            rows.append(Rk[N + 1 :, N + 1 :])
+            rhs.append((Qk.T @ fk)[N + 1 :])
+        c_sigma = la.lstsq(np.vstack(rows), np.concatenate(rhs))[0]
+
+        A_sigma, b_sigma = _pole_realization(poles)
+        poles = np.linalg.eigvals(A_sigma - np.outer(b_sigma, c_sigma))
+        if stable:
+            poles = np.where(poles.real > 0, -np.conj(poles), poles)
+        poles = _sort_poles(poles)
+
+    # residue identification with fixed poles
+    Phi = _pole_basis(s, poles)
+    coefs = _real_lstsq(np.hstack([Phi, np.ones((len(s), 1))]), F)
+    return poles, coefs[:-1], coefs[-1]
+
+
+def vf_to_ss(poles, residues, d, ny=1, nu=1):
+    """Real state-space realization (A, B, C, D) of a vector-fitting model
+    (see vector_fitting) with ny outputs and nu inputs (K = ny*nu, row-major):
+    the pole realization is duplicated for each input"""
+    A_p, b_p = _pole_realization(poles)
+    N = len(poles)
+    residues = residues.reshape(N, ny, nu)
+    A = np.kron(np.eye(nu), A_p)
+    B = np.kron(np.eye(nu), b_p[:, None])
+    C = np.hstack([residues[:, :, j].T for j in range(nu)])
+    D = np.asarray(d).reshape(ny, nu)
+    return A, B, C, D
+
+
+def _freqresp_ss(A, B, C, D, w):
+    """Frequency response C(jwI-A)^-1 B + D of shape (nw, ny, nu)"""
+    n = A.shape[0]
+    return np.array(
+        [C @ np.linalg.solve(1j * ww * np.eye(n) - A, B) + D for ww in w]
+    )
+
+
+def _passivity_crossings(A, B, C, D, eig_tol=1e-8):
+    """Pulsations w >= 0 where the Hermitian part of H(jw) = C(jwI-A)^-1 B + D is
+    singular, from the imaginary eigenvalues of the Hamiltonian matrix of
+    H(s) + H(-s)^T (Grivet-Talocia, 2004), with R = D + D^T invertible"""
+    R = D + D.T
+    Ar = A - B @ la.solve(R, C)
+    Ham = np.block(
+        [[Ar, -B @ la.solve(R, B.T)], [C.T @ la.solve(R, C), -Ar.T]]
+    )
+    eigs = la.eigvals(Ham)
+    scale = max(1.0, np.max(np.abs(eigs))) if eigs.size else 1.0
+    imag = eigs[np.abs(np.real(eigs)) <= eig_tol * scale]
+    return np.unique(np.abs(np.imag(imag)))
+
+
+def enforce_passivity(A, B, C, D, w, margin=0.0, max_iter=20, eig_tol=1e-8):
+    """Enforce passivity of square model (i.e. positive semidefinite Hermitian part
+    of H(jw) for all w, up to margin) by shifting the direct term: D + delta*I.
+    This is the simplest (conservative) enforcement, as it only modifies D.
+    The shift is first computed on pulsations w and at infinity (D), then passivity
+    is checked between samples with the Hamiltonian test (see _passivity_crossings):
+    crossings and their midpoints are added to the samples, until no crossing is left.
+    Return D"""
+    n = D.shape[0]
+    w_check = np.asarray(w, dtype=float)
+    for _ in range(max_iter):
+        H = _freqresp_ss(A, B, C, D, w_check)
+        min_eig = min(
+            np.min(np.linalg.eigvalsh((Hw + Hw.conj().T) / 2))
+            for Hw in np.concatenate((H, D[None]))
+        )
+        if min_eig < margin:
+            logger.info(f"Enforcing passivity: shifting D by {margin - min_eig}")
+            D = D + (margin - min_eig) * np.eye(n)
+        # check slightly below margin: tangency at sampled minimum is not a crossing
+        tol = eig_tol * max(1.0, la.norm(D, 2))
+        w_c = _passivity_crossings(A, B, C, D - (margin - tol) * np.eye(n), eig_tol)
+        if not w_c.size:
+            return D
+        w_c = np.concatenate(([0.0], w_c))
+        w_check = np.concatenate((w_c, (w_c[1:] + w_c[:-1]) / 2))
+    logger.warning(f"Passivity not enforced after {max_iter} iterations")
+    return D
+
+
+def fit_ss(
+    w,
+    H,
+    orders=range(2, 31, 2),
+    tol=1e-2,
+    n_iter=10,
+    init="aaa",
+    passive=False,
+):
+    """Fit a real, stable, low-order control.StateSpace on frequency response samples
+    (e.g. from flu.get_Hw or flu.get_Hw_adaptive) with vector fitting.
+    The order is the smallest in orders (number of poles per input) reaching a relative
+    RMS error lower than tol, or the one with the lowest error.
+
+    w: pulsations (nw,)
+    H: samples (nw,), or (ny, nw) as returned by get_Hw (1 line = 1 sensor),
+        or (ny, nu, nw)
+    init: initial poles from AAA ("aaa", pruned to the order) or log-spaced ("log")
+    passive: enforce passivity (square systems only, see enforce_passivity)
+
+    Return control.StateSpace, dict of relative errors per order
+    """
+    w = np.asarray(w, dtype=float)
+    H = np.asarray(H)
+    if H.ndim == 1:
+        H = H[None, None, :]
+    elif H.ndim == 2:
+        H = H[:, None, :]
+    ny, nu, _ = H.shape
+    F = H.reshape(ny * nu, -1).T  # (nw, K)
+
+    errors = dict()
+    best = None
+    for order in orders:
+        poles = None
+        if init == "aaa":
+            zj, fj, wj = aaa(1j * w, F, tol=1e-10, mmax=order + 1)
+            poles = aaa_poles(zj, wj)
+            # one pole per conjugate pair (AAA may return both), then add conjugates
+            poles = poles[poles.imag >= -1e-8 * np.maximum(np.abs(poles), 1)]
+            is_real = np.abs(poles.imag) <= 1e-8 * np.maximum(np.abs(poles), 1)
+            poles = np.where(is_real, poles.real, poles)
+            poles = poles[np.argsort(np.abs(poles.real))][:order]
+            poles = np.where(poles.real > 0, -np.conj(poles), poles)
+            poles = np.concatenate([poles, np.conj(poles[np.abs(poles.imag) > 0])])
+            poles = _sort_poles(poles)[:order]
+            if len(poles) < order or np.any(poles[-1].imag > 0):
+                poles = None  # incomplete pair or not enough poles
+        poles, residues, d = vector_fitting(
+            w, F, n_poles=order, n_iter=n_iter, poles=poles
+        )
+        A, B, C, D = vf_to_ss(poles, residues, d, ny=ny, nu=nu)
+        Hfit = _freqresp_ss(A, B, C, D, w)
+        err = np.linalg.norm(Hfit.reshape(len(w), -1) - F) / np.linalg.norm(F)
+        errors[order] = err
+        logger.info(f"Fitting with {order} poles: relative error {err}")
+        if best is None or err < best[0]:
+            best = (err, A, B, C, D)
+        if err <= tol:
+            best = (err, A, B, C, D)
+            break
+
+    _, A, B, C, D = best
+    if passive:
+        D = enforce_passivity(A, B, C, D, w)
+    return control.StateSpace(A, B, C, D), errors
+
+
+def aaa_poles(zj, wj):
+    """Poles of AAA rational approximation (see aaa), as eigenvalues
+    of the generalized arrowhead pencil (Nakatsukasa et al., 2018)"""
+    m = len(zj)
+    E = np.zeros((m + 1, m + 1), dtype=complex)
+    E[0, 1:] = wj
+    E[1:, 0] = 1
+    E[1:, 1:] = np.diag(zj)
+    Bm = np.eye(m + 1, dtype=complex)
+    Bm[0, 0] = 0
+    poles = la.eigvals(E, Bm)
+    return poles[np.isfinite(poles)]
+
+
+def test_fit_ss(rtol=1e-6):
+    """Test fit_ss on samples of a known stable SISO system (2 lightly damped
+    pairs and a real pole): recovery of poles, stability of the fitted model,
+    and passivity enforcement (no Hamiltonian crossing left, see enforce_passivity)"""
+    poles_ref = np.array([-0.1 + 2j, -0.1 - 2j, -0.5 + 5j, -0.5 - 5j, -3.0])
+    residues_ref = np.array([1 + 0.5j, 1 - 0.5j, -2 + 1j, -2 - 1j, 4.0])
+    w = np.logspace(-1, 1.5, 300)
+    H = np.array([np.sum(residues_ref / (1j * wi - poles_ref)) for wi in w])
+
+    G, errors = fit_ss(w, H, orders=range(2, 11))
+    A, B, C, D = (np.asarray(M) for M in control.ssdata(G))
+    poles = np.linalg.eigvals(A)
+    dist = np.abs(poles[:, None] - poles_ref[None, :])
+    err_poles = max(np.max(np.min(dist, axis=1)), np.max(np.min(dist, axis=0)))
+    print("Fitting errors per order: ", errors)
+    print("Max distance to true poles: ", err_poles)
+    assert len(poles) == len(poles_ref) and err_poles <= rtol
+    assert np.all(np.real(poles) < 0)
+
+    D_passive = enforce_passivity(A, B, C, D, w)
+    H_fine = _freqresp_ss(A, B, C, D_passive, np.linspace(0, 100, 100001))
+    print("Passivity shift of D: ", D_passive - D)
+    print("Min Re(H) on fine grid after enforcement: ", np.min(np.real(H_fine)))
+    tol = 1e-8 * max(1.0, la.norm(D_passive, 2))
+    assert not _passivity_crossings(A, B, C, D_passive + tol * np.eye(1)).size
+    assert np.min(np.real(H_fine)) >= -tol
+    return G, D_passive
+
+
+if __name__ == "__main__":
+    print("*" * 50)
+    print("Testing fit_ss and enforce_passivity:")
+    test_fit_ss()
@@ -0,0 +1,253 @@
+"""
+Resolvent analysis utility: leading singular values and forcing/response modes
+of the resolvent R(w) = inv(jwQ-A), computed with randomized SVD
+"""
+
+import numpy as np
+import scipy.linalg as la
+import scipy.sparse as spr
+import scipy.sparse.linalg as spr_la
+import dolfin
+
+import utils_flowsolver as flu
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+class MassFactor:
+    """Factorization M_vv = F^T F of the velocity block of the mass matrix M,
+    defining the energy norm ||u||^2 = u^H M_vv u = ||F u||^2 on velocity DOFs.
+    F = D^(1/2) L^T P^T is obtained from the sparse LU factorization
+    P^T M_vv P = L D L^T (SuperLU in symmetric mode, without pivoting) of the
+    symmetric part of M_vv, or with lumped=True from its diagonal: F = diag(M_vv)^(1/2).
+    With equal-order elements, the mass matrix E contains stabilization terms
+    (see OperatorGetter.get_E) and the plain velocity mass matrix should be used."""
+
+    def __init__(self, M, vel_dofs, lumped=False):
+        M = flu.dense_to_sparse(M, eliminate_zeros=False).tocsr()
+        M_vv = M[vel_dofs][:, vel_dofs]
+        M_vv = ((M_vv + M_vv.T) / 2).tocsc()
+        self.lumped = lumped
+        if lumped:
+            self.perm = np.arange(M_vv.shape[0])
+            d = M_vv.diagonal()
+            self.L = spr.identity(M_vv.shape[0], format="csr")
+        else:
+            lu = spr_la.splu(
+                M_vv,
+                permc_spec="MMD_AT_PLUS_A",
+                diag_pivot_thresh=0,
+                options=dict(SymmetricMode=True),
+            )
+            d = lu.U.diagonal()
+            if not np.array_equal(lu.perm_r, lu.perm_c):
+                raise ValueError("Mass matrix factorization required pivoting")
+            self.perm = lu.perm_c
+            self.L = lu.L.tocsr()
+        if np.any(d <= 0):
+            raise ValueError("Mass matrix is not positive definite on velocity DOFs")
+        self.sqrtd = np.sqrt(d)[:, None]
+        self.Lt = self.L.T.tocsr()
+
+    def apply(self, x):
+        """Return F x"""
+        xp = np.empty_like(x)
+        xp[self.perm] = x
+        return self.sqrtd * (self.Lt @ xp)
+
+    def apply_inv(self, x):
+        """Return F^-1 x"""
+        return spr_la.spsolve_triangular(self.Lt, x / self.sqrtd, lower=False)[
+            self.perm
+        ]
+
+    def apply_T(self, x):
+        """Return F^T x"""
+        return (self.L @ (self.sqrtd * x))[self.perm]
+
+    def apply_inv_T(self, x):
+        """Return F^-T x"""
+        xp = np.empty_like(x)
+        xp[self.perm] = x
+        return spr_la.spsolve_triangular(self.L, xp, lower=True) / self.sqrtd
+
+
+def get_velocity_dofs(Q):
+    """Return velocity DOFs, i.e. nonzero diagonal of the mass matrix Q
+    (without pressure and Dirichlet DOFs)"""
+    Q = flu.dense_to_sparse(Q, eliminate_zeros=False).tocsr()
+    return np.flatnonzero(Q.diagonal())
+
+
+class ResolventOperator:
+    """Resolvent mapping forcing f to response u, both on velocity DOFs:
+        u = R(w) Q f
+    in the energy norm defined by weight (see MassFactor, default: built on Q):
+        L(w) = F P^T R(w) Q P F^-1,  M_vv = F^T F
+    where P extends velocity DOFs (see get_velocity_dofs) to the full state.
+    Forward and adjoint products share the factorization of flu.ResolventSolver."""
+
+    def __init__(self, solver, Q, weight=None):
+        self.solver = solver
+        self.Q = flu.dense_to_sparse(Q, eliminate_zeros=False).tocsr()
+        self.n = self.Q.shape[0]
+        self.vel_dofs = get_velocity_dofs(self.Q)
+        self.weight = MassFactor(self.Q, self.vel_dofs) if weight is None else weight
+
+    def _extend(self, x):
+        """Extend array from velocity DOFs to full state"""
+        x_full = np.zeros((self.n, x.shape[1]), dtype=complex)
+        x_full[self.vel_dofs] = x
+        return x_full
+
+    def matmat(self, F):
+        """Return L(w) F"""
+        U = self.solver.solve(self.Q @ self._extend(self.weight.apply_inv(F)))
+        return self.weight.apply(U[self.vel_dofs])
+
+    def rmatmat(self, G):
+        """Return L(w)^H G"""
+        F = self.Q.T @ self.solver.solve_adjoint(self._extend(self.weight.apply_T(G)))
+        return self.weight.apply_inv_T(F[self.vel_dofs])
+
+    def to_state(self, X):
+        """Map weighted velocity vectors (e.g. singular vectors) back to full state"""
+        return self._extend(self.weight.apply_inv(X))
+
+
+def randomized_svd(L, m, n_modes, n_oversample=5, n_power=1, seed=0):
+    """Randomized SVD of operator L (with matmat and rmatmat methods) acting on
+    vectors of size m, see Halko, Martinsson & Tropp (2011), with n_power power
+    iterations.
+    Each power iteration costs n_modes+n_oversample forward and adjoint solves.
+    Return U, S, V such that L ~ U diag(S) V^H"""
+    rng = np.random.default_rng(seed)
+    nl = n_modes + n_oversample
+    Omega = rng.standard_normal((m, nl)) + 1j * rng.standard_normal((m, nl))
+
+    Y, _ = la.qr(L.matmat(Omega), mode="economic")
+    for _ in range(n_power):
+        Z, _ = la.qr(L.rmatmat(Y), mode="economic")
+        Y, _ = la.qr(L.matmat(Z), mode="economic")
+
+    Bh = L.rmatmat(Y)  # B = Y^H L = (L^H Y)^H
+    Ub, S, Vh = la.svd(Bh.conj().T, full_matrices=False)
+    U = Y @ Ub
+    V = Vh.conj().T
+    return U[:, :n_modes], S[:n_modes], V[:, :n_modes]
+
+
+def compute_resolvent(
+    A,
+    Q,
+    ww,
+    n_modes=3,
+    n_oversample=5,
+    n_power=1,
+    seed=0,
+    return_modes=True,
+    n_groups=None,
+    comm=None,
+    M=None,
+    lumped=False,
+):
+    """Compute leading singular values and modes of the resolvent on the
+    pulsations ww. The frequency grid is split between n_groups MPI sub-communicators
+    of comm (default: COMM_WORLD, see flu.sweep_frequencies) and, at each pulsation,
+    a single factorization is used for forward and adjoint solves.
+    A, Q are global operators (e.g. from OperatorGetter in serial, or read from file).
+    Gains are measured in the energy norm of the mass matrix M (default: Q),
+    factorized once (see MassFactor), or approximated by its diagonal if lumped.
+
+    Returns:
+        dict with: w (nw,), S (nw, n_modes) gains, norm ("energy" or "lumped"),
+        and if return_modes: forcing, response (nw, ndof, n_modes) in full state
+    """
+    logger.info(f"Computing resolvent on {len(ww)} pulsations...")
+    weight = MassFactor(Q if M is None else M, get_velocity_dofs(Q), lumped=lumped)
+    L = ResolventOperator(None, Q, weight=weight)
+
+    def resolvent_at(solver, w):
+        L.solver = solver
+        U, S, V = randomized_svd(
+            L,
+            len(L.vel_dofs),
+            n_modes=n_modes,
+            n_oversample=n_oversample,
+            n_power=n_power,
+            seed=seed,
+        )
+        logger.info(f"Resolvent gains at w={w:5.3f}: {S}")
+        if return_modes:
+            return S, L.to_state(V), L.to_state(U)
+        return (S,)
+
+    results = flu.sweep_frequencies(
+        A, Q, ww, resolvent_at, n_groups=n_groups, comm=comm
+    )
+
+    resolvent = {
+        "w": np.asarray(ww),
+        "S": np.array([res[0] for res in results]),
+        "norm": "lumped" if lumped else "energy",
+    }
+    if return_modes:
+        resolvent["forcing"] = np.array([res[1] for res in results])
+        resolvent["response"] = np.array([res[2] for res in results])
+    return resolvent
+
+
+def get_velocity_mass_matrix(fs):
+    """Assemble the (unstabilized) velocity mass matrix of FlowSolver, zero on
+    Dirichlet rows, as scipy.sparse (e.g. energy weight M of compute_resolvent)"""
+    v, _ = dolfin.TestFunctions(fs.W)
+    u, _ = dolfin.TrialFunctions(fs.W)
+    M = dolfin.PETScMatrix()
+    dolfin.assemble(dolfin.dot(u, v) * dolfin.dx, tensor=M)
+    [bc.zero(M) for bc in fs.bc["bcu"]]
+    return flu.dense_to_sparse(M, eliminate_zeros=False)
+
+
+def compute_resolvent_flowsolver(fs, ww, **kwargs):
+    """Compute resolvent (see compute_resolvent) with operators from FlowSolver
+    (see OperatorGetter). With equal-order elements, the mass matrix E contains
+    stabilization terms, and gains are measured with the plain velocity mass matrix
+    (see get_velocity_mass_matrix) unless M is given."""
+    from operatorgetter import OperatorGetter  # avoid circular import
+
+    if fs.params_solver.is_equal_order:
+        kwargs.setdefault("M", get_velocity_mass_matrix(fs))
+    opget = OperatorGetter(fs)
+    return compute_resolvent(
+        opget.get_A(sparse=True), opget.get_E(sparse=True), ww, **kwargs
+    )
+
+
+def export_resolvent_modes(fs, resolvent, path, n_modes=None):
+    """Export real and imaginary parts of forcing and response velocity modes
+    to xdmf files in path (1 file per mode and kind, 1 time step per pulsation)"""
+    if "forcing" not in resolvent:
+        raise ValueError("Resolvent was computed without modes (return_modes=False)")
+    n_modes = resolvent["S"].shape[1] if n_modes is None else n_modes
+
+    up = dolfin.Function(fs.W)
+    rstart, rend = up.vector().local_range()
+    for kind in ["forcing", "response"]:
+        for k in range(n_modes):
+            for part, fpart in zip(["real", "imag"], [np.real, np.imag]):
+                filename = path / f"resolvent_{kind}_{k}_{part}.xdmf"
+                for iw, w in enumerate(resolvent["w"]):
+                    up.vector().set_local(fpart(resolvent[kind][iw, rstart:rend, k]))
+                    up.vector().apply("insert")
+                    u, _ = up.split(deepcopy=True)
+                    flu.write_xdmf(
+                        filename,
+                        u,
+                        f"{kind}_{part}",
+                        time_step=w,
+                        append=iw > 0,
+                        write_mesh=iw == 0,
+                    )
+    logger.info(f"Exported resolvent modes to: {path}")
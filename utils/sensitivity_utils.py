@@ -0,0 +1,115 @@
+"""
+Sensitivity utility: structural sensitivity (wavemaker) and base-flow modification
+sensitivity of an eigenvalue, from its direct and adjoint modes
+(Giannetti & Luchini, 2007; Marquet, Sipp & Jacquin, 2008)
+"""
+
+import numpy as np
+import dolfin
+from dolfin import dot, inner, grad, sqrt
+
+import utils_flowsolver as flu
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def mode_to_velocity(fs, x):
+    """Real and imaginary parts of the velocity of mode x, given as a global
+    complex array on fs.W (e.g. eigenvector from eig_utils.compute_eig_targets)
+
+    Return ur, ui dolfin.Function in fs.V"""
+    up = dolfin.Function(fs.W)
+    rstart, rend = up.vector().local_range()
+    velocity = []
+    for fpart in [np.real, np.imag]:
+        up.vector().set_local(fpart(np.asarray(x).ravel()[rstart:rend]))
+        up.vector().apply("insert")
+        u, _ = up.split(deepcopy=True)
+        velocity.append(u)
+    return tuple(velocity)
+
+
+def velocity_inner_product(fs, w, v):
+    """Complex inner product of velocities of modes w and v:
+    <w, v> = int conj(w).v dx"""
+    wr, wi = mode_to_velocity(fs, w)
+    vr, vi = mode_to_velocity(fs, v)
+    real = dolfin.assemble((inner(wr, vr) + inner(wi, vi)) * fs.dx)
+    imag = dolfin.assemble((inner(wr, vi) - inner(wi, vr)) * fs.dx)
+    return real + 1j * imag
+
+
+def structural_sensitivity(fs, v, w):
+    """Structural sensitivity (wavemaker) of eigenvalue with direct mode v and
+    adjoint mode w (Giannetti & Luchini, 2007):
+        S(x) = |w(x)| |v(x)| / |<w, v>|
+    i.e. bound of the eigenvalue drift induced by a localized feedback
+    from velocity to momentum at x. Its maxima are candidate locations for
+    actuator/sensor pairs.
+
+    Return S as dolfin.Function in fs.P (projected to degree of pressure)"""
+    vr, vi = mode_to_velocity(fs, v)
+    wr, wi = mode_to_velocity(fs, w)
+    norm_v = sqrt(inner(vr, vr) + inner(vi, vi))
+    norm_w = sqrt(inner(wr, wr) + inner(wi, wi))
+    scale = np.abs(velocity_inner_product(fs, w, v))
+    return flu.projectm(norm_v * norm_w / dolfin.Constant(scale), fs.P)
+
+
+def baseflow_sensitivity(fs, v, w):
+    """Sensitivity of eigenvalue (of A v = L Q v, A being the linearized operator
+    around the base flow U0) to base-flow modifications dU (Marquet et al., 2008):
+        dL = int G.dU dx,  G = -grad(v)^T conj(w) + grad(conj(w)) v
+    (with <w, v> = 1), obtained by differentiating -(U0.grad)v - (v.grad)U0
+    with respect to U0 and integrating by parts (div v = 0).
+    Real and imaginary parts of G are the sensitivities of growth rate and
+    pulsation to a base-flow modification.
+
+    Return Re(G), Im(G) as dolfin.Function in fs.V"""
+    vr, vi = mode_to_velocity(fs, v)
+    wr, wi = mode_to_velocity(fs, w)
+    Gr = -(dot(grad(vr).T, wr) + dot(grad(vi).T, wi)) + dot(grad(wr), vr) + dot(
+        grad(wi), vi
+    )
+    Gi = -(dot(grad(vi).T, wr) - dot(grad(vr).T, wi)) + dot(grad(wr), vi) - dot(
+        grad(wi), vr
+    )
+    # normalization with <w, v>: G/c = G*conj(c)/|c|^2
+    c = velocity_inner_product(fs, w, v)
+    cr = dolfin.Constant(np.real(c) / np.abs(c) ** 2)
+    ci = dolfin.Constant(np.imag(c) / np.abs(c) ** 2)
+    sensitivity_growth = flu.projectm(cr * Gr + ci * Gi, fs.V)
+    sensitivity_pulsation = flu.projectm(cr * Gi - ci * Gr, fs.V)
+    return sensitivity_growth, sensitivity_pulsation
+
+
+def compute_sensitivity_maps(fs, v, w):
+    """Compute structural sensitivity and base-flow modification sensitivity
+    (see structural_sensitivity, baseflow_sensitivity) of the eigenvalue with
+    direct mode v and adjoint mode w, given as global complex arrays on fs.W
+
+    Return dict of dolfin.Function"""
+    logger.info("Computing sensitivity maps...")
+    sensitivity_growth, sensitivity_pulsation = baseflow_sensitivity(fs, v, w)
+    return {
+        "wavemaker": structural_sensitivity(fs, v, w),
+        "baseflow_growth": sensitivity_growth,
+        "baseflow_pulsation": sensitivity_pulsation,
+    }
+
+
+def export_sensitivity_maps(maps, path, time_step=0.0, append=False):
+    """Export sensitivity maps (see compute_sensitivity_maps) to xdmf files in path
+    (1 file per map), e.g. with time_step=index of eigenvalue and append=True
+    for several eigenvalues"""
+    for name, field in maps.items():
+        flu.write_xdmf(
+            path / f"sensitivity_{name}.xdmf",
+            field,
+            name,
+            time_step=time_step,
+            append=append,
+        )
+    logger.info(f"Exported sensitivity maps to: {path}")
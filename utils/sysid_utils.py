@@ -0,0 +1,311 @@
+"""
+System identification utility: reduced-order LTI models identified from
+simulation data, with the Eigensystem Realization Algorithm (ERA) on impulse
+responses of the linearized model, or with subspace identification (MOESP/N4SID)
+on input/output time series (e.g. multisine runs)
+"""
+
+import numpy as np
+import scipy.linalg as la
+import control
+
+import utils_flowsolver as flu
+
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def impulse_responses(fs, num_steps=None, amplitude=1.0):
+    """Impulse responses of FlowSolver from zero initial condition: for each
+    actuator, a pulse of given amplitude is applied during the first time step,
+    then sensors are recorded during num_steps steps (default: ParamTime.num_steps).
+    The model should be linearized (ParamSolver.is_eq_nonlinear=False) for
+    the responses to be Markov parameters, otherwise amplitude should be small.
+
+    The input held on the first step acts on the output at the end of that step,
+    so that the responses are the zero-order-hold Markov parameters of a strictly
+    proper discrete model (x_k+1 = Ad x_k + Bd u_k, y_k = Cd x_k): Y[k] is the
+    output after k+1 steps, i.e. Y[k] = Cd Ad^k Bd (see era).
+
+    Return Markov parameters Y (num_steps, ny, nu) normalized by amplitude
+    """
+    if fs.params_solver.is_eq_nonlinear:
+        logger.warning("Nonlinear model: impulse responses depend on amplitude")
+    num_steps = fs.params_time.num_steps if num_steps is None else num_steps
+    nu = fs.params_control.actuator_number
+    ny = fs.params_control.sensor_number
+
+    # initial condition: exactly zero
+    ic_amplitude = fs.params_ic.amplitude
+    fs.params_ic.amplitude = 0.0
+
+    Y = np.zeros((num_steps, ny, nu))
+    for j in range(nu):
+        logger.info(f"Impulse response of actuator {j+1}/{nu}...")
+        fs.initialize_time_stepping(ic=None)
+        u_ctrl = np.zeros((nu,))
+        for k in range(num_steps):
+            u_ctrl[j] = amplitude if k == 0 else 0.0
+            fs.step(u_ctrl=u_ctrl)
+            comm = flu.MpiUtils.mpi4py_comm(fs.mesh.mpi_comm())
+            Y[k, :, j] = comm.bcast(fs.y_meas, root=0) / amplitude
+
+    fs.params_ic.amplitude = ic_amplitude
+    return Y
+
+
+def save_markov(filename, Y, dt, comm=None):
+    """Save Markov parameters (see impulse_responses) and time step (npz)
+    on rank 0 of comm (default: COMM_WORLD, e.g. fs.comm in an ensemble)"""
+    if flu.MpiUtils.get_rank(comm) == 0:
+        np.savez_compressed(filename, Y=Y, dt=dt)
+
+
+def load_markov(filename):
+    """Load Markov parameters and time step (see save_markov)"""
+    data = np.load(filename)
+    return data["Y"], float(data["dt"])
+
+
+def block_hankel(Y, n_rows, n_cols, shift=0):
+    """Block Hankel matrix H[i, j] = Y[i + j + shift] of shape
+    (n_rows*ny, n_cols*nu) from Y (n, ny, nu)"""
+    _, ny, nu = Y.shape
+    idx = np.arange(n_rows)[:, None] + np.arange(n_cols)[None, :] + shift
+    return Y[idx].transpose(0, 2, 1, 3).reshape(n_rows * ny, n_cols * nu)
+
+
+def randomized_svd_dense(M, rank, n_oversample=10, n_power=2, seed=0):
+    """Randomized SVD of dense matrix M (Halko, Martinsson & Tropp, 2011)
+    Return U, S, Vh truncated to rank"""
+    rng = np.random.default_rng(seed)
+    nl = min(rank + n_oversample, min(M.shape))
+    Y, _ = la.qr(M @ rng.standard_normal((M.shape[1], nl)), mode="economic")
+    for _ in range(n_power):
+        Z, _ = la.qr(M.T @ Y, mode="economic")
+        Y, _ = la.qr(M @ Z, mode="economic")
+    Ub, S, Vh = la.svd(Y.T @ M, full_matrices=False)
+    return (Y @ Ub)[:, :rank], S[:rank], Vh[:rank]
+
+
+def discrete_to_continuous(Ad, Bd, Cd, D, dt, every=1):
+    """Continuous-time model whose zero-order-hold discretization with time step dt
+    is (Ad^(1/every), Bd, Cd, D), i.e. Ad is sampled every _every_ steps while the
+    input is held during dt (see era): x_k+1 = Ad x_k + Bd u_k, y_k = Cd x_k + D u_k
+    with Bd = Ac^-1 (expm(Ac dt) - I) Bc"""
+    Ac = la.logm(Ad) / (every * dt)
+    Ad1 = la.expm(Ac * dt)
+    Bc = la.solve(Ad1 - np.eye(Ad.shape[0]), Ac @ Bd)
+    return np.real(Ac), np.real(Bc), Cd, D
+
+
+def era(
+    Y,
+    dt,
+    order=None,
+    hsv_threshold=1e-6,
+    n_hankel=None,
+    every=1,
+    randomized=True,
+    continuous=True,
+    max_order=100,
+):
+    """Eigensystem Realization Algorithm (Juang & Pappa, 1985) on zero-order-hold
+    Markov parameters Y (n, ny, nu) of a strictly proper model, with
+    Y[k] = Cd Ad^k Bd the output after k+1 steps (as from impulse_responses), so
+    that the model has no feedthrough (D = 0).
+    The Markov parameters are subsampled every _every_ steps (Y[0], Y[every], ...),
+    which keeps the block Hankel matrix small for long impulse responses.
+    The leading singular vectors of the block Hankel matrix are computed with
+    randomized SVD (if randomized, with at most max_order singular values).
+
+    Args:
+        order: order of model (default: from hsv_threshold)
+        hsv_threshold: relative threshold on singular values of Hankel matrix
+        n_hankel: number of block rows and columns (default: largest possible)
+        continuous: return continuous-time model (see discrete_to_continuous),
+            else discrete-time model with time step every*dt
+
+    Return control.StateSpace, singular values of Hankel matrix
+    """
+    D = np.zeros(Y.shape[1:])
+    Ys = Y[::every]
+    if n_hankel is None:
+        n_hankel = (len(Ys) - 1) // 2
+    H0 = block_hankel(Ys, n_hankel, n_hankel)
+    H1 = block_hankel(Ys, n_hankel, n_hankel, shift=1)
+
+    if randomized:
+        U, S, Vh = randomized_svd_dense(H0, rank=min(max_order, min(H0.shape)))
+    else:
+        U, S, Vh = la.svd(H0, full_matrices=False)
+    if order is None:
+        order = int(np.sum(S / S[0] >= hsv_threshold))
+    U, S, Vh = U[:, :order], S[:order], Vh[:order]
+
+    ny, nu = D.shape
+    sqrtS = np.sqrt(S)
+    Ad = (U.T @ H1 @ Vh.T) / sqrtS[:, None] / sqrtS[None, :]
+    Bd = sqrtS[:, None] * Vh[:, :nu]
+    Cd = U[:ny] * sqrtS[None, :]
+    logger.info(f"ERA model of order {order}")
+
+    if continuous:
+        # Bd is sampled every step, so that subsampled Markov parameters
+        # are C Ad^k Bd with input held during dt
+        Ac, Bc, Cc, Dc = discrete_to_continuous(Ad, Bd, Cd, D, dt, every=every)
+        return control.StateSpace(Ac, Bc, Cc, Dc), S
+    return control.StateSpace(Ad, Bd, Cd, D, every * dt), S
+
+
+def era_flowsolver(fs, num_steps=None, amplitude=1.0, **kwargs):
+    """Impulse responses of FlowSolver (see impulse_responses) and ERA (see era)"""
+    Y = impulse_responses(fs, num_steps=num_steps, amplitude=amplitude)
+    return era(Y, dt=fs.params_time.dt, **kwargs)
+
+
+# Subspace identification # GOTO ##############################################
+def _hankel_rows(u, y, j0, j1, n_block):
+    """Rows j0..j1-1 of the transposed block Hankel data matrix
+    [U_f; U_p; Y_p; Y_f]^T with n_block past and future block rows"""
+    s = n_block
+    windows = []
+    for data, offset in [(u, s), (u, 0), (y, 0), (y, s)]:
+        W = np.lib.stride_tricks.sliding_window_view(data, s, axis=0)
+        # W[j] has shape (nx, s): flatten time-major
+        W = W[j0 + offset : j1 + offset].transpose(0, 2, 1)
+        windows.append(W.reshape(j1 - j0, -1))
+    return np.hstack(windows)
+
+
+def streaming_lq(u, y, n_block, chunk=10000):
+    """Triangular factor R of the QR decomposition of the transposed block Hankel
+    data matrix [U_f; U_p; Y_p; Y_f]^T (see _hankel_rows), computed by chunks of
+    columns, so that memory is bounded by chunk*(2*n_block*(nu+ny)) whatever
+    the length of the record. L = R^T is the LQ factor of the data matrix."""
+    n_cols = len(u) - 2 * n_block + 1
+    R = None
+    for j0 in range(0, n_cols, chunk):
+        rows = _hankel_rows(u, y, j0, min(j0 + chunk, n_cols), n_block)
+        stacked = rows if R is None else np.vstack((R, rows))
+        R = la.qr(stacked, mode="r")[0][: stacked.shape[1]]
+    return R / np.sqrt(n_cols)
+
+
+def _estimate_BD(A, C, u, y, feedthrough=False):
+    """Least-squares estimation of B, D (and initial state) given A, C, with
+    normal equations accumulated over the record (bounded memory).
+    The regressors are the sensitivities of the state to (x0, B), simulated
+    along the record: S_k+1 = A S_k + [0, u_k^T kron I]"""
+    n, ny, nu = A.shape[0], C.shape[0], u.shape[1]
+    nB, nD = n * nu, ny * nu if feedthrough else 0
+    p = n + nB + nD
+    PhiTPhi = np.zeros((p, p))
+    PhiTy = np.zeros((p,))
+    S = np.hstack((np.eye(n), np.zeros((n, nB))))
+    for k in range(len(u)):
+        Phi_k = C @ S
+        if feedthrough:
+            Phi_k = np.hstack((Phi_k, np.kron(u[k][None, :], np.eye(ny))))
+        PhiTPhi += Phi_k.T @ Phi_k
+        PhiTy += Phi_k.T @ y[k]
+        S = A @ S
+        S[:, n:] += np.kron(u[k][None, :], np.eye(n))
+    theta = la.lstsq(PhiTPhi, PhiTy)[0]
+    B = theta[n : n + nB].reshape(nu, n).T
+    D = theta[n + nB :].reshape(nu, ny).T if feedthrough else np.zeros((ny, nu))
+    return B, D, theta[:n]
+
+
+def _simulate(A, B, C, D, u, x0):
+    """Output of discrete-time model from initial state x0"""
+    x = x0.copy()
+    y = np.zeros((len(u), C.shape[0]))
+    for k in range(len(u)):
+        y[k] = C @ x + D @ u[k]
+        x = A @ x + B @ u[k]
+    return y
+
+
+def subspace_id(
+    u,
+    y,
+    dt,
+    n_block=20,
+    order=None,
+    sv_threshold=1e-3,
+    method="moesp",
+    feedthrough=False,
+    continuous=True,
+    chunk=10000,
+):
+    """Subspace identification (Verhaegen, 1994; Van Overschee & De Moor, 1994) of
+    a discrete-time model x_k+1 = A x_k + B u_k, y_k = C x_k + D u_k from input and
+    output records u (N, nu), y (N, ny) sampled with time step dt.
+    The LQ factorization of the block Hankel data matrix (n_block past and future
+    block rows, with past inputs and outputs as instruments) is computed with
+    streaming QR (see streaming_lq). The extended observability matrix is obtained
+    from the SVD of:
+        - L32 (PO-MOESP) if method="moesp",
+        - the oblique projection of future outputs L32 L22^+ [L21 L22] if method="n4sid",
+    then A, C by shift invariance, and B, D (and x0) by least squares.
+
+    Args:
+        order: order of model (default: singular values above sv_threshold*max)
+        continuous: return continuous-time model (zero-order hold, see
+            discrete_to_continuous), else discrete-time model with time step dt
+
+    Return control.StateSpace and diagnostics dict with singular values (for
+    order selection), and fit (1 - NRMSE per output) of the model on the record
+    """
+    u = np.asarray(u, dtype=float).reshape(len(u), -1)
+    y = np.asarray(y, dtype=float).reshape(len(y), -1)
+    nu, ny = u.shape[1], y.shape[1]
+    s = n_block
+
+    logger.info(f"Subspace identification ({method}) on {len(u)} samples...")
+    L = streaming_lq(u, y, n_block, chunk=chunk).T
+    i_uf, i_p = s * nu, s * nu + s * (nu + ny)
+    L21 = L[i_uf:i_p, :i_uf]
+    L22 = L[i_uf:i_p, i_uf:i_p]
+    L32 = L[i_p:, i_uf:i_p]
+    if method == "moesp":
+        O = L32
+    elif method == "n4sid":
+        O = L32 @ la.pinv(L22) @ np.hstack((L21, L22))
+    else:
+        raise ValueError("supported methods are 'moesp' or 'n4sid'")
+    U, sv, _ = la.svd(O, full_matrices=False)
+    if order is None:
+        order = int(np.sum(sv / sv[0] >= sv_threshold))
+    logger.info(f"Singular values: {sv[: 2 * order]}, selected order: {order}")
+
+    Gamma = U[:, :order] * np.sqrt(sv[:order])
+    C = Gamma[:ny]
+    A = la.lstsq(Gamma[:-ny], Gamma[ny:])[0]
+    B, D, x0 = _estimate_BD(A, C, u, y, feedthrough=feedthrough)
+
+    y_sim = _simulate(A, B, C, D, u, x0)
+    fit = 1 - np.linalg.norm(y - y_sim, axis=0) / np.linalg.norm(
+        y - np.mean(y, axis=0), axis=0
+    )
+    logger.info(f"Fit on identification data: {fit}")
+    diagnostics = {"sv": sv, "order": order, "fit": fit}
+
+    if continuous:
+        Ac, Bc, Cc, Dc = discrete_to_continuous(A, B, C, D, dt)
+        return control.StateSpace(Ac, Bc, Cc, Dc), diagnostics
+    return control.StateSpace(A, B, C, D, dt), diagnostics
+
+
+def subspace_id_timeseries(timeseries, **kwargs):
+    """Subspace identification (see subspace_id) from FlowSolver.timeseries
+    (columns u_ctrl_*, y_meas_*, time), e.g. from a multisine run.
+    In timeseries, u_ctrl at row k is applied during the step producing y_meas at
+    row k+1, which is the zero-order hold convention of subspace_id. The last row
+    (no input applied) is discarded."""
+    u = timeseries.filter(regex=r"^u_ctrl_\d+$").to_numpy()[:-1]
+    y = timeseries.filter(regex=r"^y_meas_\d+$").to_numpy()[:-1]
+    dt = float(np.mean(np.diff(timeseries["time"].to_numpy())))
+    return subspace_id(u, y, dt, **kwargs)
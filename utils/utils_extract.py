@@ -33,33 +33,32 @@ def get_mass_matrix(self, sparse=False, volume=True, uvp=False):
 
 def get_matrices_lifting(self, A, C, Q):
     """Return matrices A, B, C, Q resulting form lifting transform (Barbagallo et al. 2009)
-    See get_Hw_lifting for details"""
-    # Steady field with rho=1: S1
+    See get_Hw_lifting for details. Only a single actuator is supported."""
+    if self.params_control.actuator_number != 1:
+        raise ValueError("Lifting transform is only implemented for a single actuator")
+
+    # Steady field with rho=1: S1, as perturbation of the base flow
     logger.info("Computing steady actuated field...")
-    self.actuator_expression.ampl = 1.0
-    S1 = self.compute_steady_state_newton()
-    S1v = S1.vector()
-
-    # Q*S1 (as vector)
-    sz = self.W.dim()
-    QS1v = dolfin.Vector(S1v.copy())
-    QS1v.set_local(
-        np.zeros(
-            sz,
-        )
-    )
-    QS1v.apply("insert")
-    Q.mult(S1v, QS1v)  # QS1v = Q * S1v
+    self._set_actuators_u_ctrl([1.0])
+    UP1 = dolfin.Function(self.W)
+    UP1.assign(self.fields.UP0)
+    UP1 = self._compute_steady_state_newton(initial_guess=UP1)
+    self._flush_actuators_u_ctrl()
+    S1_local = UP1.vector().get_local() - self.fields.UP0.vector().get_local()
+
+    # gather S1 (owned DOFs of each process) as global array
+    comm = flu.MpiUtils.mpi4py_comm(self.mesh.mpi_comm())
+    S1 = np.concatenate(comm.allgather(S1_local))
 
     # Bl = [Q*S1; -1]
-    Bl = np.hstack((QS1v.get_local(), -1))  # stack -1
+    Qsp = flu.dense_to_sparse(Q)
+    Bl = np.hstack((Qsp @ S1, -1))  # stack -1
     Bl = np.atleast_2d(Bl).T  # as column
 
     # Cl = [C, 0]
-    Cl = np.hstack((C, np.atleast_2d(0)))
+    Cl = np.hstack((np.atleast_2d(C), np.zeros((np.atleast_2d(C).shape[0], 1))))
 
     # Ql = diag(Q, 1)
-    Qsp = flu.dense_to_sparse(Q)
     Qlsp = flu.spr.block_diag((Qsp, 1))
 
     # Al = diag(A, 0)
@@ -152,21 +151,14 @@ def get_div0_u_random(fs, sigma=0.1, seed=0):
     return u0
 
 
-class localized_perturbation_u(dolfin.UserExpression):
-    """Perturbation localized in disk
-    Use: u = dolfin.interpolate(localized_perturbation_u(), self.V)
-    or something like that"""
+def localized_perturbation_u(V):
+    """Perturbation localized in disk, as dolfin.Function in V
+    Use: u = localized_perturbation_u(self.V)"""
 
-    def eval(self, value, x):
-        if (x[0] - -2.5) ** 2 + (x[1] - 0.1) ** 2 <= 1:
-            value[0] = 0.05
-            value[1] = 0.05
-        else:
-            value[0] = 0
-            value[1] = 0
+    def in_disk(x):
+        return 0.05 * ((x[:, 0] - -2.5) ** 2 + (x[:, 1] - 0.1) ** 2 <= 1)
 
-    def value_shape(self):
-        return (2,)
+    return flu.interpolate_numpy([in_disk, in_disk], V)
 
 
 # see end_simulation in flu
@@ -20,7 +20,11 @@ import os
 import dolfin
 from dolfin import dot, inner
 
+import rational_utils as rat
+import mpi_utils
+
 import functools
+import weakref
 from mpi4py import MPI as mpi
 import matplotlib.pyplot as plt
 from matplotlib import cm
@@ -35,6 +39,43 @@ logger.debug("Importing or running: %s", __name__)
 
 
 # Dolfin utility # GOTO ###################################################
+def get_scalar_subspaces(V):
+    """Return list of scalar subspaces of (possibly mixed/vector) FunctionSpace V,
+    in order (e.g. [u, v, p] for the mixed space W)"""
+    if V.num_sub_spaces() == 0:
+        return [V]
+    return [S for i in range(V.num_sub_spaces()) for S in get_scalar_subspaces(V.sub(i))]
+
+
+def interpolate_numpy(funs, V, f=None):
+    """Interpolate numpy callables on FunctionSpace V, by evaluating them on the
+    coordinates of the DOFs of each scalar subspace (see tabulate_dof_coordinates)
+    and writing values directly into the vector of a dolfin.Function.
+    This replaces dolfin.UserExpression (evaluated point by point in Python).
+
+    funs: list of callables, one per scalar subspace of V (e.g. [u, v, p] for W),
+        each mapping coordinates x of shape (n, gdim) to values of shape (n,)
+    f: dolfin.Function in V to write into (created if None)
+    """
+    if f is None:
+        f = dolfin.Function(V)
+    subspaces = get_scalar_subspaces(V)
+    if len(funs) != len(subspaces):
+        raise ValueError(
+            f"Expected {len(subspaces)} callables (one per scalar subspace), got {len(funs)}"
+        )
+
+    dof_coordinates = V.tabulate_dof_coordinates()
+    offset = V.dofmap().ownership_range()[0]
+    values = f.vector().get_local()
+    for fun, S in zip(funs, subspaces):
+        dofs = np.array(S.dofmap().dofs(), dtype=int) - offset
+        values[dofs] = fun(dof_coordinates[dofs])
+    f.vector().set_local(values)
+    f.vector().apply("insert")
+    return f
+
+
 def apply_fun(u, fun):
     """Shortcut for applying numeric method to dolfin.dolfin.Function"""
     return fun(u.vector().get_local())
@@ -46,8 +87,10 @@ def show_max(u, name=""):
 
 
 def write_xdmf(filename, func, name, time_step=0.0, append=False, write_mesh=True):
-    """Shortcut to write XDMF file with options & context manager"""
-    with dolfin.XDMFFile(dolfin.MPI.comm_world, str(filename)) as ff:
+    """Shortcut to write XDMF file with options & context manager
+    (on the communicator of the mesh of func)"""
+    comm = func.function_space().mesh().mpi_comm()
+    with dolfin.XDMFFile(comm, str(filename)) as ff:
         ff.parameters["rewrite_function_mesh"] = write_mesh
         ff.parameters[
             "functions_share_mesh"
@@ -62,8 +105,10 @@ def write_xdmf(filename, func, name, time_step=0.0, append=False, write_mesh=Tru
 
 
 def read_xdmf(filename, func, name, counter=-1):
-    """Shortcut to read XDMF file with context manager"""
-    with dolfin.XDMFFile(dolfin.MPI.comm_world, str(filename)) as ff:
+    """Shortcut to read XDMF file with context manager
+    (on the communicator of the mesh of func)"""
+    comm = func.function_space().mesh().mpi_comm()
+    with dolfin.XDMFFile(comm, str(filename)) as ff:
         ff.read_checkpoint(func, name=name, counter=counter)
 
 
@@ -85,10 +130,17 @@ projectm = functools.partial(dolfin.project, solver_type="mumps")
 
 # MPI utility # GOTO ##########################################################
 class MpiUtils:
+    # mpi4py-only helpers, also used without dolfin (see mpi_utils)
+    mpi4py_comm = staticmethod(mpi_utils.mpi4py_comm)
+    split_comm = staticmethod(mpi_utils.split_comm)
+    map_groups = staticmethod(mpi_utils.map_groups)
+
     @staticmethod
-    def get_rank():
-        """Access MPI rank in COMM WORLD"""
-        return mpi.COMM_WORLD.Get_rank()
+    def get_rank(comm=None):
+        """Access MPI rank in comm (default: COMM WORLD)"""
+        if comm is None:
+            comm = mpi.COMM_WORLD
+        return MpiUtils.mpi4py_comm(comm).Get_rank()
 
     @staticmethod
     def check_process_rank():
@@ -97,14 +149,6 @@ class MpiUtils:
         ip = comm.Get_rank()
         logger.info("================= Hello I am process %d", ip)
 
-    @staticmethod
-    def mpi4py_comm(comm):
-        """Get mpi4py communicator"""
-        try:
-            return comm.tompi4py()
-        except AttributeError:
-            return comm
-
     @staticmethod
     def peval(f, x):
         """Parallel synced eval"""
@@ -158,9 +202,11 @@ class MpiUtils:
         logger.info("nb threads is: %s", os.environ["OMP_NUM_THREADS"])
 
     @staticmethod
-    def mpi_broadcast(x):
-        """Broadcast y to MPI (shortcut but longer)"""
-        y = dolfin.MPI.comm_world.bcast(x, root=0)
+    def mpi_broadcast(x, comm=None):
+        """Broadcast x from rank 0 of comm (default: COMM_WORLD, e.g. fs.comm)"""
+        if comm is None:
+            comm = mpi.COMM_WORLD
+        y = MpiUtils.mpi4py_comm(comm).bcast(x, root=0)
         return y
 
 
@@ -170,29 +216,33 @@ class MpiUtils:
 # PETSc, scipy.sparse utility # GOTO ##########################################
 def dense_to_sparse(A, eliminate_zeros=True, eliminate_under=None):
     """Cast PETSc or dolfin Matrix to scipy.sparse
-    (Misleading name because A is not dense)"""
+    (Misleading name because A is not dense)
+    If eliminate_zeros, explicit zeros (or entries with magnitude under
+    eliminate_under) are removed, otherwise the sparsity pattern is kept.
+    A scipy.sparse input is never modified in place."""
 
-    def eliminate_zeros(A):
+    def _eliminate(A):
         if eliminate_under is None:
+            A = A.copy()
             A.eliminate_zeros()
         else:
             # assuming A is small, convert to dense, then back to sparse...
             # this is bad
             Adense = A.toarray()
-            Adense[Adense <= eliminate_under] = 0
+            Adense[np.abs(Adense) <= eliminate_under] = 0
             A = spr.csr_matrix(Adense)
         return A
 
     if spr.issparse(A):
         # print('A is already sparse; exiting')
         if eliminate_zeros:
-            A = eliminate_zeros(A)
+            A = _eliminate(A)
         return A
 
     if isinstance(A, np.ndarray):
         A = spr.csr_matrix(A)
         if eliminate_zeros:
-            A = eliminate_zeros(A)
+            A = _eliminate(A)
         return A
 
     if not isinstance(A, PETSc.Mat):
@@ -201,7 +251,7 @@ def dense_to_sparse(A, eliminate_zeros=True, eliminate_under=None):
     Ac, As, Ar = A.getValuesCSR()
     Acsr = spr.csr_matrix((Ar, As, Ac))
     if eliminate_zeros:
-        Acsr.eliminate_zeros()
+        Acsr = _eliminate(Acsr)
     return Acsr
 
 
@@ -661,11 +711,10 @@ def export_to_mat(infile, outfile, matname, option="sparse"):
 def export_flowsolver_matrices(fs, path, suffix=""):
     """Export A, B, C, Q matrices of high dim state-space representation
     of flow, in sparse and mat formats"""
+    from operatorgetter import OperatorGetter  # avoid circular import
+
     # Gather matrices
-    A = fs.get_A()
-    B = fs.get_B()
-    C = fs.get_C()
-    Q = fs.get_mass_matrix()
+    A, B, C, Q = OperatorGetter(fs).get_all()
 
     for mat, matname in zip([A, B, C, Q], ["A", "B", "C", "Q"]):
         # Convert to sparse
@@ -726,7 +775,7 @@ def export_subdomains(mesh, subdomains_list, filename="subdomains.xdmf"):
         subdomain.mark(subd, subdnr)
         logger.info("Marking subdomain nr: {0} ({1})".format(i + 1, subdnr))
     logger.info("Writing subdomains file: %s", filename)
-    with dolfin.XDMFFile(str(filename)) as fsubd:
+    with dolfin.XDMFFile(mesh.mpi_comm(), str(filename)) as fsubd:
         fsubd.write(subd)
 
 
@@ -847,23 +896,47 @@ def saturate(x, xmin, xmax):
 
 
 # Controller utility # GOTO ###################################################
+def c2d_zoh(A, B, dt):
+    """Zero-order hold discretization of x' = A x + B u on time step dt,
+    with exponential of augmented matrix: expm([[A, B], [0, 0]] dt) = [[Ad, Bd], [0, I]]
+    Return Ad, Bd"""
+    A = np.atleast_2d(A)
+    B = np.asarray(B).reshape(A.shape[0], -1)
+    n, m = B.shape
+    M = np.zeros((n + m, n + m))
+    M[:n, :n] = A
+    M[:n, n:] = B
+    Md = la.expm(M * dt)
+    return Md[:n, :n], Md[:n, n:]
+
+
+_c2d_zoh_cache = weakref.WeakKeyDictionary()
+
+
+def _discretize_controller(K, dt):
+    """Return ZOH discretization (Ad, Bd) of controller K on time step dt,
+    computed once per (K, dt): with Controller.discretize if available, otherwise
+    cached here per K (weakly, the cache does not keep K alive) and per dt"""
+    if hasattr(K, "discretize"):
+        return K.discretize(dt)
+    per_dt = _c2d_zoh_cache.setdefault(K, dict())
+    if dt not in per_dt:
+        per_dt[dt] = c2d_zoh(K.A, K.B, dt)
+    return per_dt[dt]
+
+
 def step_controller(K, x, e, dt):
     """Wrapper for stepping controller on one time step, from state (x),
     with input(e), up to time (dt) >> u=K*e
+    Input (e) is held constant on the time step (zero-order hold), as in
+    control.forced_response with interpolate=False.
+    The discretization of K is computed once per time step dt.
     Return controller output u and controller new state x"""
-    # import pdb
-    # pdb.set_trace()
-    e_rep = np.repeat(np.atleast_2d(e), repeats=2, axis=0).T
-
-    # import pdb
-    # pdb.set_trace()
-
-    Tsim = [0, dt]
-    _, yout, xout = control.forced_response(
-        K, U=e_rep, T=Tsim, X0=x, interpolate=False, return_x=True
-    )  # y=y(t)
-    u = np.ravel(yout)[0]
-    x = xout[:, 1]  # this is x(t+dt)
+    Ad, Bd = _discretize_controller(K, dt)
+    e = np.atleast_1d(np.asarray(e, dtype=float)).ravel()
+    x = np.broadcast_to(np.asarray(x, dtype=float), (Ad.shape[0],))
+    u = np.ravel(K.C @ x + K.D @ e)[0]
+    x = Ad @ x + Bd @ e  # this is x(t+dt)
     return u, x
 
 
@@ -1096,6 +1169,271 @@ def write_optim_csv(fs, x, J, diverged, write=True):
 
 
 # FlowSolver frequency response utility # GOTO ################################
+def _structural_union(*mats):
+    """Return csr matrix (row-sorted, data=1) whose pattern is the union of the
+    stored entries of sparse matrices mats, explicit zeros included
+    (scipy addition would drop them)"""
+    coos = [M.tocoo() for M in mats]
+    rows = np.concatenate([M.row for M in coos])
+    cols = np.concatenate([M.col for M in coos])
+    pattern = spr.csr_matrix(
+        (np.ones(len(rows)), (rows, cols)), shape=mats[0].shape
+    )  # duplicates are summed, not dropped
+    pattern.sort_indices()
+    pattern.data[:] = 1
+    return pattern
+
+
+def _data_on_pattern(M, pattern):
+    """Return data of sparse matrix M laid out on the (larger, row-sorted)
+    sparsity pattern of csr matrix pattern, i.e. such that
+    csr_matrix((data, pattern.indices, pattern.indptr)) == M
+    All stored entries of M (explicit zeros included) must be in pattern."""
+    ncol = pattern.shape[1]
+    pattern_rows = np.repeat(np.arange(pattern.shape[0]), np.diff(pattern.indptr))
+    pattern_keys = pattern_rows * ncol + pattern.indices
+    Mcoo = M.tocoo()
+    keys = Mcoo.row.astype(np.int64) * ncol + Mcoo.col
+    position = np.searchsorted(pattern_keys, keys)
+    found = position < pattern.nnz
+    found[found] = pattern_keys[position[found]] == keys[found]
+    assert np.all(found), "Entries of matrix missing from sparsity pattern"
+    data = np.zeros(pattern.nnz)
+    np.add.at(data, position, Mcoo.data)
+    return data
+
+
+class ResolventSolver:
+    """Solver for the resolvent R(w) = inv(jwQ-A), written in real form
+    with the 2n x 2n block matrix:
+        M(w) = [[-A, -wQ], [wQ, -A]]    acting on [Re(x); Im(x)]
+    The sparsity pattern of M(w) does not depend on w: the PETSc matrix is
+    created once, and only its values are updated with each new frequency, so that
+    MUMPS reuses the symbolic analysis and only performs the numeric factorization.
+    Since M(w)^T is the real form of R(w)^H, adjoint solves reuse the
+    same factorization (transpose solves).
+    A and Q are global matrices (scipy.sparse, np.ndarray or PETSc), e.g. computed
+    in serial with OperatorGetter or read from file; rows of M are distributed on comm.
+    """
+
+    def __init__(self, A, Q, comm=None):
+        A = dense_to_sparse(A, eliminate_zeros=False).tocsr()
+        Q = dense_to_sparse(Q, eliminate_zeros=False).tocsr()
+        self.n = A.shape[0]
+        self.comm = mpi.COMM_WORLD if comm is None else MpiUtils.mpi4py_comm(comm)
+        self.w = None
+
+        # Pattern of M(w) and values of its 2 parts on this pattern
+        M0 = spr.bmat([[-A, None], [None, -A]], format="csr")
+        M1 = spr.bmat([[None, -Q], [Q, None]], format="csr")
+        pattern = _structural_union(M0, M1)
+        data0 = _data_on_pattern(M0, pattern)
+        data1 = _data_on_pattern(M1, pattern)
+
+        # Distributed PETSc matrix with fixed pattern
+        self.mat = PETSc.Mat().create(comm=PETSc.Comm(self.comm))
+        self.mat.setSizes((2 * self.n, 2 * self.n))
+        self.mat.setType(PETSc.Mat.Type.AIJ)
+        self.mat.setUp()
+        self.rstart, self.rend = self.mat.getOwnershipRange()
+
+        istart, iend = pattern.indptr[self.rstart], pattern.indptr[self.rend]
+        self._indptr = (pattern.indptr[self.rstart : self.rend + 1] - istart).astype(
+            PETSc.IntType
+        )
+        self._indices = pattern.indices[istart:iend].astype(PETSc.IntType)
+        self._data0 = data0[istart:iend]
+        self._data1 = data1[istart:iend]
+        self.mat.setPreallocationCSR((self._indptr, self._indices))
+
+        self.ksp = PETSc.KSP().create(comm=PETSc.Comm(self.comm))
+        self.ksp.setType(PETSc.KSP.Type.PREONLY)
+        pc = self.ksp.getPC()
+        pc.setType(PETSc.PC.Type.LU)
+        pc.setFactorSolverType("mumps")
+
+        self._x, self._b = self.mat.createVecs()
+
+    def set_frequency(self, w):
+        """Update values of M(w) and factorize (numeric factorization only,
+        after the first frequency)"""
+        self.w = w
+        self.mat.setValuesCSR(
+            self._indptr, self._indices, self._data0 + w * self._data1
+        )
+        self.mat.assemble()
+        self.ksp.setOperators(self.mat)
+        self.ksp.setUp()
+
+    def _solve(self, b, transpose):
+        """Solve M(w) x = b (or M(w)^T x = b) for complex b of shape (n,) or (n, k)"""
+        b = np.asarray(b)
+        is_vector = b.ndim == 1
+        b = np.atleast_2d(b.T).T
+        x = np.zeros(b.shape, dtype=complex)
+        for k in range(b.shape[1]):
+            b_real = np.concatenate([np.real(b[:, k]), np.imag(b[:, k])])
+            self._b.setArray(b_real[self.rstart : self.rend])
+            if transpose:
+                self.ksp.solveTranspose(self._b, self._x)
+            else:
+                self.ksp.solve(self._b, self._x)
+            x_real = np.concatenate(self.comm.allgather(self._x.getArray()))
+            x[:, k] = x_real[: self.n] + 1j * x_real[self.n :]
+        if is_vector:
+            return x[:, 0]
+        return x
+
+    def solve(self, b):
+        """Return x = inv(jwQ-A) b"""
+        return self._solve(b, transpose=False)
+
+    def solve_adjoint(self, b):
+        """Return x = inv(jwQ-A)^H b"""
+        return self._solve(b, transpose=True)
+
+
+class FrequencySweep:
+    """Distribute evaluations of fun(solver, w) over pulsations, where solver is a
+    ResolventSolver already factorized at w. MPI processes of comm (default: COMM_WORLD)
+    are split into n_groups sub-communicators (default: 1 group per process), each
+    handling a slice of the pulsations with its own ResolventSolver (symbolic analysis
+    done once per group, then reused by successive calls to map)."""
+
+    def __init__(self, A, Q, n_groups=None, comm=None):
+        self.comm = mpi.COMM_WORLD if comm is None else MpiUtils.mpi4py_comm(comm)
+        if n_groups is None:
+            n_groups = self.comm.Get_size()
+        self.n_groups = min(n_groups, self.comm.Get_size())
+        self.color, self.subcomm = MpiUtils.split_comm(self.n_groups, self.comm)
+        self.solver = ResolventSolver(A, Q, comm=self.subcomm)
+
+    def map(self, fun, ww):
+        """Evaluate fun(solver, w) for w in ww. Results are gathered
+        on all processes, in the order of ww."""
+
+        def fun_at(ii):
+            self.solver.set_frequency(ww[ii])
+            return fun(self.solver, ww[ii])
+
+        return MpiUtils.map_groups(
+            fun_at, len(ww), self.color, self.n_groups, self.subcomm, self.comm
+        )
+
+    def free(self):
+        """Free sub-communicator"""
+        self.subcomm.Free()
+
+
+def sweep_frequencies(A, Q, ww, fun, n_groups=None, comm=None):
+    """Evaluate fun(solver, w) for each pulsation w in ww, where solver is a
+    ResolventSolver already factorized at w (see FrequencySweep).
+    Results are gathered on all processes of comm, in the order of ww."""
+    sweep = FrequencySweep(A, Q, n_groups=n_groups, comm=comm)
+    results = sweep.map(fun, ww)
+    sweep.free()
+    return results
+
+
+def _make_get_Hw_at(B, C, D, verbose=True, timings=None):
+    """Make function computing C inv(jwQ-A) B + D with a factorized ResolventSolver"""
+
+    def get_Hw_at(solver, w):
+        if verbose:
+            logger.info("Computing pulsation: %5.3f..." % w)
+        t0 = time.time()
+        x = solver.solve(B)
+        if timings is not None:
+            timings["solve"] += time.time() - t0
+        return C @ x + D
+
+    return get_Hw_at
+
+
+def _get_operators_Hw(fs, A, B, C, Q):
+    """Get operators A, B, C, Q (as scipy.sparse / np.ndarray) for frequency
+    response, computing those that are None with OperatorGetter"""
+    if any(M is None for M in [A, B, C, Q]):
+        from operatorgetter import OperatorGetter  # avoid circular import
+
+        opget = OperatorGetter(fs)
+        A = opget.get_A(sparse=True) if A is None else A
+        B = opget.get_B() if B is None else B
+        C = opget.get_C() if C is None else C
+        Q = opget.get_E(sparse=True) if Q is None else Q
+    B = B.toarray() if spr.issparse(B) else np.asarray(B)
+    C = C.toarray() if spr.issparse(C) else np.asarray(C)
+    return A, np.atleast_2d(B.T).T, np.atleast_2d(C), Q
+
+
+def save_Hw(Hw, ww, save_dir, save_suffix="", xs=None):
+    """Save frequency response Hw (1 line per sensor, 1 column per pulsation,
+    for a single input) to .mat files, with bode plots: the whole response
+    in Hw_nw*.mat, then every sensor response as a separate file.
+    With several inputs (Hw of shape (ny, nu, nw)), the response to each input
+    is saved in the same way, with suffix _in<index of input>"""
+    if MpiUtils.get_rank() != 0:
+        return
+    if Hw.ndim == 3:
+        for k in range(Hw.shape[1]):
+            save_Hw(Hw[:, k, :], ww, save_dir, save_suffix + "_in" + str(k), xs=xs)
+        return
+    nw = len(ww)
+    ns = Hw.shape[0]
+    if xs is None:
+        xs = [[np.nan, np.nan]] * ns
+
+    suffix = "_" + str(ns) + "sensors"
+    savepath = save_dir + "Hw_nw" + str(nw) + save_suffix + suffix + ".mat"
+    sio.savemat(
+        savepath,
+        {
+            "H": Hw,
+            "w": ww,
+            "xs": np.asarray(xs),
+            "comment": "1 line = 1 sensor",
+        },
+    )
+
+    for sn in range(ns):
+        xs_i = xs[sn]
+        Hw_i = Hw[sn, :]
+
+        suffix = "_dx=" + str(xs_i[0]) + "_dy=" + str(xs_i[1])
+
+        savepath = save_dir + "Hw_nw" + str(nw) + save_suffix + suffix + ".mat"
+        sio.savemat(savepath, {"H": Hw_i, "w": ww, "xs": xs_i})
+        logger.info("Saving frequency response to: %s", savepath)
+
+        fig, axs = plt.subplots(2, 1)
+
+        axs[0].grid(which="both")
+        axs[0].scatter(ww, 20 * np.log10(np.abs(Hw_i)), marker=".")
+        axs[0].set_title("Amplitude response")
+        axs[0].set_xlabel("Frequency")
+        axs[0].set_xscale("log")
+
+        axs[1].grid(which="both")
+        axs[1].scatter(ww, (180 / np.pi) * np.unwrap(np.angle(Hw_i)), marker=".")
+        axs[1].set_title("Phase response")
+        axs[1].set_xlabel("Frequency")
+        axs[1].set_xscale("log")
+
+        fig.tight_layout()
+        fig.savefig(save_dir + "bodeplot_" + suffix + save_suffix + ".png")
+        plt.close(fig)
+
+
+def _get_sensor_positions(fs, ns):
+    """Positions of sensors (nan for sensors without position)"""
+    if fs is None:
+        return None
+    return [
+        getattr(sensor, "position", [np.nan, np.nan])
+        for sensor in fs.params_control.sensor_list
+    ][:ns]
+
+
 def get_Hw(
     fs,
     A=None,
@@ -1109,282 +1447,150 @@ def get_Hw(
     save_dir="/scratchm/wjussiau/fenics-python/cylinder/data/temp/",
     save_suffix="",
     verbose=True,
+    ww=None,
+    n_groups=None,
+    comm=None,
 ):
     """Get frequency response of infinite-dimensional system
-    One can pass A, B, C, D read from file or small dimension"""
-
-    MpiUtils.check_process_rank()
+    One can pass A, B, C, D read from file or small dimension
+    (operators that are None are computed with OperatorGetter).
+    The frequency grid (ww, or logspace(logwmin, logwmax, nw)) is split between
+    n_groups MPI sub-communicators of comm (default: COMM_WORLD, see
+    sweep_frequencies), and each group reuses
+    the symbolic factorization of the resolvent (see ResolventSolver).
+    Hw has 1 line per sensor and 1 column per pulsation (for a single actuator),
+    or shape (ny, nu, nw) with several actuators."""
 
     # solve: given w, (jwQ-A)x=B, then y=Cx
-    ww = np.logspace(logwmin, logwmax, num=nw)
-    ns = fs.sensor_nr
-    # 1 line per sensor
-    # 1 column per freq
-    Hw = np.zeros((ns, len(ww)), dtype=complex)
-
-    # If input is none, get A B C from FlowSolver object
-    if A is None:
-        A = fs.get_A()
-    if B is None:
-        B = fs.get_B()
-    if C is None:
-        C = fs.get_C()
+    if ww is None:
+        ww = np.logspace(logwmin, logwmax, num=nw)
+    ww = np.asarray(ww, dtype=float)
+    A, B, C, Q = _get_operators_Hw(fs, A, B, C, Q)
     if D is None:
         D = 0
-    if Q is None:
-        Q = fs.get_mass_matrix()
-    Q = dense_to_sparse(Q)
+    ns = C.shape[0]
 
-    # Sub blocks (before loop)
-    if verbose:
-        logger.info("Defining sub-blocks (A, E)")
-    Acsr = dense_to_sparse(A)
-    sz = Acsr.shape[0]  # fs.W.dim()
-    # print('size of acsr is:', sz)
-
-    petsc4py.init()
-    Rb = PETSc.Mat().create()
-    Rb.setSizes((2 * sz, 2 * sz))
-    Rb.setUp()
-    Rb.assemble()
-
-    rstart, rend = Rb.getOwnershipRange()
-    # print('my ownership range is: ', rstart, rend)
-
-    # B, C
-    # C0 = np.zeros_like(C)
-    B0 = np.zeros_like(B)
-    # Czero = np.hstack([C, C0])
-    # zeroC = np.hstack([C0, C])
-    Bzero = np.vstack([B, B0])
-    CjC = np.hstack([C, 1j * C])
-
-    # solver
-    solvR = dolfin.LUSolver("mumps")
-    # solvR = PETSc.KSP().create()
-    # setup ksp here
-
-    hw_timings = {
-        "stack": 0,
-        "createAIJ": 0,
-        "createmat": 0,
-        "solve": 0,
-        "decompose": 0,
-    }
-    # 0: make block matrix (scipy)
-    # 1: create petsc matrix
-    # 2: create petsc vectors + transform to dolfin
-    # 3: solve system
-    # 4: multiply x
-    tb = time.time()
-    for ii, w in enumerate(ww):
-        if verbose:
-            logger.info("Computing %d/%d with puls: %5.3f..." % (ii + 1, len(ww), w))
-        # Block matrix
-        t00 = time.time()
-
-        # from here to......
-        Ablk = spr.bmat([[-Acsr, -w * Q], [w * Q, -Acsr]])  # TODO convert to PETSc
-        Ablk = Ablk.tocsr()
-        # Ablk_csr = (Ablk.indptr, Ablk.indices, Ablk.data)
-
-        Ablk_csr = (
-            Ablk.indptr[rstart : rend + 1] - Ablk.indptr[rstart],
-            Ablk.indices[Ablk.indptr[rstart] : Ablk.indptr[rend]],
-            Ablk.data[Ablk.indptr[rstart] : Ablk.indptr[rend]],
-        )
+    hw_timings = {"factorize": 0, "solve": 0}
 
-        hw_timings["stack"] += -t00 + time.time()
-
-        t01 = time.time()
-        Rb.createAIJ(size=(2 * sz, 2 * sz), csr=Ablk_csr, comm=PETSc.COMM_WORLD)
-        # Rb.createAIJWithArrays(size=[2*sz, 2*sz], csr=Ablk_csr, comm=PETSc.COMM_WORLD)
-
-        Rb.assemblyBegin()
-        Rb.assemblyEnd()
-        hw_timings["createAIJ"] += -t01 + time.time()
-
-        # Create solution (in LHS) & RHS
-        t02 = time.time()
-        vecx, vecb = Rb.createVecs()
-        # vecx = Rb.createVecRight()
-        # print('size of vx after createvec: ', vecx.size)
-        # print('size of vb after createvec: ', vecb.size)
-        # print('size of bzero: ', Bzero.shape)
-        # vecb = PETSc.Vec().createWithArray(Bzero, comm=PETSc.COMM_WORLD)
-        rbstart, rbend = vecb.getOwnershipRange()
-        # print('ownership range is: ', rbstart, rbend)
-        # vecb.createWithArray(Bzero, comm=PETSc.COMM_WORLD)
-        localidx = list(range(rbstart, rbend))
-        vecb.setValues(localidx, Bzero[localidx])
-        # print('size of vb after createarray: ', vecb.size)
-        vecx, vecb = dolfin.PETScVector(vecx), dolfin.PETScVector(vecb)
-        # print('size of vx after convert: ', vecx.size())
-        # print('size of vb after convert: ', vecb.size())
-
-        # Casting matrix
-        ############################## warning: this is back to dolfin
-        # Rmat = Rb
-        # solvR.setOperators(Rmat)
-        # solvR.setFromOptions()
-        Rmat = dolfin.PETScMatrix(Rb)
-        hw_timings["createmat"] += -t02 + time.time()
-
-        # Solving system
-        t03 = time.time()
-        # exitFlag = solvR.solve(Rmat, vecx, vecb)
-        solvR.solve(Rmat, vecx, vecb)
-        # solvR.solve(vecb, vecx)
-        hw_timings["solve"] += -t03 + time.time()
-        # .............. here
-        # the function determines the field response x = inv(jwQ-A)*B for given w
-
-        ########################################################
-        # this part has to take into account the nr of sensors #
-        ########################################################
-        # print('max of x is:', max(vecx.get_local()))
-        t04 = time.time()
-
-        rxstart, rxend = vecx.vec().getOwnershipRange()
-        localidx = list(range(rxstart, rxend))
-        # print('size of vecx local: ', vecx.get_local().shape)
-        # print('size of vecx local slice: ', vecx.get_local()[:sz].shape)
-        # print('size of C: ', C.shape)
-
-        vecy = spr.csr_matrix(CjC[:, localidx]).dot(vecx.get_local())
-        # vecy = spr.csr_matrix(C).dot(vecx.get_local()[:sz]) + D
-        # ivecy = spr.csr_matrix(C).dot(vecx.get_local()[sz:])
-        hw_timings["decompose"] += -t04 + time.time()
-
-        # print('  --- y is:', vecy)
-        # print('  --- iy is:', ivecy)
-
-        # Hw[:, ii] = vecy + 1j * ivecy
-        # Hw[:, ii] = vecy # mpi.allgather ?
-        Hw[:, ii] = dolfin.MPI.comm_world.reduce(vecy, root=0)  # mpi.allgather ?
+    get_Hw_at = _make_get_Hw_at(B, C, D, verbose=verbose, timings=hw_timings)
 
-        if verbose:
-            for sn in range(ns):
-                logger.info("\t magnitude is: %5.4f" % (np.abs(Hw[sn, ii])))
+    tb = time.time()
+    Hw = np.stack(
+        sweep_frequencies(A, Q, ww, get_Hw_at, n_groups=n_groups, comm=comm), axis=-1
+    )
+    hw_timings["factorize"] = time.time() - tb - hw_timings["solve"]
+    if Hw.shape[1] == 1:
+        Hw = Hw[:, 0, :]  # 1 line = 1 sensor
 
     if verbose:
         logger.info(
             "Elapsed computing {0} pulsations: {1}".format(len(ww), time.time() - tb)
         )
 
-    if save_dir and MpiUtils.get_rank() == 0:  # if dir not empty string & rank 0
+    if save_dir:  # if dir not empty string
         # save whole frequency response with sensor positions
-        suffix = "_" + str(ns) + "sensors"
-        savepath = save_dir + "Hw_nw" + str(nw) + save_suffix + suffix + ".mat"
-        sio.savemat(
-            savepath,
-            {
-                "H": Hw,
-                "w": ww,
-                "xs": fs.sensor_location,
-                "comment": "1 line = 1 sensor",
-            },
-        )
+        save_Hw(Hw, ww, save_dir, save_suffix, xs=_get_sensor_positions(fs, ns))
+
+    return Hw, ww, hw_timings
+
+
+def get_Hw_adaptive(
+    fs,
+    A=None,
+    B=None,
+    C=None,
+    D=None,
+    Q=None,
+    logwmin=-2,
+    logwmax=2,
+    nw0=9,
+    tol=1e-3,
+    max_iter=10,
+    max_nw=200,
+    save_dir="/scratchm/wjussiau/fenics-python/cylinder/data/temp/",
+    save_suffix="",
+    verbose=True,
+    n_groups=None,
+    comm=None,
+):
+    """Get frequency response of infinite-dimensional system (see get_Hw) on an
+    adaptive frequency grid. Starting from nw0 log-spaced pulsations, every
+    interval [w_i, w_i+1] is bisected (in log scale) while its error estimate is
+    larger than tol. The error estimate at the log-midpoint is the discrepancy
+    between the rational (AAA, see rational_utils) interpolants of the samples of the
+    current and previous iterations, relative to max|Hw|: it is large around
+    unresolved resonance peaks and vanishes once the rational interpolant has
+    converged, so that the samples allow to reconstruct Hw on the whole band.
+    New pulsations of each iteration are computed in parallel (see FrequencySweep),
+    with a single symbolic factorization for the whole sweep.
+    Return Hw (1 line per sensor, or (ny, nu, nw)), sorted non-uniform ww, timings."""
+    A, B, C, Q = _get_operators_Hw(fs, A, B, C, Q)
+    if D is None:
+        D = 0
 
-        # save every sensor response as separate file
-        for sn in range(ns):
-            xs_i = fs.sensor_location[sn]
-            Hw_i = Hw[sn, :]
+    sweep = FrequencySweep(A, Q, n_groups=n_groups, comm=comm)
+    get_Hw_at = _make_get_Hw_at(B, C, D, verbose=verbose)
 
-            suffix = "_dx=" + str(xs_i[0]) + "_dy=" + str(xs_i[1])
+    tb = time.time()
+    ww = np.logspace(logwmin, logwmax, num=nw0)
+    Hw = np.stack(sweep.map(get_Hw_at, ww), axis=-1)
+    # initial previous interpolant: built on every other sample
+    rat_prev = rat.aaa(1j * ww[::2], Hw.reshape(-1, len(ww)).T[::2], tol=tol / 100)
+    for iter in range(max_iter):
+        # error estimate at midpoints: discrepancy between successive interpolants
+        H2 = Hw.reshape(-1, len(ww)).T  # (nw, ny*nu)
+        rat_cur = rat.aaa(1j * ww, H2, tol=tol / 100)
+        logw_mid = (np.log10(ww[1:]) + np.log10(ww[:-1])) / 2
+        H_cur = rat.aaa_eval(1j * 10**logw_mid, *rat_cur)
+        H_prev = rat.aaa_eval(1j * 10**logw_mid, *rat_prev)
+        err = np.max(np.abs(H_cur - H_prev), axis=1) / np.max(np.abs(H2))
+        rat_prev = rat_cur
+
+        refine = err > tol
+        nw_new = min(np.count_nonzero(refine), max_nw - len(ww))
+        if verbose:
+            logger.info(
+                f"Adaptive sweep iteration {iter + 1}: {len(ww)} pulsations, "
+                f"max error estimate: {np.max(err)}, refining {nw_new} intervals"
+            )
+        if nw_new <= 0:
+            break
 
-            savepath = save_dir + "Hw_nw" + str(nw) + save_suffix + suffix + ".mat"
-            sio.savemat(savepath, {"H": Hw_i, "w": ww, "xs": xs_i})
-            logger.info("Saving frequency response to: %s", savepath)
+        # refine intervals with largest error first
+        idx_refine = np.argsort(-err)[:nw_new]
+        idx_refine = idx_refine[refine[idx_refine]]
+        ww_new = 10 ** logw_mid[idx_refine]
+        Hw_new = np.stack(sweep.map(get_Hw_at, ww_new), axis=-1)
 
-            fig, axs = plt.subplots(2, 1)
+        ww = np.concatenate([ww, ww_new])
+        Hw = np.concatenate([Hw, Hw_new], axis=-1)
+        order = np.argsort(ww)
+        ww, Hw = ww[order], Hw[..., order]
 
-            axs[0].grid(which="both")
-            axs[0].scatter(ww, 20 * np.log10(np.abs(Hw_i)), marker=".")
-            axs[0].set_title("Amplitude response")
-            axs[0].set_xlabel("Frequency")
-            axs[0].set_xscale("log")
+    sweep.free()
+    hw_timings = {"total": time.time() - tb, "nw": len(ww)}
+    if Hw.shape[1] == 1:
+        Hw = Hw[:, 0, :]  # 1 line = 1 sensor
 
-            axs[1].grid(which="both")
-            axs[1].scatter(ww, (180 / np.pi) * np.unwrap(np.angle(Hw_i)), marker=".")
-            axs[1].set_title("Phase response")
-            axs[1].set_xlabel("Frequency")
-            axs[1].set_xscale("log")
+    if verbose:
+        logger.info(
+            "Elapsed computing {0} pulsations: {1}".format(len(ww), hw_timings["total"])
+        )
 
-            fig.tight_layout()
-            fig.savefig(save_dir + "bodeplot_" + suffix + save_suffix + ".png")
-            plt.close(fig)
+    if save_dir:
+        save_Hw(Hw, ww, save_dir, save_suffix, xs=_get_sensor_positions(fs, C.shape[0]))
 
     return Hw, ww, hw_timings
 
 
-def get_field_response(fs, w, A=None, B=None, Q=None, verbose=True):
+def get_field_response(fs, w, A=None, B=None, Q=None, verbose=True, comm=None):
     """Get field response at frequency w
-    The field is defined by: x=inv(sQ-A)*B
-    This function should be used in get_Hw()
-    WARNING: FUNCTION UNDER WORK"""
-    if A is None:
-        A = fs.get_A()
-    if B is None:
-        B = fs.get_B()
-    if Q is None:
-        Q = fs.get_mass_matrix()
-    Acsr = dense_to_sparse(A)
-    sz = Acsr.shape[0]  # fs.W.dim()
-    Q = dense_to_sparse(Q)
-
-    # B, C
-    Bzero = np.vstack([B, np.zeros_like(B)])
-
-    # solver
-    solvR = dolfin.LUSolver("mumps")
-    Rb = PETSc.Mat()
-
-    hw_timings = {
-        "stack": 0,
-        "createAIJ": 0,
-        "createmat": 0,
-        "solve": 0,
-        "decompose": 0,
-    }
-    # 0: make block matrix (scipy)
-    # 1: create petsc matrix
-    # 2: create petsc vectors + transform to dolfin
-    # 3: solve system
-    # 4: multiply x
-    # tb = time.time()
-    # for ii, w in enumerate(ww):
-    # Block matrix
-    t00 = time.time()
-    Ablk = spr.bmat([[-Acsr, -w * Q], [w * Q, -Acsr]])
-    Ablk = Ablk.tocsr()
-    Ablk_csr = (Ablk.indptr, Ablk.indices, Ablk.data)
-    hw_timings["stack"] += -t00 + time.time()
-
-    t01 = time.time()
-    Rb.createAIJWithArrays(size=[2 * sz, 2 * sz], csr=Ablk_csr, comm=PETSc.COMM_WORLD)
-    Rb.assemblyBegin()
-    Rb.assemblyEnd()
-    hw_timings["createAIJ"] += -t01 + time.time()
-
-    # Create solution (in LHS) & RHS
-    t02 = time.time()
-    vecx, vecb = Rb.createVecs()
-    vecb.createWithArray(Bzero)
-    vecx, vecb = dolfin.PETScVector(vecx), dolfin.PETScVector(vecb)
-
-    # Casting matrix
-    Rmat = dolfin.PETScMatrix(Rb)
-    hw_timings["createmat"] += -t02 + time.time()
-
-    # Solving system
-    t03 = time.time()
-    # exitFlag = solvR.solve(Rmat, vecx, vecb)
-    solvR.solve(Rmat, vecx, vecb)
-    hw_timings["solve"] += -t03 + time.time()
-
-    # Assign to function (2 func: Re & Im)
-    return vecx.get_local()
+    The field is defined by: x=inv(jwQ-A)*B, solved on comm (default: COMM_WORLD)
+    For several frequencies, see sweep_frequencies"""
+    A, B, _, Q = _get_operators_Hw(fs, A, B, np.zeros((1, 1)), Q)
+    solver = ResolventSolver(A, Q, comm=comm)
+    solver.set_frequency(w)
+    return solver.solve(B)
 
 
 def get_Hw_lifting(
@@ -1426,19 +1632,20 @@ def get_Hw_lifting(
     So we must find: H(m/rho) = -jw * H(m/c)
     WARNING: ONLY RUNS FOR A SINGLE SENSOR (but might not even give satisfactory ans)
     """
+    from operatorgetter import OperatorGetter  # avoid circular import
+    import utils_extract as flu2
+
     # Get matrices
+    opget = OperatorGetter(fs)
     if A is None:
-        A = fs.get_A()
+        A = opget.get_A()
     if C is None:
-        C = fs.get_C()
+        C = opget.get_C()
     if Q is None:
-        Q = fs.get_mass_matrix()
-        # should we do that???
-        # [bc.apply(E) for bc in fs.bc['bcu']]
-    Q = dense_to_sparse(Q)
+        Q = opget.get_E()
 
     # Determine matrices in lifting formulation
-    Al, Bl, Cl, Ql = fs.get_matrices_lifting(A=A, C=C, Q=Q)
+    Al, Bl, Cl, Ql = flu2.get_matrices_lifting(fs, A=A, C=C, Q=Q)
 
     # Get frequency response with prescribed matrices A, B, C, D, E
     Hw_l, ww, hw_timings = get_Hw(
@@ -11,6 +11,7 @@ import scipy.linalg as la
 #import scipy as scp
 import scipy.signal as sig
 import warnings
+import freqresp_utils as fru
 #import pdb
 #try:
 #    import matlab.engine
@@ -292,6 +293,115 @@ def basis_laguerre_K00(G, K0, p, theta):
     return Q00    #, ybest
 
 
+
+class YoulaLaguerre:
+    '''Youla controllers K(theta) = K0 + lft(Psi, Q(theta)) with respect to
+    Gstab = feedback(G, K0, +1), with Youla parameter Q projected on Laguerre
+    bases, as youla_laguerre (SISO), youla_laguerre_mimo (theta with Qi on
+    each row) and youla_laguerre_K00 (if K00, SISO only).
+    Only the input matrix Bq of Q depends on theta, and it does so affinely,
+    so that the LFT is written once for all:
+        A = [A0, 0, 0; 0, Apsi, B2 Cq; 0, Bq C2, Aq + Bq D22 Cq]
+        B = [B0; B1; Bq D21],  C = [C0, C1, D12 Cq],  D = D0 + D11
+    Everything independent of theta is precomputed for (G, K0, p, N), and
+    controller matrices for new theta only cost a few small matrix products
+    (also in batch for many theta, see matrices_batch).
+    The controller has the same transfer function as the functions above
+    (states may be ordered differently).'''
+
+    def __init__(self, G, K0, p, N, K00=False):
+        Gstab = G.feedback(other=K0, sign=+1)
+        nz = Gstab.noutputs
+        p = np.atleast_1d(p) * np.ones((nz,))
+        if K00 and nz > 1:
+            raise ValueError('K00 parametrization is SISO only')
+        self.nz = nz
+        self.N = N
+        self.K00 = K00
+
+        # Laguerre bases: Q = [Phi_1 y_1, ..., Phi_nz y_nz]
+        Nq = N + 1 if K00 else N
+        Phi = [basis_laguerre_canonical_ss(pi, Nq) for pi in p]
+        Aq = la.block_diag(*[ssdata(Phi_i)[0] for Phi_i in Phi])
+        self.Bphi = [ssdata(Phi_i)[1] for Phi_i in Phi]
+        Cq = np.hstack([ssdata(Phi_i)[2] for Phi_i in Phi])
+        self.nq = Aq.shape[0]
+
+        # affine map theta -> y (K00: see basis_laguerre_K00)
+        if K00:
+            J = np.atleast_2d(np.ones((Nq,)) * (-1)**np.arange(0, Nq))
+            K00dc = control.dcgain(K0)
+            G00 = control.dcgain(Gstab)
+            a0 = -K00dc / (1+K00dc*G00) * np.sqrt(p[0]/2)
+            self.y0 = la.lstsq(J, np.reshape(a0, -1))[0]
+            self.kerJ = la.null_space(J)
+        else:
+            self.y0 = np.zeros((nz*Nq,))
+            self.kerJ = np.eye(nz*Nq)
+        self.ntheta = self.kerJ.shape[1]
+
+        # Bq(theta) = Bq0 + (Bmap @ theta).reshape(nq, nz)
+        self.Bq0 = self._Bq(self.y0)
+        self.Bmap = np.stack([self._Bq(self.kerJ[:, k]).ravel()
+                              for k in range(self.ntheta)], axis=1)
+
+        # LFT with Psi = [0, 1; I, -Gstab]
+        Psi = build_block_Psi(Gstab)
+        Apsi, Bpsi, Cpsi, Dpsi = ssdata(Psi)
+        nv = Psi.noutputs - nz
+        B1, B2 = Bpsi[:, :nz], Bpsi[:, nz:]
+        C1, C2 = Cpsi[:nv], Cpsi[nv:]
+        D11, D12 = Dpsi[:nv, :nz], Dpsi[:nv, nz:]
+        D21, D22 = Dpsi[nv:, :nz], Dpsi[nv:, nz:]
+        if isinstance(K0, control.StateSpace):
+            A0, B0, C0, D0 = ssdata(K0)
+        else: # static K0 (e.g. 0)
+            A0, B0, C0 = np.zeros((0, 0)), np.zeros((0, nz)), np.zeros((nv, 0))
+            D0 = K0 * np.ones((nv, nz))
+        n0, npsi = A0.shape[0], Apsi.shape[0]
+
+        self.A = la.block_diag(A0, Apsi, Aq)
+        self.A[n0:n0+npsi, n0+npsi:] = B2 @ Cq
+        self.B = np.vstack((B0, B1, np.zeros((self.nq, nz))))
+        self.C = np.hstack((C0, C1, D12 @ Cq))
+        self.D = D0 + D11
+        self.R = np.hstack((C2, D22 @ Cq)) # A[-nq:, n0:] += Bq @ R
+        self.D21 = D21 # B[-nq:] = Bq @ D21
+        self.n0 = n0
+
+    def _Bq(self, y):
+        '''Input matrix of Q for Laguerre coordinates y (see basis_laguerre_ss)'''
+        y = np.reshape(y, (self.nz, -1))
+        return la.block_diag(*[(Bphi_i @ y_i)[:, None]
+                               for Bphi_i, y_i in zip(self.Bphi, y)])
+
+    def matrices_batch(self, theta):
+        '''Controller matrices for a batch of parameters theta (nb, ntheta),
+        with MIMO theta flattened row-wise (nb, nz*N)
+        Return A (nb, n, n), B (nb, n, ny), C (nb, nu, n), D (nb, nu, ny)'''
+        theta = np.reshape(theta, (-1, self.ntheta))
+        nb, nq = theta.shape[0], self.nq
+        Bq = self.Bq0 + (theta @ self.Bmap.T).reshape(nb, nq, self.nz)
+        A = np.repeat(self.A[None], nb, axis=0)
+        B = np.repeat(self.B[None], nb, axis=0)
+        A[:, -nq:, self.n0:] += Bq @ self.R
+        B[:, -nq:] = Bq @ self.D21
+        C = np.repeat(self.C[None], nb, axis=0)
+        D = np.repeat(self.D[None], nb, axis=0)
+        return A, B, C, D
+
+    def matrices(self, theta):
+        '''Controller matrices A, B, C, D for parameter theta'''
+        return tuple(M[0] for M in self.matrices_batch(theta))
+
+    def controller(self, theta):
+        '''Controller K(theta) as control.StateSpace'''
+        return control.StateSpace(*self.matrices(theta))
+
+    def controllers(self, theta):
+        '''List of controllers for a batch of parameters theta (nb, ntheta)'''
+        return [control.StateSpace(*M) for M in zip(*self.matrices_batch(theta))]
+
 def youla_lqg(G, Qx, Ru, Qv, Rw, Q):
     '''Youla controller in LQG form'''
     # K0 = lft(J, 0)
@@ -578,11 +688,9 @@ def sigma_trivial(G, w):
     """sigma_trivial(G,w) -> s
     G - LTI object, order n
     w - frequencies, length m
-    s - (m,n) array of singular values of G(1j*w)"""
-    m, p, _ = G.freqresp(w)
-    sjw = (m*np.exp(1j*p)).transpose(2, 0, 1)
-    sv = np.linalg.svd(sjw, compute_uv=False)
-    return sv
+    s - (m,n) array of singular values of G(1j*w)
+    Frequency response from Hessenberg form (see freqresp_utils.sigma)"""
+    return fru.sigma(*ssdata(G), w)[0]
 
 
 def controller_residues(real_c=[], real_p=[], cplx_c=[], cplx_p=[]):
@@ -686,6 +794,118 @@ def test_controller_residues(n_real, n_cplx):
     return K1, K2
 
 
+
+def test_youla_laguerre_lft():
+    '''Test equivalence of YoulaLaguerre with youla_laguerre, youla_laguerre_mimo
+    and youla_laguerre_K00 (frequency responses on a grid, random theta)'''
+    rand = np.random.randn
+    w = np.logspace(-2, 2, 20)
+    def dresp(K1, K2):
+        return np.max([np.max(np.abs(control.evalfr(K1, 1j*wi)
+                                     - control.evalfr(K2, 1j*wi))) for wi in w])
+
+    # SISO
+    G = control.tf2ss(control.tf([1, 2], [1, 0.5, 4]))
+    K0 = control.tf2ss(control.tf([-3], [1, 5]))
+    p, N = 3.0, 4
+    theta = rand(N)
+    Ky = YoulaLaguerre(G, K0, p, N)
+    print('SISO diff = ', dresp(youla_laguerre(G, K0, p, theta), Ky.controller(theta)))
+    Ky00 = YoulaLaguerre(G, K0, p, N, K00=True)
+    print('K00 diff = ', dresp(youla_laguerre_K00(G, K0, p, theta),
+                               Ky00.controller(theta)))
+
+    # SIMO plant, MISO controller
+    G2 = control.StateSpace([[0.2, 1], [-1, -0.3]], [[0], [1]],
+                            [[1, 0], [0.5, 1]], np.zeros((2, 1)))
+    K02 = control.StateSpace([[-4]], [[1, 0.5]], [[-2]], np.zeros((1, 2)))
+    p2 = [2.0, 5.0]
+    theta2 = rand(2, N)
+    Ky2 = YoulaLaguerre(G2, K02, p2, N)
+    print('MIMO diff = ', dresp(youla_laguerre_mimo(G2, K02, p2, theta2),
+                                Ky2.controller(theta2)))
+
+    # batch
+    thetas = rand(10, N)
+    Klist = Ky.controllers(thetas)
+    print('Batch diff = ', np.max([dresp(youla_laguerre(G, K0, p, th), Kb)
+                                   for th, Kb in zip(thetas, Klist)]))
+    return Ky, Ky00, Ky2
+
+
+def test_freqresp_utils(n_sys=5, n=6, ny=2, nu=3, rtol=1e-5):
+    '''Test freqresp_utils (used by norm, sigma_trivial) against control.freqresp
+    and the dense BBBS algorithm (norm_bbbs) on random stable MIMO systems
+    with D != 0 (and D = 0 for H2 norms)'''
+    w = np.logspace(-2, 2, 50)
+    err_freqresp, err_hinf, err_h2 = [], [], []
+    for _ in range(n_sys):
+        G = control.rss(n, ny, nu)
+        G = control.StateSpace(G.A, G.B, G.C, np.random.randn(ny, nu))
+        mag, phase, _ = control.freqresp(G, w)
+        Hw_ref = np.reshape(mag * np.exp(1j * phase), (ny, nu, len(w)))
+        Hw = fru.freqresp(*ssdata(G), w)[0].transpose(1, 2, 0)
+        err_freqresp.append(np.max(np.abs(Hw - Hw_ref)) / np.max(np.abs(Hw_ref)))
+        hinf_ref = norm_bbbs(G)
+        err_hinf.append(np.abs(norm(G) - hinf_ref) / hinf_ref)
+        G0 = control.StateSpace(G.A, G.B, G.C, np.zeros((ny, nu)))
+        h2_ref = norm_bbbs(G0, p=2)
+        err_h2.append(np.abs(norm(G0, p=2) - h2_ref) / h2_ref)
+    print('freqresp max relative diff = ', np.max(err_freqresp))
+    print('Hinf norm max relative diff = ', np.max(err_hinf))
+    print('H2 norm max relative diff = ', np.max(err_h2))
+    assert np.max(err_freqresp) <= 1e-10
+    assert np.max(err_hinf) <= rtol
+    assert np.max(err_h2) <= 1e-10
+    return err_freqresp, err_hinf, err_h2
+
+
+def test_screen_controllers(n_controllers=20, rtol=1e-2):
+    '''Test batched closed-loop screening of freqresp_utils on a population of
+    Youla controllers (YoulaLaguerre.matrices_batch): closed-loop poles of
+    feedback_batch against control.feedback, and stability margins of
+    screen_controllers (loop_margins) against control.stability_margins
+    (gain and phase margins among all crossings, modulus margin)'''
+    G = control.tf2ss(control.tf([1, 2], [1, 0.5, 4]))
+    K0 = control.tf2ss(control.tf([-3], [1, 5]))
+    Ky = YoulaLaguerre(G, K0, p=3.0, N=4)
+    thetas = np.random.randn(n_controllers, Ky.ntheta)
+    AK, BK, CK, DK = Ky.matrices_batch(thetas)
+    Klist = Ky.controllers(thetas)
+
+    # closed-loop poles
+    Acl = fru.feedback_batch(G, AK, BK, CK, DK, sign=+1)
+    err_poles = 0.0
+    for Acl_k, K in zip(Acl, Klist):
+        poles = la.eigvals(Acl_k)
+        poles_ref = control.pole(control.feedback(G, K, +1))
+        dist = np.abs(poles[:, None] - poles_ref[None, :])
+        err_poles = max(err_poles, np.max(np.min(dist, axis=1)),
+                        np.max(np.min(dist, axis=0)))
+    print('Closed-loop poles max diff = ', err_poles)
+    assert err_poles <= 1e-6
+
+    # margins of L = -K G (negative feedback 1 + L, sign=+1)
+    w = np.logspace(-2, 3, 20000)
+    res = fru.screen_controllers(G, (AK, BK, CK, DK), w, sign=+1)
+    n_checked = 0
+    for k, K in enumerate(Klist):
+        if not res['accepted'][k]:
+            continue
+        gms, pms, sms, _, _, _ = control.stability_margins(
+            control.series(G, -K), returnall=True)
+        gm_ref = np.min(np.abs(np.log(gms))) if len(gms) else np.inf
+        pm_ref = np.min(np.abs(pms)) if len(pms) else np.inf
+        sm_ref = np.min(sms)
+        assert np.isclose(np.abs(np.log(res['gm'][k])), gm_ref, rtol=rtol, atol=rtol)
+        assert np.isclose(np.abs(res['pm'][k]), pm_ref, rtol=rtol, atol=rtol)
+        assert np.isclose(res['mm'][k], sm_ref, rtol=rtol)
+        n_checked += 1
+    print('Margins consistent with control.stability_margins for ',
+          n_checked, '/', n_controllers, ' accepted controllers')
+    return res
+
+
 def rncf(G):
     '''Compute right normalized coprime factorization
     G = Nr * inv(Mr)
@@ -998,19 +1218,34 @@ def make_tf_real(G):
 
 
 def compare_controllers(K1, K2):
-    '''Compare controllers of same shape with eigenvalues(A) and dcgain
-    No hinfnorm function seem to exist in Python (otherwise compute hinfnorm(K1-K2))'''
+    '''Compare controllers of same shape with Hinf norms and dcgain, with the
+    Hessenberg frequency responses of freqresp_utils (see norm)'''
     #eig1 = la.eig(K1.A)[0]
     #eig2 = la.eig(K2.A)[0]
     #deig = eig1 - eig2
     print('Comparing controllers...')
     print('\t hinfnorm diff = ', norm(K1) - norm(K2))
     #print('\t dEig norm =', la.norm(deig))
-    print('\t dcgains diff =', control.dcgain(K1) - control.dcgain(K2))
+    dcgain1 = fru.freqresp(*ssdata(K1), [0.0])[0, 0]
+    dcgain2 = fru.freqresp(*ssdata(K2), [0.0])[0, 0]
+    print('\t dcgains diff =', np.real(dcgain1 - dcgain2))
     #return K1, K2
 
 
 def norm(G, p=np.inf, hinf_tol=1e-6, eig_tol=1e-8):
+    '''Hinf (p=np.inf) or H2 (p=2) norm of StateSpace G, with freqresp_utils
+    (hinfnorm: BBBS on Hessenberg form, h2norm: Lyapunov equation), inf if G is
+    unstable (or if D != 0 for H2). See norm_bbbs for the former dense
+    implementation, kept for reference (see test_freqresp_utils)'''
+    if p not in (2, np.inf):
+        raise ValueError('The p in p-norm is not 2 or infinity. If you'
+                         ' tried the string \'inf\', use "np.inf" instead')
+    if p == 2:
+        return fru.h2norm(*ssdata(G))[0]
+    return fru.hinfnorm(*ssdata(G), hinf_tol=hinf_tol, eig_tol=eig_tol)[0][0]
+
+
+def norm_bbbs(G, p=np.inf, hinf_tol=1e-6, eig_tol=1e-8):
     """
     Code adapted from HAROLD control package in Python
     https://github.com/ilayn/harold/blob/master/harold/_system_props.py
@@ -1161,56 +1396,94 @@ def norm(G, p=np.inf, hinf_tol=1e-6, eig_tol=1e-8):
         return (gamma_lb + gamma_ub)/2
 
 
-def condswitch(ur, yr, K, dt, w_y, w_u, w_decay):
+def condswitch_matrices(A, B, C, D, r):
+    """Forward propagation matrices of discrete-time controller (A, B, C, D)
+    on r steps, from state x0 and inputs y_0...y_{r-1}:
+        [u_0; ...; u_{r-1}] = O x0 + T [y_0; ...; y_{r-1}]
+        x_r = Ar x0 + Cr [y_0; ...; y_{r-1}]
+    O = [C; CA; ...] and T (block Toeplitz of Markov parameters D, CB, CAB...)
+    are built by recursive products (no matrix inverse nor power)
+    Return O (r*nu, n), T (r*nu, r*ny), Ar (n, n), Cr (n, r*ny)"""
+    n = A.shape[0]
+    nu, ny = D.shape
+    CAk = np.empty((r, nu, n)) # C A^k
+    AkB = np.empty((r, n, ny)) # A^k B
+    CAk[0], AkB[0] = C, B
+    Ar = A.copy() # A^k
+    for k in range(1, r):
+        CAk[k] = CAk[k-1] @ A
+        AkB[k] = A @ AkB[k-1]
+        Ar = Ar @ A
+
+    markov = np.concatenate((D[None], CAk[:-1] @ B)) # D, CB, CAB...
+    lag = np.arange(r)[:, None] - np.arange(r)[None, :]
+    T = np.where((lag >= 0)[:, :, None, None], markov[np.maximum(lag, 0)], 0)
+    T = T.transpose(0, 2, 1, 3).reshape(r*nu, r*ny)
+    O = CAk.reshape(r*nu, n)
+    Cr = np.flip(AkB, axis=0).transpose(1, 0, 2).reshape(n, r*ny)
+    return O, T, Ar, Cr
+
+
+class CondSwitch:
+    """Controller conditionning for switching as per Paxman phd:
+    find the state of controller K compatible with past signals (ur, yr)
+    of the loop, i.e. if the signals had been (ur, yr), what would the
+    controller state be? Fictitious inputs yhat and initial state x0 of the
+    window are fitted in the weighted least-squares sense:
+        min w_u |O x0 + T yhat - ur|^2 + w_y |yhat - yr|^2
+    with exponential forgetting w_decay^(r-1-k) of sample k (last sample has
+    weight 1). The problem matrix only depends on (K, dt, r, weights), so
+    its QR factorization is computed once and reused at each switch.
+    K is discretized as in Controller.step (zero-order hold) by default.
+    Signals are (r, ny) and (r, nu), oldest first, with ur[k] = K(yr[k])
+    at time step k (as in Controller.step).
+    Requires r*nu >= order of K (observable K)."""
+
+    def __init__(self, K, dt, r, w_y, w_u, w_decay, method='zoh'):
+        Kd = control.c2d(K, dt, method)
+        A, B, C, D = ssdata(Kd)
+        self.r = r
+        self.nu, self.ny = D.shape
+        n = A.shape[0]
+        O, T, self.Ar, self.Cr = condswitch_matrices(A, B, C, D, r)
+        self.O, self.T = O, T
+
+        # Build weight matrix (diagonal)
+        decay = w_decay**np.flip(np.arange(0, r))
+        self.wu = np.repeat(w_u * decay, self.nu)
+        self.wy = np.repeat(w_y * decay, self.ny)
+        # unknowns z = [x0, yhat]
+        Asol = np.block([[self.wu[:, None] * O, self.wu[:, None] * T],
+                         [np.zeros((r*self.ny, n)), np.diag(self.wy)]])
+        self.Q, self.R = la.qr(Asol, mode='economic')
+        self.n = n
+
+    def __call__(self, ur, yr):
+        """Return conditioned state xn (after last sample), fictitious
+        inputs yhat (r, ny) and corresponding outputs uhat (r, nu)"""
+        Ur = np.reshape(ur, (-1,))
+        Yr = np.reshape(yr, (-1,))
+        bsol = np.hstack((self.wu * Ur, self.wy * Yr))
+        sol = la.solve_triangular(self.R, self.Q.T @ bsol)
+        x0, yhat = sol[:self.n], sol[self.n:]
+        xn = self.Ar @ x0 + self.Cr @ yhat
+        uhat = self.O @ x0 + self.T @ yhat
+        return xn, yhat.reshape(self.r, self.ny), uhat.reshape(self.r, self.nu)
+
+
+def condswitch(ur, yr, K, dt, w_y, w_u, w_decay, method='zoh'):
     """Controller conditionning for switching as per Paxman phd
-    Find signals and initial state compatible with offline controller
-    Answers the question: if the signals were (ur, yr) then what is
-    the controller state compatible with those?
-    Problem: requires ur, yr which are past signals, 
-    so we will need to get timeseries.csv"""
-    # Discretize
-    Kd = control.c2d(K, dt, 'tustin')
-    A, B, C, D = control.ssdata(Kd)
-
-    # Format input
-    r = len(ur)
-    Ur = ur.reshape(-1,)
-    Yr = yr.reshape(-1,)
-    n = Kd.nstates
-
-    # Build propagation matrices
-    invA = np.linalg.inv(A)
-    Gamma_r = np.zeros((r, n))
-    Gamma_r[0, :] = C@invA
-    for ii in range(r-1): # 0 to r-1, update row ii+1
-        Gamma_r[ii+1, :] = Gamma_r[ii, :]@invA
-
-    Tr = np.zeros((r, r))
-    Tr0 = np.zeros((r, 1)) # 1st col
-    for ii in range(r):
-        Tr0[ii] = C @ invA**(ii+1) @ B
-    Tr0[0] += np.asarray(-D).ravel()
-
-    # fill columns of Tr
-    Tr[:, 0] = Tr0.ravel() # first col
-    for jj in range(1, r): # rest of col (because Tr0[:-0]=empty)
-        Tr[:, jj] = np.vstack((np.zeros((jj, 1)), Tr0[:-jj])).ravel()
-    
-    # Build weight matrix
-    W_decay = np.diag(w_decay**np.flip(np.arange(0,r))) 
-    W = la.block_diag(w_y*np.eye(r), w_u*np.eye(r))
-    W *= la.block_diag(W_decay, W_decay)
-
-    # Solve backwards-prediction problem
-    Asol = W@np.block([[-Tr, Gamma_r], [np.eye(Tr.shape[0]), np.zeros(Gamma_r.shape)]]) 
-    bsol = W@np.hstack((Ur, Yr))
-    sol = np.linalg.lstsq(Asol, bsol, rcond=None)[0]
-
-    # Extract solution
-    xn = sol[-n:]
-    yhat = sol[:r]
-    uhat = Gamma_r@xn - Tr@yhat
-    return xn, yhat, uhat
+    (see CondSwitch, which keeps the factorization for several switches)
+    ur (r, nu), yr (r, ny): past signals, oldest first
+    Return conditioned state xn, yhat, uhat
+    Note: this function used to discretize K with method='tustin' and to take
+    the signals most recent first (backward prediction with inv(A), which
+    requires A invertible); it now defaults to method='zoh' (consistent with
+    Controller.step) and takes the signals oldest first (forward prediction).
+    Callers relying on the former behavior must pass method='tustin' and
+    flip ur, yr along their first axis."""
+    r = np.shape(ur)[0]
+    return CondSwitch(K, dt, r, w_y, w_u, w_decay, method=method)(ur, yr)
 
 
 def export_controller(filename, K):
@@ -1245,6 +1518,21 @@ if __name__=='__main__':
     print('Testing residues formula:')
     K1, K2 = test_controller_residues(n_real=2, n_cplx=1)
 
+    # Check precomputed Youla LFT
+    print('*'*50)
+    print('Testing Youla LFT with Laguerre basis:')
+    test_youla_laguerre_lft()
+
+    # Check Hessenberg frequency responses and norms
+    print('*'*50)
+    print('Testing frequency responses and norms:')
+    test_freqresp_utils()
+
+    # Check batched closed-loop screening
+    print('*'*50)
+    print('Testing closed-loop screening:')
+    test_screen_controllers()
+
     # Check MIMO (dummy system)
     print('*'*50)
     print('Testing MIMO stacking')